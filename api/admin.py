@@ -1,16 +1,35 @@
 from django.contrib import admin
-from .models import Bus, Seat, Booking, BookedSeat
+from .models import Bus, Schedule, Seat, SeatLayout, Booking, BookedSeat
 
 @admin.register(Bus)
 class BusAdmin(admin.ModelAdmin):
-    list_display = ('bus_number', 'source', 'destination', 'departure_time', 'arrival_time', 'has_sleeper')
+    list_display = ('bus_number', 'source', 'destination', 'departure_time', 'arrival_time', 'has_sleeper', 'layout', 'schedule')
     search_fields = ('bus_number', 'source', 'destination')
     list_filter = ('has_sleeper', 'departure_time')
 
+@admin.register(Schedule)
+class ScheduleAdmin(admin.ModelAdmin):
+    # Edits apply to trips created from now on; trips already created keep their own copy
+    list_display = ('bus_number', 'source', 'destination', 'departure', 'days_of_week', 'starts_on', 'ends_on', 'is_active')
+    search_fields = ('bus_number', 'source', 'destination')
+    list_filter = ('is_active', 'layout')
+
+class SeatInline(admin.TabularInline):
+    model = Seat
+    extra = 0
+
+@admin.register(SeatLayout)
+class SeatLayoutAdmin(admin.ModelAdmin):
+    # Custom coaches get their seats here; every trip on the template is recounted on save
+    list_display = ('name', 'kind', 'total_rows')
+    list_filter = ('kind',)
+    search_fields = ('name',)
+    inlines = [SeatInline]
+
 @admin.register(Seat)
 class SeatAdmin(admin.ModelAdmin):
-    list_display = ('seat_number', 'bus', 'seat_type', 'row', 'column')
-    list_filter = ('seat_type', 'bus')
+    list_display = ('seat_number', 'layout', 'seat_type', 'row', 'column')
+    list_filter = ('seat_type', 'layout')
     search_fields = ('seat_number',)
 
 @admin.register(Booking)
@@ -21,5 +40,5 @@ class BookingAdmin(admin.ModelAdmin):
 
 @admin.register(BookedSeat)
 class BookedSeatAdmin(admin.ModelAdmin):
-    list_display = ('booking', 'seat')
+    list_display = ('booking', 'bus', 'seat')
     search_fields = ('booking__id', 'seat__seat_number')
@@ -0,0 +1,145 @@
+import functools
+import json
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+
+from .authentication import CachedJWTAuthentication
+from .cache import ENCODINGS, seat_map_cache
+from .conditional import bus_etag, listing_etag, not_modified, tag_response
+from .models import Bus, Booking
+from .pagination import BusCursorPagination
+from .reservations import AlreadyCancelled, release_booking
+from .serializers import BookingSerializer, BusSerializer, get_seat_map
+
+# Async counterparts of the hot endpoints in views.py, mounted under /api/async/.
+# Django's async ORM still runs each query on the sync thread; what these save is a
+# worker thread per request while it waits. Seat events leave through the same
+# after-commit dispatcher as the sync views, so nothing here waits on the channel layer.
+
+def json_response(data, status=200):
+    return HttpResponse(JSONRenderer().render(data), content_type='application/json', status=status)
+
+async def get_jwt_user(request):
+    authentication = CachedJWTAuthentication()
+    header = authentication.get_header(request)
+    if header is None:
+        return None
+    try:
+        raw_token = authentication.get_raw_token(header)
+        if raw_token is None:
+            return None
+        token = authentication.get_validated_token(raw_token)
+        user = authentication.get_cached_user(token)
+        if user is None:
+            user = await sync_to_async(authentication.load_user)(token)
+    except (AuthenticationFailed, InvalidToken):
+        return None
+    return user
+
+def jwt_required(view):
+    # Same contract as the DRF default: IsAuthenticated via a Bearer access token
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        user = await get_jwt_user(request)
+        if user is None:
+            return json_response({"detail": "Authentication credentials were not provided."}, status=401)
+        request.user = user
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+@require_GET
+@jwt_required
+async def get_all_buses(request):
+    paginator = BusCursorPagination()
+    drf_request = Request(request)
+    page = await sync_to_async(paginator.paginate_queryset)(Bus.objects.all(), drf_request)
+    etag = listing_etag(paginator, page)
+    response = not_modified(request, etag)
+    if response is not None:
+        return tag_response(response, etag)
+    serializer = BusSerializer(page, many=True)
+    return tag_response(json_response(paginator.get_paginated_response(serializer.data).data), etag)
+
+@require_GET
+@jwt_required
+async def get_bus_details(request, bus_id):
+    try:
+        bus = await Bus.objects.aget(id=bus_id)
+    except Bus.DoesNotExist:
+        return json_response({"error": "Bus not found"}, status=404)
+
+    etag = bus_etag('bus', bus)
+    response = not_modified(request, etag)
+    if response is not None:
+        return tag_response(response, etag)
+    return tag_response(json_response(BusSerializer(bus).data), etag)
+
+@require_GET
+@jwt_required
+async def get_bus_seats(request, bus_id):
+    try:
+        bus = await Bus.objects.aget(id=bus_id)
+    except Bus.DoesNotExist:
+        return json_response({"error": "Bus not found"}, status=404)
+
+    encoding = request.GET.get('encoding', 'json')
+    if encoding not in ENCODINGS:
+        return json_response({"error": f"Unknown encoding '{encoding}'"}, status=400)
+
+    etag = bus_etag('seats', bus, encoding)
+    response = not_modified(request, etag)
+    if response is not None:
+        return tag_response(response, etag)
+
+    entry = seat_map_cache.get(bus.id, bus.seat_version, encoding)
+    if entry is None:
+        entry = await sync_to_async(get_seat_map)(bus, encoding)
+    return tag_response(HttpResponse(entry[1], content_type='application/json'), etag)
+
+@csrf_exempt
+@require_POST
+@jwt_required
+async def book_seats(request):
+    try:
+        data = json.loads(request.body or b'{}')
+    except ValueError:
+        return json_response({"error": "Invalid JSON body"}, status=400)
+
+    serializer = BookingSerializer(data=data, context={'request': request})
+
+    def create():
+        # Validation, the reservation transaction and rendering all touch the DB
+        if not serializer.is_valid():
+            return serializer.errors, 400
+        try:
+            serializer.save()
+        except Exception as e:
+            return {"error": str(e)}, 400
+        return serializer.data, 201
+
+    body, status = await sync_to_async(create)()
+    return json_response(body, status=status)
+
+@csrf_exempt
+@require_POST
+@jwt_required
+async def cancel_booking(request, booking_id):
+    try:
+        booking = await Booking.objects.aget(id=booking_id, user=request.user)
+    except Booking.DoesNotExist:
+        return json_response({"error": "Booking not found"}, status=404)
+
+    if booking.status == 'CANCELLED':
+        return json_response({"error": "Booking is already cancelled"}, status=400)
+
+    try:
+        await sync_to_async(release_booking)(booking)
+    except AlreadyCancelled as e:
+        return json_response({"error": str(e)}, status=400)
+    return json_response({"message": "Booking cancelled successfully"})
@@ -0,0 +1,65 @@
+from urllib.parse import parse_qs
+from channels.middleware import BaseMiddleware
+from django.contrib.auth.models import AnonymousUser
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from .cache import token_user_cache
+
+def token_user_id(validated_token):
+    try:
+        # Claims may carry the id as an int or a string; signals.py evicts by str(pk)
+        return str(validated_token[jwt_settings.USER_ID_CLAIM])
+    except KeyError as e:
+        raise InvalidToken(_("Token contained no recognizable user identification")) from e
+
+def check_revoked(user, validated_token):
+    if jwt_settings.CHECK_REVOKE_TOKEN and validated_token.get(
+        jwt_settings.REVOKE_TOKEN_CLAIM
+    ) != get_md5_hash_password(user.password):
+        raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+
+class CachedJWTAuthentication(JWTAuthentication):
+    # JWTAuthentication with the User lookup served from token_user_cache. Only users
+    # that passed the stock checks are cached, and saving one evicts it
+    def get_user(self, validated_token):
+        return self.get_cached_user(validated_token) or self.load_user(validated_token)
+
+    def get_cached_user(self, validated_token):
+        user = token_user_cache.get(token_user_id(validated_token))
+        if user is not None:
+            check_revoked(user, validated_token)
+        return user
+
+    def load_user(self, validated_token):
+        user = super().get_user(validated_token)
+        token_user_cache.put(token_user_id(validated_token), user)
+        return user
+
+class JWTAuthMiddleware(BaseMiddleware):
+    # WebSocket counterpart of CachedJWTAuthentication. Browsers cannot set headers on a
+    # WebSocket, so the access token may also come as ?token=. scope['user'] is a
+    # TokenUser built from the token's claims, so admission never touches the database;
+    # a user deactivated after the token was issued keeps read access until it expires.
+    async def __call__(self, scope, receive, send):
+        scope = dict(scope, user=self.get_user(scope))
+        return await self.inner(scope, receive, send)
+
+    def get_user(self, scope):
+        authentication = CachedJWTAuthentication()
+        raw_token = parse_qs(scope.get('query_string', b'').decode()).get('token', [None])[-1]
+        try:
+            if raw_token is None:
+                headers = dict(scope.get('headers', ()))
+                header = headers.get(b'authorization')
+                raw_token = header and authentication.get_raw_token(header)
+            if not raw_token:
+                return AnonymousUser()
+            token = authentication.get_validated_token(raw_token)
+            token_user_id(token)  # Rejects tokens without a user id
+        except (AuthenticationFailed, InvalidToken):
+            return AnonymousUser()
+        return jwt_settings.TOKEN_USER_CLASS(token)
@@ -0,0 +1,139 @@
+import random
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.utils import timezone
+
+from .models import BookedSeat, Booking, Bus, SeatLayout
+
+
+@contextmanager
+def scratch_database(path=None):
+    # Benchmarks seed lots of rows, so run them against a throwaway test database. SQLite
+    # test databases live in memory unless given a path; concurrent writers need a file,
+    # since the shared in-memory cache fails on a locked table instead of waiting
+    setup_test_environment()
+    old_name = connection.settings_dict['NAME']
+    test_settings = connection.settings_dict['TEST']
+    old_test_name = test_settings.get('NAME')
+    if path is not None:
+        test_settings['NAME'] = path
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        test_settings['NAME'] = old_test_name
+        teardown_test_environment()
+
+
+def time_calls(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def create_bus(total_rows=10, has_sleeper=True, **kwargs):
+    # A Bangalore-Chennai trip leaving tomorrow; used by the tests as well as the benchmarks
+    departure = kwargs.pop('departure_time', timezone.now() + timedelta(days=1))
+    defaults = {
+        'bus_number': 'KA01',
+        'source': 'Bangalore',
+        'destination': 'Chennai',
+        'departure_time': departure,
+        'arrival_time': departure + timedelta(hours=6),
+        'total_rows': total_rows,
+        'has_sleeper': has_sleeper,
+        'seater_fare': Decimal('500.00'),
+        'lower_berth_fare': Decimal('800.00'),
+        'upper_berth_fare': Decimal('700.00'),
+    }
+    defaults.update(kwargs)
+    return Bus.objects.create(**defaults)
+
+
+def generate_fleet(buses, users, sleeper_ratio=0.5, occupancy=0.5, days=30, seed=42):
+    # Synthetic, reproducible data: users, buses between a handful of cities over the next
+    # days, and confirmed bookings of one to four seats taking about occupancy of each
+    # bus. Inventory columns and seat_version match the bookings, as if they had gone
+    # through reserve_seats. Returns (buses, users).
+    rng = random.Random(seed)
+    users = User.objects.bulk_create([User(username=f'bench{i}') for i in range(users)])
+    cities = ['Bangalore', 'Chennai', 'Hyderabad', 'Mumbai', 'Pune', 'Goa', 'Mysore', 'Kochi']
+    start = timezone.now().replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+
+    layouts = {}
+    fleet, groups = [], []
+    for index in range(buses):
+        has_sleeper = rng.random() < sleeper_ratio
+        total_rows = rng.randrange(8, 13)
+        if (total_rows, has_sleeper) not in layouts:
+            layout = SeatLayout.objects.standard(total_rows, has_sleeper)
+            layouts[total_rows, has_sleeper] = (layout, list(layout.seats.order_by('id').values_list('id', 'seat_type')))
+        layout, seats = layouts[total_rows, has_sleeper]
+
+        source, destination = rng.sample(cities, 2)
+        departure = start + timedelta(minutes=rng.randrange(days * 24 * 60))
+        bus = Bus(
+            bus_number=f"BENCH{index:05d}",
+            source=source,
+            destination=destination,
+            departure_time=departure,
+            arrival_time=departure + timedelta(hours=rng.randrange(4, 13)),
+            total_rows=total_rows,
+            has_sleeper=has_sleeper,
+            layout=layout,
+            seater_fare=Decimal(rng.randrange(300, 900)),
+            lower_berth_fare=Decimal(rng.randrange(700, 1500)),
+            upper_berth_fare=Decimal(rng.randrange(600, 1400)),
+        )
+        taken = rng.sample(seats, round(len(seats) * occupancy))
+        bus_groups = []
+        while taken:
+            size = rng.randint(1, 4)
+            bus_groups.append(taken[:size])
+            taken = taken[size:]
+
+        free_by_type = {}
+        for _, seat_type in seats:
+            free_by_type[seat_type] = free_by_type.get(seat_type, 0) + 1
+        for group in bus_groups:
+            for _, seat_type in group:
+                free_by_type[seat_type] -= 1
+        bus.set_initial_inventory(free_by_type)
+        bus.seat_version = len(bus_groups)
+        fleet.append(bus)
+        groups.append(bus_groups)
+    Bus.objects.bulk_create(fleet, batch_size=1000)
+
+    bookings, seat_groups = [], []
+    for bus, bus_groups in zip(fleet, groups):
+        for group in bus_groups:
+            bookings.append(Booking(
+                user=rng.choice(users),
+                bus=bus,
+                status='CONFIRMED',
+                total_fare=sum(bus.get_fare(seat_type) for _, seat_type in group),
+            ))
+            seat_groups.append(group)
+    Booking.objects.bulk_create(bookings, batch_size=1000)
+    BookedSeat.objects.bulk_create([
+        BookedSeat(booking=booking, bus=booking.bus, seat_id=seat_id)
+        for booking, group in zip(bookings, seat_groups)
+        for seat_id, _ in group
+    ], batch_size=1000)
+    return fleet, users
@@ -0,0 +1,131 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+# Every seat-map encoding a bus can be cached in; a seat change invalidates all of them
+ENCODINGS = ('json', 'bitmap')
+
+# How long an invalidation keeps turning away snapshots built before it. Builds take
+# milliseconds; after that a bus's cached entries carry its version themselves
+FLOOR_SECONDS = 60
+
+class SeatMapCache:
+    # Per-bus seat maps as pre-rendered bytes, keyed by bus id and encoding and tagged
+    # with the seat_version they were built from. Least recently used entries are
+    # evicted once the total payload size passes max_bytes.
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        # bus_id -> (oldest version still worth caching, until when), oldest first
+        self._floor = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, bus_id, version=None, encoding='json'):
+        # With a version, only an entry built from exactly that version counts
+        with self._lock:
+            entry = self._entries.get((bus_id, encoding))
+            if entry is None or (version is not None and entry[0] != version):
+                self.misses += 1
+                return None
+            self._entries.move_to_end((bus_id, encoding))
+            self.hits += 1
+            return entry
+
+    def put(self, bus_id, version, payload, encoding='json'):
+        with self._lock:
+            # A snapshot that started before the latest write must not replace it
+            old = self._entries.get((bus_id, encoding))
+            if version < self._floor.get(bus_id, (0,))[0] or (old is not None and version < old[0]):
+                return
+            if old is not None:
+                del self._entries[(bus_id, encoding)]
+                self.size -= len(old[1])
+            self._entries[(bus_id, encoding)] = (version, payload)
+            self.size += len(payload)
+            while self.size > self.max_bytes and len(self._entries) > 1:
+                (evicted_bus, _), (_, evicted) = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+                if not any((evicted_bus, other) in self._entries for other in ENCODINGS):
+                    self._floor.pop(evicted_bus, None)
+
+    def invalidate(self, bus_id, version):
+        # version is the seat_version after the write; anything older is stale
+        with self._lock:
+            now = time.monotonic()
+            while self._floor and next(iter(self._floor.values()))[1] <= now:
+                self._floor.popitem(last=False)
+            if version >= self._floor.get(bus_id, (0,))[0]:
+                self._floor.pop(bus_id, None)
+                self._floor[bus_id] = (version, now + FLOOR_SECONDS)
+            for key in ((bus_id, encoding) for encoding in ENCODINGS):
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] < version:
+                    del self._entries[key]
+                    self.size -= len(entry[1])
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._floor.clear()
+            self.size = 0
+            self.hits = 0
+            self.misses = 0
+
+seat_map_cache = SeatMapCache(settings.SEAT_MAP_CACHE_MAX_BYTES)
+
+class TokenUserCache:
+    # Active users resolved from access tokens, keyed by user id, so authenticated
+    # requests skip the User lookup. Entries expire after ttl seconds and the least
+    # recently used go once there are more than max_entries; max_entries=0 turns the
+    # cache off. Saving or deleting a user evicts it (signals.py), but only in this
+    # process, and QuerySet.update() sends no signal at all: other workers pick up a
+    # deactivation or password change within ttl, so keep it short.
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # user_id -> (expires_at, user)
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        # A copy, so one request's changes to its user never reach another's
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[0] <= time.monotonic():
+                if entry is not None:
+                    del self._entries[user_id]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return copy.copy(entry[1])
+
+    def put(self, user_id, user):
+        if not self.max_entries:
+            return
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + self.ttl, copy.copy(user))
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+token_user_cache = TokenUserCache(settings.TOKEN_USER_CACHE_MAX_ENTRIES, settings.TOKEN_USER_CACHE_TTL)
@@ -0,0 +1,40 @@
+from hashlib import md5
+from django.conf import settings
+from django.utils.cache import get_conditional_response, patch_cache_control, quote_etag
+
+# ETags for the bus endpoints. Bus.seat_version moves on every booking, cancel, hold,
+# inventory fix and bus edit, so a tag built from it changes exactly when the payload
+# can, and checking it costs one read of the Bus row and none of the seat tables.
+
+# Polled payloads: clients may keep a copy but must revalidate it every time
+REVALIDATE = {'private': True, 'no_cache': True}
+
+def bus_etag(kind, bus, *extra):
+    return quote_etag('-'.join(str(part) for part in (kind, bus.id, bus.seat_version, *extra)))
+
+def listing_etag(paginator, buses):
+    # The page's cursor links are part of the body too: a bus added after the last page
+    # gives it a next link without changing any of its rows
+    versions = ','.join(f'{bus.id}:{bus.seat_version}' for bus in buses)
+    links = f'{paginator.get_next_link()} {paginator.get_previous_link()}'
+    return quote_etag('buses-' + md5(f'{versions} {links}'.encode(), usedforsecurity=False).hexdigest())
+
+def layout_etag(bus):
+    # bus.layout must be loaded; its seats_version moves when the template's seats change
+    parts = (bus.id, bus.layout_id, bus.layout.seats_version, bus.seater_fare, bus.lower_berth_fare, bus.upper_berth_fare)
+    return quote_etag('layout-' + md5(repr(parts).encode(), usedforsecurity=False).hexdigest())
+
+def template_etag(layout):
+    return quote_etag(f'template-{layout.id}-{layout.seats_version}')
+
+def layout_cache_control():
+    return {'private': True, 'max_age': settings.BUS_LAYOUT_MAX_AGE}
+
+def not_modified(request, etag):
+    # A 304 when If-None-Match already names this etag, otherwise None
+    return get_conditional_response(request, etag=etag)
+
+def tag_response(response, etag, cache_control=REVALIDATE):
+    response['ETag'] = etag
+    patch_cache_control(response, **cache_control)
+    return response
@@ -1,45 +1,256 @@
 from channels.generic.websocket import AsyncWebsocketConsumer
+import asyncio
 import json
+import logging
+import weakref
+from collections import Counter, deque
+from urllib.parse import parse_qs
 from channels.db import database_sync_to_async
-from .models import Seat
-from .serializers import SeatSerializer
+from django.conf import settings
+from .cache import seat_map_cache
+from .metrics import instrumented, stage
+from .models import Bus
+from .serializers import build_seat_bitmap, build_seat_map
+
+logger = logging.getLogger(__name__)
+
+# One snapshot build per bus and encoding at a time; sockets that connect meanwhile wait for it
+_build_locks = weakref.WeakValueDictionary()
+
+# Clients opt into the compact seat map with this subprotocol or ?encoding=bitmap
+BITMAP_SUBPROTOCOL = 'seatmap.bitmap'
+
+# seat_update events received vs seat messages actually pushed, across all sockets
+coalescing_stats = {'events_in': 0, 'pushes_out': 0}
+
+# Close codes for refused connections (before accept, so servers send them as a 403)
+UNAUTHENTICATED = 4401
+TOO_MANY_CONNECTIONS = 4429
+
+# Close code for a socket whose writer failed; the client reconnects for a fresh snapshot
+INTERNAL_ERROR = 1011
+
+# Admitted sockets in this process, keyed ('bus', bus_id) and ('user', user_id)
+open_connections = Counter()
+
+# Stands in the outbox for a seat snapshot, built when it is actually sent
+SNAPSHOT = object()
+
+# Outgoing messages a slow client let pile up and that a snapshot made redundant
+outbox_stats = {'dropped': 0}
 
 class BusSeatConsumer(AsyncWebsocketConsumer):
+    @instrumented('ws bus-seats connect')
     async def connect(self):
         self.bus_id = self.scope['url_route']['kwargs']['bus_id']
         self.group_name = f"bus_{self.bus_id}"
+        self.admitted = []
+        self.writer_task = None
+        self.flush_task = None
+        
+        # Sockets come through JWTAuthMiddleware; one viral bus page or one client
+        # opening sockets in a loop must not exhaust the process
+        user = self.scope.get('user')
+        if user is None or not user.is_authenticated:
+            await self.close(code=UNAUTHENTICATED)
+            return
+        keys = (('bus', self.bus_id), ('user', user.id))
+        limits = (settings.WEBSOCKET_MAX_PER_BUS, settings.WEBSOCKET_MAX_PER_USER)
+        if any(limit is not None and open_connections[key] >= limit for key, limit in zip(keys, limits)):
+            await self.close(code=TOO_MANY_CONNECTIONS)
+            return
+        for key in keys:
+            open_connections[key] += 1
+        self.admitted = keys
+        
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        subprotocol = BITMAP_SUBPROTOCOL if BITMAP_SUBPROTOCOL in self.scope.get('subprotocols', []) else None
+        self.encoding = 'bitmap' if subprotocol or query.get('encoding') == ['bitmap'] else 'json'
+        
+        # Seat changes buffered until the coalescing window closes
+        self.coalesce_window = settings.SEAT_UPDATE_COALESCE_MS / 1000
+        self.sent_version = 0
+        self.pending_versions = set()
+        self.pending_seats = {}
+        self.pending_snapshot = False
+        
+        # Messages wait here for a writer task, so a client that reads slowly holds up
+        # neither the channel layer nor memory: see queue()
+        self.outbox = deque()
+        self.outbox_ready = asyncio.Event()
+        self.snapshot_version = None
         
         # Join bus group
-        await self.channel_layer.group_add(
-            self.group_name,
-            self.channel_name
-        )
+        with stage('channel'):
+            await self.channel_layer.group_add(
+                self.group_name,
+                self.channel_name
+            )
         
-        await self.accept()
+        await self.accept(subprotocol=subprotocol)
+        self.writer_task = asyncio.ensure_future(self.write_outbox())
         
         # Send initial seat status
-        await self.send_seat_status()
+        self.queue(SNAPSHOT)
     
+    @instrumented('ws bus-seats disconnect')
     async def disconnect(self, close_code):
+        for task in (self.flush_task, self.writer_task):
+            if task is not None:
+                task.cancel()
+        if not self.admitted:
+            return
+        for key in self.admitted:
+            open_connections[key] -= 1
+            if not open_connections[key]:
+                del open_connections[key]
+        self.admitted = []
+        
         # Leave bus group
-        await self.channel_layer.group_discard(
-            self.group_name,
-            self.channel_name
-        )
+        with stage('channel'):
+            await self.channel_layer.group_discard(
+                self.group_name,
+                self.channel_name
+            )
+    
+    @instrumented('ws bus-seats receive')
+    async def receive(self, text_data=None, bytes_data=None):
+        # Clients that spot a gap in delta versions ask for a fresh snapshot
+        try:
+            message = json.loads(text_data or '')
+        except ValueError:
+            return
+        if isinstance(message, dict) and message.get('type') == 'resync':
+            self.queue(SNAPSHOT)
     
     @database_sync_to_async
     def get_seat_status(self):
-        seats = Seat.objects.filter(bus_id=self.bus_id)
-        serializer = SeatSerializer(seats, many=True)
-        return serializer.data
-    
-    async def send_seat_status(self):
-        seats = await self.get_seat_status()
-        await self.send(text_data=json.dumps({
-            'type': 'seat_status',
-            'seats': seats
-        }))
+        try:
+            bus = Bus.objects.get(id=self.bus_id)
+        except Bus.DoesNotExist:
+            return 0, b'{}' if self.encoding == 'bitmap' else b'[]'
+        return build_seat_bitmap(bus) if self.encoding == 'bitmap' else build_seat_map(bus)
+    
+    @database_sync_to_async
+    def get_seat_version(self):
+        return Bus.objects.filter(id=self.bus_id).values_list('seat_version', flat=True).first()
+    
+    @instrumented('ws bus-seats snapshot')
+    async def send_seat_status(self, version=None):
+        # Every socket on this bus shares one cached, pre-rendered seat list. Only an entry
+        # for the bus's current seat_version will do: this process hears of writes made by
+        # other processes only while it has a socket open on the bus. Pushes pass the
+        # version their event carried; on connect and resync it is read from the bus row
+        if version is None:
+            version = await self.get_seat_version()
+        entry = None if version is None else seat_map_cache.get(self.bus_id, version, self.encoding)
+        if entry is None:
+            key = (self.bus_id, self.encoding)
+            lock = _build_locks.get(key)
+            if lock is None:
+                lock = _build_locks[key] = asyncio.Lock()
+            async with lock:
+                entry = None if version is None else seat_map_cache.get(self.bus_id, version, self.encoding)
+                if entry is None:
+                    entry = await self.get_seat_status()
+        version, seats = entry
+        if self.encoding == 'bitmap':
+            # The cached bitmap object already carries its version
+            await self.send(text_data='{"type": "seat_bitmap", "bitmap": %s}' % seats.decode())
+        else:
+            await self.send(
+                text_data='{"type": "seat_status", "version": %d, "seats": %s}' % (version, seats.decode())
+            )
+        self.sent_version = version
+    
+    def queue(self, message, version=None):
+        # A snapshot supersedes everything queued before it. A client that falls
+        # WEBSOCKET_SEND_QUEUE messages behind gets one snapshot in place of the backlog.
+        # version is the seat_version a snapshot must show, if a seat_update told us
+        if message is SNAPSHOT or len(self.outbox) >= settings.WEBSOCKET_SEND_QUEUE:
+            outbox_stats['dropped'] += len(self.outbox)
+            self.outbox.clear()
+            self.snapshot_version = version if message is SNAPSHOT else None
+            message = SNAPSHOT
+        self.outbox.append(message)
+        self.outbox_ready.set()
+    
+    async def write_outbox(self):
+        try:
+            while True:
+                await self.outbox_ready.wait()
+                while self.outbox:
+                    message = self.outbox.popleft()
+                    if message is SNAPSHOT:
+                        await self.send_seat_status(self.snapshot_version)
+                    else:
+                        await self.send(text_data=message)
+                self.outbox_ready.clear()
+        except Exception:
+            # Without its writer the socket would stay admitted but never hear another update
+            logger.exception("Seat socket writer for bus %s failed", self.bus_id)
+            await self.close(code=INTERNAL_ERROR)
     
     async def seat_update(self, event):
-        # Send updated seat status
-        await self.send_seat_status()
\ No newline at end of file
+        # The event also reaches consumers in other processes, so drop their stale copy
+        seat_map_cache.invalidate(event['bus_id'], event['version'])
+        coalescing_stats['events_in'] += 1
+        if event['version'] <= self.sent_version:
+            return
+        
+        # Merge into the pending push; the newest version of each seat wins.
+        # A batched event from the dispatcher covers several versions at once
+        self.pending_versions.update(event.get('versions', [event['version']]))
+        if event['seats'] is None:
+            self.pending_snapshot = True
+        for seat in event['seats'] or ():
+            pending = self.pending_seats.get(seat['id'])
+            if pending is None or pending[0] < event['version']:
+                self.pending_seats[seat['id']] = (event['version'], seat)
+        
+        if self.flush_task is None:
+            self.flush_task = asyncio.ensure_future(self.flush_seat_updates())
+    
+    async def flush_seat_updates(self):
+        await asyncio.sleep(self.coalesce_window)
+        await self.push_seat_updates()
+    
+    @instrumented('ws bus-seats push')
+    async def push_seat_updates(self):
+        self.flush_task = None
+        versions = {version for version in self.pending_versions if version > self.sent_version}
+        seats = [seat for _, seat in self.pending_seats.values()]
+        snapshot = self.pending_snapshot
+        self.pending_versions = set()
+        self.pending_seats = {}
+        self.pending_snapshot = False
+        if not versions:
+            return
+        
+        latest = max(versions)
+        if SNAPSHOT in self.outbox:
+            # Built when it is sent, so it will already show these changes
+            if self.snapshot_version is not None:
+                self.snapshot_version = max(self.snapshot_version, latest)
+            return
+        
+        coalescing_stats['pushes_out'] += 1
+        if self.encoding == 'bitmap' or snapshot:
+            # A full bitmap is smaller than most deltas, and never needs a resync; a fare or
+            # layout change cannot be sent as a delta at all
+            self.queue(SNAPSHOT, latest)
+            return
+        if versions != set(range(self.sent_version + 1, latest + 1)):
+            # Some change in between never reached us, so a delta would leave the client wrong
+            self.queue(SNAPSHOT, latest)
+            return
+        
+        # Clients apply this on top of base_version; any other base means they must resync.
+        # sent_version is what the client will have once the outbox drains
+        self.queue(json.dumps({
+            'type': 'seat_delta',
+            'base_version': self.sent_version,
+            'version': latest,
+            'seats': seats
+        }))
+        self.sent_version = latest
\ No newline at end of file
@@ -0,0 +1,143 @@
+import asyncio
+import atexit
+import logging
+import queue
+import threading
+import time
+from channels.layers import InMemoryChannelLayer, get_channel_layer
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.db import transaction
+from .cache import seat_map_cache
+from .metrics import measure, stage
+
+logger = logging.getLogger(__name__)
+
+def seat_changes(seat_ids, status):
+    # New state of each changed seat; status is the booking status now holding it, or None
+    return [
+        {'id': seat_id, 'is_booked': status is not None, 'is_held': status == 'PENDING'}
+        for seat_id in seat_ids
+    ]
+
+def seat_update_event(bus_id, version, seats, versions=None):
+    # Carry the delta so BusSeatConsumer can forward it without re-reading the seat map;
+    # versions lists every seat_version folded into it when several changes are batched.
+    # seats is None for a change no delta can express (fares, the seat layout), which
+    # consumers answer with a snapshot
+    return {
+        "type": "seat_update",
+        "bus_id": bus_id,
+        "version": version,
+        "versions": versions or [version],
+        "seats": seats,
+    }
+
+def merge_seat_updates(events):
+    # Fold queued (bus_id, versions, seats) tuples into one seat_update per bus,
+    # keeping the newest state of each seat; if any of them needs a snapshot, so does it
+    merged = {}
+    for bus_id, event_versions, seats in sorted(events, key=lambda event: event[1][-1]):
+        versions, latest = merged.setdefault(bus_id, ([], {}))
+        versions.extend(event_versions)
+        if seats is None or latest is None:
+            merged[bus_id] = (versions, None)
+            continue
+        for seat in seats:
+            latest[seat['id']] = seat
+    return {
+        bus_id: seat_update_event(bus_id, versions[-1], None if latest is None else list(latest.values()), versions)
+        for bus_id, (versions, latest) in merged.items()
+    }
+
+class SeatEventDispatcher:
+    # Sends seat_update events from a background thread, so neither a row lock nor an
+    # HTTP response waits on the channel layer. Events queued within SEAT_EVENT_BATCH_MS
+    # go out as one group_send per bus; a failed send is retried with backoff and then
+    # dropped, which consumers notice as a version gap and answer with a snapshot.
+
+    def __init__(self):
+        self.sent = 0
+        self.retried = 0
+        self.dropped = 0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def enqueue(self, bus_id, version, seats, versions=None):
+        event = (bus_id, versions or [version], seats)
+        channel_layer = get_channel_layer()
+        if not settings.SEAT_EVENTS_IN_BACKGROUND or isinstance(channel_layer, InMemoryChannelLayer):
+            # The in-memory layer only works from the event loop its readers run on
+            self.send(channel_layer, [event], lambda send, *args: async_to_sync(send)(*args))
+            return
+        self._start()
+        self._queue.put(event)
+
+    def send(self, channel_layer, events, run):
+        for bus_id, event in merge_seat_updates(events).items():
+            for attempt in range(settings.SEAT_EVENT_MAX_ATTEMPTS):
+                if attempt:
+                    self.retried += 1
+                    time.sleep(settings.SEAT_EVENT_RETRY_DELAY_MS / 1000 * 2 ** (attempt - 1))
+                try:
+                    with stage('channel'):
+                        run(channel_layer.group_send, f"bus_{bus_id}", event)
+                except Exception:
+                    logger.warning("seat_update for bus %s failed (attempt %d)", bus_id, attempt + 1, exc_info=True)
+                    continue
+                self.sent += 1
+                break
+            else:
+                self.dropped += 1
+                logger.error("Dropped seat_update for bus %s at version %s", bus_id, event['version'])
+
+    def flush(self, timeout=None):
+        # Wait until everything queued so far has been sent (or given up on)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='seat-events', daemon=True)
+                self._thread.start()
+                atexit.register(self.flush, timeout=5)
+
+    def _run(self):
+        # One event loop for the life of the thread, so the channel layer keeps its connections
+        loop = asyncio.new_event_loop()
+        run = lambda send, *args: loop.run_until_complete(send(*args))
+        while True:
+            events = [self._queue.get()]
+            time.sleep(settings.SEAT_EVENT_BATCH_MS / 1000)
+            while True:
+                try:
+                    events.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with measure('seat-events batch'):
+                    self.send(get_channel_layer(), events, run)
+            except Exception:
+                logger.exception("Seat event dispatcher failed on a batch of %d events", len(events))
+            finally:
+                for _ in events:
+                    self._queue.task_done()
+
+seat_event_dispatcher = SeatEventDispatcher()
+
+def publish_seat_update(bus_id, version, seats, versions=None):
+    # Called inside the writing transaction; the event only leaves if it commits. Every
+    # seat_version bump needs one, or sockets see a gap and fall back to snapshots;
+    # versions lists them all when one call covers several
+    def dispatch():
+        seat_map_cache.invalidate(bus_id, version)
+        seat_event_dispatcher.enqueue(bus_id, version, seats, versions)
+    transaction.on_commit(dispatch)
@@ -0,0 +1,103 @@
+import csv
+import itertools
+import json
+import time
+from contextlib import nullcontext
+from django.db import transaction
+from rest_framework import serializers
+from .models import Bus, SeatLayout
+
+# Streaming schedule import. Rows are read lazily from CSV or JSONL, validated a chunk
+# at a time and written with bulk_create. Each trip points at the stock layout template
+# for its size, so no seats are written; the layout and starting inventory are set here
+# because bulk_create never fires the pre_save signal that does it for single saves.
+
+IMPORT_FORMATS = ('csv', 'jsonl')
+
+# Invalid rows listed in the report; the rest are only counted
+MAX_REPORTED_ERRORS = 100
+
+class BusImportSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Bus
+        fields = [
+            'bus_number', 'source', 'destination', 'departure_time', 'arrival_time',
+            'total_rows', 'has_sleeper', 'seater_fare', 'lower_berth_fare', 'upper_berth_fare',
+        ]
+        extra_kwargs = {'total_rows': {'min_value': 1}}
+
+    def validate(self, data):
+        if data['arrival_time'] <= data['departure_time']:
+            raise serializers.ValidationError("arrival_time must be after departure_time")
+        return data
+
+def import_format(filename):
+    # 'schedule.csv' -> 'csv'; None for anything we cannot read
+    extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    extension = 'jsonl' if extension == 'ndjson' else extension
+    return extension if extension in IMPORT_FORMATS else None
+
+def read_rows(lines, fmt):
+    # Yields (line_number, row dict) without loading the whole file
+    if fmt == 'csv':
+        reader = csv.DictReader(lines)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line_number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield line_number, row if isinstance(row, dict) else {}
+
+def import_buses(rows, batch_size=1000, dry_run=False):
+    # Returns {'rows', 'created', 'seats', 'invalid', 'errors', 'seconds', 'rows_per_sec'};
+    # invalid rows are skipped and counted, and the first MAX_REPORTED_ERRORS of them
+    # reported as {'line': n, 'errors': {...}}
+    report = {'rows': 0, 'created': 0, 'seats': 0, 'invalid': 0, 'errors': []}
+    start = time.perf_counter()
+    # A dry run still resolves templates, so it runs in one transaction that is rolled back
+    with transaction.atomic() if dry_run else nullcontext():
+        _import_chunks(iter(rows), batch_size, dry_run, report)
+        if dry_run:
+            transaction.set_rollback(True)
+
+    report['seconds'] = time.perf_counter() - start
+    report['rows_per_sec'] = report['rows'] / report['seconds'] if report['seconds'] else 0
+    return report
+
+def _import_chunks(rows, batch_size, dry_run, report):
+    # One serializer for every row; building its fields per row costs more than validating
+    validator = BusImportSerializer()
+    # (total_rows, has_sleeper) -> (template, its seat counts by type)
+    layouts = {}
+    while True:
+        chunk = list(itertools.islice(rows, batch_size))
+        if not chunk:
+            break
+        report['rows'] += len(chunk)
+
+        buses = []
+        for line_number, row in chunk:
+            try:
+                bus = Bus(**validator.run_validation(row))
+            except serializers.ValidationError as e:
+                report['invalid'] += 1
+                if len(report['errors']) < MAX_REPORTED_ERRORS:
+                    report['errors'].append({'line': line_number, 'errors': e.detail})
+                continue
+            key = (bus.total_rows, bus.has_sleeper)
+            if key not in layouts:
+                layout = SeatLayout.objects.standard(*key)
+                layouts[key] = (layout, layout.seat_type_counts())
+            bus.layout, seat_type_counts = layouts[key]
+            bus.set_initial_inventory(seat_type_counts)
+            buses.append(bus)
+        if buses and not dry_run:
+            with transaction.atomic():
+                Bus.objects.bulk_create(buses)
+        report['created'] += len(buses)
+        report['seats'] += sum(bus.free_seats for bus in buses)
@@ -0,0 +1,150 @@
+import threading
+from bisect import bisect_left, insort
+from collections import namedtuple
+from datetime import timedelta
+from operator import attrgetter
+from django.utils import timezone
+from .models import Bus
+
+# Journey planning over an in-memory connection graph. Every future trip is indexed by
+# the stop it leaves from and by its (source, destination) pair, each list sorted by
+# departure time, so finding the next trips out of a stop is a bisect. The graph is
+# loaded once per process and then kept current from Bus.updated_at: each plan first
+# reads the rows saved since the previous one, which catches bulk_create imports and
+# saves made by other processes alike. Deletes are dropped after commit by a signal.
+
+Trip = namedtuple('Trip', 'id source destination departure_time arrival_time')
+
+TRIP_FIELDS = ('id', 'source', 'destination', 'departure_time', 'arrival_time')
+
+# Re-read this much before the last sync, for rows whose transaction committed after
+# a later-stamped row had already been seen
+SYNC_OVERLAP = timedelta(seconds=5)
+
+PRUNE_EVERY = timedelta(hours=1)
+
+departure_key = attrgetter('departure_time')
+trip_key = attrgetter('departure_time', 'id')
+
+class ConnectionGraph:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self._trips = {}
+        self._from = {}  # stop -> trips leaving it
+        self._routes = {}  # (source, destination) -> direct trips
+        self._synced_at = None
+        self._pruned_at = None
+
+    def __len__(self):
+        return len(self._trips)
+
+    def sync(self):
+        now = timezone.now()
+        with self._lock:
+            if self._synced_at is None:
+                rows = Bus.objects.filter(departure_time__gte=now)
+            else:
+                rows = Bus.objects.filter(updated_at__gte=self._synced_at - SYNC_OVERLAP)
+            for row in rows.values_list(*TRIP_FIELDS).iterator():
+                self._put(Trip(*row))
+            self._synced_at = now
+            if self._pruned_at is None or now - self._pruned_at > PRUNE_EVERY:
+                self._prune(now)
+                self._pruned_at = now
+
+    def discard(self, trip_id):
+        with self._lock:
+            trip = self._trips.pop(trip_id, None)
+            if trip is not None:
+                self._remove(self._from[trip.source], trip)
+                self._remove(self._routes[trip.source, trip.destination], trip)
+
+    def plan(self, source, destination, departure_after, departure_before, max_transfers=2,
+             min_layover=timedelta(minutes=30), max_duration=timedelta(hours=24), limit=20):
+        # Itineraries (tuples of Trips) leaving source in the window and reaching destination
+        # within max_duration, earliest arrival first
+        found = []
+        with self._lock:
+            for first in self._departing(self._from.get(source, ()), departure_after, departure_before):
+                if first.destination == source:
+                    continue
+                self._extend((first,), destination, max_transfers, min_layover, first.departure_time + max_duration, found)
+        found.sort(key=lambda legs: (legs[-1].arrival_time, len(legs), legs[0].departure_time))
+        return found[:limit]
+
+    def _extend(self, legs, destination, transfers_left, min_layover, deadline, found):
+        last = legs[-1]
+        if last.arrival_time > deadline:
+            return
+        if last.destination == destination:
+            found.append(legs)
+            return
+        if not transfers_left:
+            return
+        ready = last.arrival_time + min_layover
+        if transfers_left == 1:
+            # Only a direct trip can finish; the first one out that still arrives in time
+            for trip in self._departing(self._routes.get((last.destination, destination), ()), ready, deadline):
+                if trip.arrival_time <= deadline:
+                    found.append(legs + (trip,))
+                    return
+            return
+        visited = {leg.source for leg in legs}
+        for trip in self._departing(self._from.get(last.destination, ()), ready, deadline):
+            if trip.destination in visited:
+                continue
+            # Skip stops with no direct trip on to the destination
+            if trip.destination != destination and not self._routes.get((trip.destination, destination)):
+                continue
+            self._extend(legs + (trip,), destination, transfers_left - 1, min_layover, deadline, found)
+
+    def _departing(self, trips, after, before):
+        start = bisect_left(trips, after, key=departure_key)
+        end = bisect_left(trips, before, lo=start, key=departure_key)
+        return trips[start:end]
+
+    def _put(self, trip):
+        old = self._trips.get(trip.id)
+        if old == trip:
+            return
+        if old is not None:
+            self._remove(self._from[old.source], old)
+            self._remove(self._routes[old.source, old.destination], old)
+        self._trips[trip.id] = trip
+        insort(self._from.setdefault(trip.source, []), trip, key=trip_key)
+        insort(self._routes.setdefault((trip.source, trip.destination), []), trip, key=trip_key)
+
+    def _remove(self, trips, trip):
+        index = bisect_left(trips, trip_key(trip), key=trip_key)
+        if index < len(trips) and trips[index].id == trip.id:
+            del trips[index]
+
+    def _prune(self, now):
+        # Trips that have left can never start or continue a journey
+        for index in (self._from, self._routes):
+            for key, trips in index.items():
+                gone = bisect_left(trips, now, key=departure_key)
+                for trip in trips[:gone]:
+                    self._trips.pop(trip.id, None)
+                del trips[:gone]
+
+connection_graph = ConnectionGraph()
+
+def plan_journeys(source, destination, departure_after, departure_before, min_seats=None, **options):
+    # Plans from the graph, then loads every leg in one query; itineraries with a leg
+    # that has since been deleted, or that is short of min_seats, are left out
+    connection_graph.sync()
+    itineraries = connection_graph.plan(source, destination, departure_after, departure_before, **options)
+    buses = Bus.objects.in_bulk({trip.id for legs in itineraries for trip in legs})
+    journeys = []
+    for legs in itineraries:
+        leg_buses = [buses.get(trip.id) for trip in legs]
+        if None in leg_buses:
+            continue
+        if min_seats is not None and any(bus.free_seats < min_seats for bus in leg_buses):
+            continue
+        journeys.append(leg_buses)
+    return journeys
@@ -0,0 +1,100 @@
+import asyncio
+import itertools
+import random
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient, override_settings
+from django.urls import reverse
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from api.bench import create_bus, percentile, scratch_database
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive the sync and async endpoints through the ASGI handler with many "
+        "concurrent clients and report requests/sec and p50/p99 latency for each."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=200,
+                            help='Concurrent clients per scenario')
+        parser.add_argument('--requests', type=int, default=2000,
+                            help='Requests per scenario')
+        parser.add_argument('--buses', type=int, default=50)
+        parser.add_argument('--layer', choices=list(settings.CHANNEL_LAYER_BACKENDS),
+                            default=settings.CHANNEL_LAYER_BACKEND,
+                            help='Channel layer backend the booking scenarios publish through')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        layers = {'default': settings.CHANNEL_LAYER_BACKENDS[options['layer']]}
+        with override_settings(CHANNEL_LAYERS=layers):
+            self.run(options)
+
+    def run(self, options):
+        rng = random.Random(options['seed'])
+        with scratch_database():
+            user = User.objects.create_user(username='bench')
+            headers = {'Authorization': f'Bearer {RefreshToken.for_user(user).access_token}'}
+            # Separate fleets so sync and async bookings never compete for a seat
+            fleets = {
+                flavour: [create_bus(total_rows=20, has_sleeper=False) for _ in range(options['buses'])]
+                for flavour in ('sync', 'async')
+            }
+            seats = {
+                flavour: list(itertools.chain.from_iterable(
+                    [(bus.id, seat_id) for seat_id in bus.seats.values_list('id', flat=True)] for bus in buses
+                ))
+                for flavour, buses in fleets.items()
+            }
+            for flavour in seats:
+                rng.shuffle(seats[flavour])
+
+            self.stdout.write(f"{'scenario':<22} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8}")
+            for scenario in ('seat map', 'bus details', 'book seat'):
+                for flavour, prefix in (('sync', ''), ('async', 'async-')):
+                    buses = fleets[flavour]
+                    free_seats = iter(seats[flavour])
+
+                    def request(client):
+                        if scenario == 'seat map':
+                            url = reverse(f'{prefix}bus-seats', args=[rng.choice(buses).id])
+                            return client.get(url, headers=headers)
+                        if scenario == 'bus details':
+                            url = reverse(f'{prefix}bus-details', args=[rng.choice(buses).id])
+                            return client.get(url, headers=headers)
+                        bus_id, seat_id = next(free_seats)
+                        return client.post(
+                            reverse(f'{prefix}book-seats'),
+                            {'bus': bus_id, 'seat_ids': [seat_id]},
+                            content_type='application/json',
+                            headers=headers
+                        )
+
+                    elapsed, samples = asyncio.run(
+                        self.load(request, options['clients'], options['requests'])
+                    )
+                    self.stdout.write(
+                        f"{scenario + ' (' + flavour + ')':<22} {len(samples) / elapsed:>8.0f} "
+                        f"{percentile(samples, 50) * 1000:>8.1f} {percentile(samples, 99) * 1000:>8.1f}"
+                    )
+
+    async def load(self, request, clients, total):
+        samples = []
+        remaining = iter(range(total))
+
+        async def client_loop():
+            client = AsyncClient()
+            for _ in remaining:
+                start = time.perf_counter()
+                response = await request(client)
+                samples.append(time.perf_counter() - start)
+                assert response.status_code < 300, response.content
+
+        start = time.perf_counter()
+        await asyncio.gather(*(client_loop() for _ in range(clients)))
+        return time.perf_counter() - start, samples
@@ -0,0 +1,65 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from api.bench import generate_fleet, percentile, scratch_database, time_calls
+from api.cache import token_user_cache
+
+
+class Command(BaseCommand):
+    help = (
+        "Send Bearer-token requests to authenticated endpoints with the token user "
+        "cache off and on, and report requests/sec, p50/p99 latency and queries per "
+        "request for each."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000,
+                            help='Requests per endpoint and mode')
+        parser.add_argument('--users', type=int, default=100,
+                            help='Distinct users the requests rotate through')
+
+    def handle(self, *args, **options):
+        with scratch_database():
+            fleet, users = generate_fleet(20, options['users'])
+            tokens = [f'Bearer {RefreshToken.for_user(user).access_token}' for user in users]
+            endpoints = (
+                ('get_user', reverse('get_user')),
+                ('my-bookings', reverse('my-bookings')),
+                ('bus-details', reverse('bus-details', args=[fleet[0].id])),
+                ('async-bus-details', reverse('async-bus-details', args=[fleet[0].id])),
+            )
+
+            self.stdout.write(f"{'endpoint':<20} {'cache':<6} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'queries':>8}")
+            max_entries = token_user_cache.max_entries
+            try:
+                for name, url in endpoints:
+                    for enabled in (False, True):
+                        token_user_cache.clear()
+                        token_user_cache.max_entries = max_entries if enabled else 0
+                        self.measure(name, url, tokens, enabled, options['requests'])
+            finally:
+                token_user_cache.max_entries = max_entries
+                token_user_cache.clear()
+
+    def measure(self, name, url, tokens, enabled, requests):
+        client = APIClient()
+        calls = iter(range(requests))
+
+        def call():
+            token = tokens[next(calls) % len(tokens)]
+            response = client.get(url, headers={'Authorization': token})
+            assert response.status_code == 200, response.status_code
+
+        for token in tokens:  # warm up, filling the cache when it is on
+            client.get(url, headers={'Authorization': token})
+        with CaptureQueriesContext(connection) as queries:
+            samples = time_calls(call, requests)
+        self.stdout.write(
+            f"{name:<20} {'on' if enabled else 'off':<6} {requests / sum(samples):>8.0f} "
+            f"{percentile(samples, 50) * 1000:>8.2f} {percentile(samples, 99) * 1000:>8.2f} "
+            f"{len(queries) / requests:>8.2f}"
+        )
@@ -0,0 +1,99 @@
+import asyncio
+import importlib.util
+import time
+
+from channels.layers import channel_layers, get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from api.bench import create_bus, percentile, scratch_database
+from api.events import seat_changes, seat_update_event
+from api.routing import websocket_application
+
+
+class Command(BaseCommand):
+    help = (
+        "Open N BusSeatConsumer sockets on one bus and time how long a seat_update "
+        "takes to reach them through each channel layer backend."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sockets', default='10,100,500',
+                            help='Comma-separated socket counts to measure at')
+        parser.add_argument('--rounds', type=int, default=50,
+                            help='Seat updates sent at each size')
+        parser.add_argument('--backends', default=','.join(settings.CHANNEL_LAYER_BACKENDS),
+                            help='Comma-separated keys of CHANNEL_LAYER_BACKENDS')
+        parser.add_argument('--coalesce-ms', type=int, default=0,
+                            help='SEAT_UPDATE_COALESCE_MS for the sockets; 0 measures raw fan-out')
+
+    def handle(self, *args, **options):
+        sizes = sorted(int(size) for size in options['sockets'].split(','))
+        with scratch_database():
+            bus = create_bus(total_rows=10)
+            seat_ids = list(bus.seats.values_list('id', flat=True))
+            token = RefreshToken.for_user(User.objects.create_user(username='bench')).access_token
+
+            self.stdout.write(
+                f"{'backend':<8} {'sockets':>8} {'p50 ms':>8} {'p99 ms':>8} {'last p50':>9} {'last p99':>9}"
+            )
+            for backend in options['backends'].split(','):
+                if backend == 'redis' and importlib.util.find_spec('channels_redis') is None:
+                    self.stdout.write(f"{backend:<8} skipped: channels_redis is not installed")
+                    continue
+
+                layers = {'default': settings.CHANNEL_LAYER_BACKENDS[backend]}
+                # Every socket belongs to one user, so lift the per-user cap
+                with override_settings(CHANNEL_LAYERS=layers, SEAT_UPDATE_COALESCE_MS=options['coalesce_ms'],
+                                       WEBSOCKET_MAX_PER_USER=None, WEBSOCKET_MAX_PER_BUS=None):
+                    channel_layers.backends.clear()
+                    for size in sizes:
+                        try:
+                            per_socket, per_round = asyncio.run(
+                                self.measure(bus.id, seat_ids, token, size, options['rounds'])
+                            )
+                        except OSError as e:
+                            self.stdout.write(f"{backend:<8} skipped: {e}")
+                            break
+                        self.stdout.write(
+                            f"{backend:<8} {size:>8} "
+                            f"{percentile(per_socket, 50) * 1000:>8.2f} {percentile(per_socket, 99) * 1000:>8.2f} "
+                            f"{percentile(per_round, 50) * 1000:>9.2f} {percentile(per_round, 99) * 1000:>9.2f}"
+                        )
+                    channel_layers.backends.clear()
+
+    async def measure(self, bus_id, seat_ids, token, sockets, rounds):
+        # per_socket: send -> delivery on each socket; per_round: send -> delivery on the last one
+        communicators = []
+        for _ in range(sockets):
+            communicator = WebsocketCommunicator(websocket_application, f'/ws/bus/{bus_id}/?token={token}')
+            connected, _ = await communicator.connect(timeout=10)
+            assert connected
+            communicators.append(communicator)
+        snapshots = await asyncio.gather(*(c.receive_json_from(timeout=10) for c in communicators))
+        version = max(snapshot['version'] for snapshot in snapshots)
+
+        async def delivered(communicator, start):
+            await communicator.receive_json_from(timeout=10)
+            return time.perf_counter() - start
+
+        per_socket, per_round = [], []
+        channel_layer = get_channel_layer()
+        try:
+            for round_number in range(rounds):
+                version += 1
+                seat_id = seat_ids[round_number % len(seat_ids)]
+                event = seat_update_event(bus_id, version, seat_changes([seat_id], 'CONFIRMED'))
+                start = time.perf_counter()
+                await channel_layer.group_send(f"bus_{bus_id}", event)
+                samples = await asyncio.gather(*(delivered(c, start) for c in communicators))
+                per_socket.extend(samples)
+                per_round.append(max(samples))
+        finally:
+            for communicator in communicators:
+                await communicator.disconnect()
+        return per_socket, per_round
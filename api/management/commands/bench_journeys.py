@@ -0,0 +1,121 @@
+import random
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from api.bench import percentile, scratch_database, time_calls
+from api.journeys import SYNC_OVERLAP, connection_graph
+from api.models import Bus
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a scratch database with a growing number of trips between a set of "
+        "cities and report journey planning latency (up to two transfers) at each "
+        "size, both straight from the connection graph and through the API. Latency "
+        "is reported for the searches that found at least one journey."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='10000,25000,50000',
+                            help='Comma-separated trip counts to measure at')
+        parser.add_argument('--queries', type=int, default=200,
+                            help='Journeys planned at each size')
+        parser.add_argument('--cities', type=int, default=8,
+                            help='Fewer cities make a denser network, so more searches find journeys')
+        parser.add_argument('--days', type=int, default=30,
+                            help='Spread departures over this many days')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        sizes = sorted(int(size) for size in options['sizes'].split(','))
+        cities = [f"City{i}" for i in range(options['cities'])]
+        rng = random.Random(options['seed'])
+
+        with scratch_database():
+            client = APIClient()
+            client.force_authenticate(user=User.objects.create_user(username='bench'))
+            start = timezone.now().replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+
+            self.stdout.write(
+                f"{'trips':>8} {'sync ms':>8} {'graph p50':>10} {'graph p99':>10} "
+                f"{'api p50':>8} {'api p99':>8} {'hits':>6} {'journeys':>9}"
+            )
+            seeded = 0
+            for size in sizes:
+                self.seed_trips(size - seeded, cities, start, options['days'], rng)
+                seeded = size
+                # Let the seeded rows age past the sync overlap, so the API numbers below
+                # are for a steady state rather than every request re-reading them
+                time.sleep(SYNC_OVERLAP.total_seconds())
+                # First size loads the graph; later ones measure the incremental sync
+                sync_start = time.perf_counter()
+                connection_graph.sync()
+                sync_ms = (time.perf_counter() - sync_start) * 1000
+
+                # Journeys found by each graph and API search, in the order they were timed
+                graph_found, api_found = [], []
+
+                def query():
+                    source, destination = rng.sample(cities, 2)
+                    after = start + timedelta(days=rng.randrange(options['days'] - 1))
+                    return source, destination, after, after + timedelta(hours=6)
+
+                def plan():
+                    graph_found.append(len(connection_graph.plan(*query())))
+
+                def api():
+                    source, destination, after, before = query()
+                    response = client.get(reverse('journey-search'), {
+                        'source': source,
+                        'destination': destination,
+                        'departure_after': after.isoformat(),
+                        'departure_before': before.isoformat(),
+                    })
+                    assert response.status_code == 200, response.data
+                    api_found.append(len(response.data['results']))
+
+                graph_samples = time_calls(plan, options['queries'])
+                api()  # warm up
+                api_found.clear()
+                api_samples = time_calls(api, options['queries'])
+                # Empty searches return early, so leave them out of the latencies
+                graph_hits = [sample for sample, found in zip(graph_samples, graph_found) if found]
+                api_hits = [sample for sample, found in zip(api_samples, api_found) if found]
+                if not graph_hits or not api_hits:
+                    self.stdout.write(f"{size:>8} {sync_ms:>8.1f}  no search found a journey; try fewer --cities")
+                    continue
+                self.stdout.write(
+                    f"{size:>8} {sync_ms:>8.1f} "
+                    f"{percentile(graph_hits, 50) * 1000:>10.2f} {percentile(graph_hits, 99) * 1000:>10.2f} "
+                    f"{percentile(api_hits, 50) * 1000:>8.2f} {percentile(api_hits, 99) * 1000:>8.2f} "
+                    f"{len(graph_hits) / len(graph_found):>6.0%} "
+                    f"{sum(graph_found) / len(graph_hits):>9.1f}"
+                )
+            connection_graph.clear()
+
+    def seed_trips(self, count, cities, start, days, rng, batch_size=5000):
+        buses = []
+        for _ in range(count):
+            source, destination = rng.sample(cities, 2)
+            departure = start + timedelta(minutes=rng.randrange(days * 24 * 60))
+            buses.append(Bus(
+                bus_number=f"BUS{rng.randrange(10000):04d}",
+                source=source,
+                destination=destination,
+                departure_time=departure,
+                arrival_time=departure + timedelta(minutes=rng.randrange(90, 12 * 60)),
+                total_rows=10,
+                has_sleeper=rng.random() < 0.5,
+                seater_fare=Decimal(rng.randrange(300, 900)),
+                lower_berth_fare=Decimal(rng.randrange(700, 1500)),
+                upper_berth_fare=Decimal(rng.randrange(600, 1400)),
+                free_seats=20,
+            ))
+        Bus.objects.bulk_create(buses, batch_size=batch_size)
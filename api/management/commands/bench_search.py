@@ -0,0 +1,85 @@
+import random
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from api.bench import percentile, scratch_database, time_calls
+from api.models import Bus
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a scratch database with a growing number of buses and report "
+        "route search latency at each size. Seats are not generated, so this "
+        "isolates the cost of the route/date index lookup."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='10000,25000,50000,100000',
+                            help='Comma-separated bus counts to measure at')
+        parser.add_argument('--queries', type=int, default=200,
+                            help='Searches timed at each size')
+        parser.add_argument('--cities', type=int, default=40)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        sizes = sorted(int(size) for size in options['sizes'].split(','))
+        cities = [f"City{i}" for i in range(options['cities'])]
+        rng = random.Random(options['seed'])
+
+        with scratch_database():
+            client = APIClient()
+            client.force_authenticate(user=User.objects.create_user(username='bench'))
+            start = timezone.now().replace(minute=0, second=0, microsecond=0)
+
+            self.stdout.write(f"{'buses':>8} {'p50 ms':>8} {'p99 ms':>8}")
+            seeded = 0
+            for size in sizes:
+                self.seed_buses(size - seeded, cities, start, rng)
+                seeded = size
+
+                def search():
+                    source, destination = rng.sample(cities, 2)
+                    day = (start + timedelta(days=rng.randrange(90))).date()
+                    response = client.get(reverse('bus-search'), {
+                        'source': source,
+                        'destination': destination,
+                        'date': day.isoformat(),
+                    })
+                    assert response.status_code == 200, response.data
+
+                search()  # warm up
+                samples = time_calls(search, options['queries'])
+                self.stdout.write(
+                    f"{size:>8} {percentile(samples, 50) * 1000:>8.2f} "
+                    f"{percentile(samples, 99) * 1000:>8.2f}"
+                )
+
+            plan = Bus.objects.search(cities[0], cities[1], departure_after=start).explain()
+            self.stdout.write(f"\nQuery plan:\n{plan}")
+
+    def seed_buses(self, count, cities, start, rng, batch_size=5000):
+        # bulk_create skips the seat-generation signal, which keeps seeding fast
+        buses = []
+        for _ in range(count):
+            source, destination = rng.sample(cities, 2)
+            departure = start + timedelta(minutes=rng.randrange(90 * 24 * 60))
+            has_sleeper = rng.random() < 0.5
+            buses.append(Bus(
+                bus_number=f"BUS{rng.randrange(10000):04d}",
+                source=source,
+                destination=destination,
+                departure_time=departure,
+                arrival_time=departure + timedelta(hours=rng.randrange(2, 14)),
+                total_rows=10,
+                has_sleeper=has_sleeper,
+                seater_fare=Decimal(rng.randrange(300, 900)),
+                lower_berth_fare=Decimal(rng.randrange(700, 1500)),
+                upper_berth_fare=Decimal(rng.randrange(600, 1400)),
+            ))
+        Bus.objects.bulk_create(buses, batch_size=batch_size)
@@ -0,0 +1,300 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+from channels.db import database_sync_to_async
+from channels.layers import channel_layers
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from api.bench import generate_fleet, percentile, scratch_database
+from api.cache import seat_map_cache
+from api.metrics import metrics
+from api.models import BookedSeat, Booking, Bus
+from api.reservations import release_booking, reserve_seats
+from api.routing import websocket_application
+
+SCENARIOS = ('listing', 'seat_map', 'hot_bus', 'cancel_storm', 'ws_fanout')
+
+# Compared by --compare: metric -> whether a higher value is better
+COMPARED = {'throughput': True, 'p50_ms': False, 'p99_ms': False, 'queries_per_request': False}
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate a synthetic fleet in a scratch SQLite database and run scripted "
+        "scenarios against it through the real URLs, with the in-memory channel layer. "
+        "Prints a JSON report of throughput, p50/p99 latency and queries per request "
+        "for each scenario; save one per commit and diff them with --compare."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--buses', type=int, default=200)
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--sleeper-ratio', type=float, default=0.5)
+        parser.add_argument('--occupancy', type=float, default=0.5,
+                            help='Share of each bus already booked before the scenarios run')
+        parser.add_argument('--requests', type=int, default=500,
+                            help='Requests per HTTP scenario')
+        parser.add_argument('--threads', type=int, default=8,
+                            help='Concurrent clients per HTTP scenario')
+        parser.add_argument('--sockets', type=int, default=100,
+                            help='WebSocket clients on the bus in ws_fanout')
+        parser.add_argument('--rounds', type=int, default=20,
+                            help='Seat changes pushed to the sockets in ws_fanout')
+        parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+        parser.add_argument('--compare', help='Earlier JSON report to print changes against')
+
+    def handle(self, *args, **options):
+        scenarios = options['scenarios'].split(',')
+        unknown = set(scenarios) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+        # Deltas go straight out, and slow-request logging would only add noise; server
+        # errors are counted in each scenario's statuses rather than logged
+        logging.getLogger('django.request').setLevel(logging.CRITICAL)
+        layers = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+        overrides = {
+            'CHANNEL_LAYERS': layers,
+            'SEAT_UPDATE_COALESCE_MS': 0,
+            'SLOW_REQUEST_MS': None,
+            # --sockets may be many times --users
+            'WEBSOCKET_MAX_PER_USER': None,
+        }
+        with override_settings(**overrides):
+            channel_layers.backends.clear()
+            with scratch_database(os.path.join(tempfile.gettempdir(), 'bench_suite.sqlite3')):
+                self.rng = random.Random(options['seed'])
+                self.buses, users = generate_fleet(
+                    options['buses'], options['users'],
+                    sleeper_ratio=options['sleeper_ratio'],
+                    occupancy=options['occupancy'],
+                    seed=options['seed'],
+                )
+                self.auth = {
+                    user.id: {'Authorization': f'Bearer {RefreshToken.for_user(user).access_token}'}
+                    for user in users
+                }
+                results = {}
+                for name in scenarios:
+                    seat_map_cache.clear()
+                    metrics.clear()
+                    results[name] = getattr(self, f'run_{name}')(options)
+            channel_layers.backends.clear()
+
+        report = {
+            'commit': self.commit(),
+            'options': {key: options[key] for key in (
+                'buses', 'users', 'sleeper_ratio', 'occupancy', 'requests', 'threads', 'sockets', 'rounds', 'seed'
+            )},
+            'scenarios': results,
+        }
+        text = json.dumps(report, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as handle:
+                handle.write(text + '\n')
+        else:
+            self.stdout.write(text)
+        if options['compare']:
+            with open(options['compare']) as handle:
+                self.compare(json.load(handle), report)
+
+    def commit(self):
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def compare(self, before, after):
+        # To stderr, so the JSON on stdout stays parseable
+        sys.stderr.write(f"{'scenario':<14} {'metric':<20} {'before':>10} {'after':>10} {'change':>8}\n")
+        for name, numbers in after['scenarios'].items():
+            old = before.get('scenarios', {}).get(name, {})
+            for metric, higher_is_better in COMPARED.items():
+                if metric not in numbers or metric not in old:
+                    continue
+                change = (numbers[metric] - old[metric]) / old[metric] * 100 if old[metric] else 0
+                verdict = '' if not change else 'better' if (change > 0) == higher_is_better else 'worse'
+                line = f"{name:<14} {metric:<20} {old[metric]:>10} {numbers[metric]:>10} {change:>+7.1f}% {verdict}"
+                sys.stderr.write(line.rstrip() + '\n')
+
+    def run_listing(self, options):
+        def request(client, index):
+            return client.get(reverse('all-buses'), headers=self.any_user())
+        return self.load(request, options['requests'], options['threads'])
+
+    def run_seat_map(self, options):
+        def request(client, index):
+            bus = self.rng.choice(self.buses)
+            return client.get(reverse('bus-seats', args=[bus.id]), headers=self.any_user())
+        return self.load(request, options['requests'], options['threads'])
+
+    def run_hot_bus(self, options):
+        # Every client books single seats on the emptiest bus, so most attempts collide
+        bus = Bus.objects.order_by('-free_seats', 'id').first()
+        free = self.free_seats(bus)
+
+        def request(client, index):
+            return client.post(
+                reverse('book-seats'),
+                {'bus': bus.id, 'seat_ids': [self.rng.choice(free)]},
+                format='json',
+                headers=self.any_user()
+            )
+        result = self.load(request, options['requests'], options['threads'])
+        result['seats_free_before'] = len(free)
+        bus.refresh_from_db()
+        result['seats_free_after'] = bus.free_seats
+        result['consistent'] = self.consistent(bus)
+        return result
+
+    def run_cancel_storm(self, options):
+        # Owners cancel confirmed bookings across the fleet all at once
+        bookings = list(Booking.objects.filter(status='CONFIRMED').order_by('id')[:options['requests']])
+        self.rng.shuffle(bookings)
+
+        def request(client, index):
+            booking = bookings[index]
+            return client.post(reverse('cancel-booking', args=[booking.id]), headers=self.auth[booking.user_id])
+        result = self.load(request, len(bookings), options['threads'])
+        result['consistent'] = all(self.consistent(bus) for bus in Bus.objects.filter(
+            id__in={booking.bus_id for booking in bookings}
+        ))
+        return result
+
+    def run_ws_fanout(self, options):
+        return asyncio.run(self.fanout(options['sockets'], options['rounds']))
+
+    async def fanout(self, sockets, rounds):
+        # Each round books (or releases) a seat through reserve_seats and waits for the
+        # delta to reach every socket, so the whole publish path is on the clock
+        bus, seat_id, user = await database_sync_to_async(self.fanout_target)()
+        tokens = [headers['Authorization'].split()[1] for headers in self.auth.values()]
+        communicators = []
+        for index in range(sockets):
+            communicator = WebsocketCommunicator(
+                websocket_application, f'/ws/bus/{bus.id}/?token={tokens[index % len(tokens)]}'
+            )
+            connected, _ = await communicator.connect(timeout=10)
+            assert connected
+            communicators.append(communicator)
+        await asyncio.gather(*(c.receive_json_from(timeout=10) for c in communicators))
+
+        async def delivered(communicator, start):
+            await communicator.receive_json_from(timeout=10)
+            return time.perf_counter() - start
+
+        per_socket, per_round = [], []
+        booking = None
+        start_all = time.perf_counter()
+        try:
+            for _ in range(rounds):
+                start = time.perf_counter()
+                if booking is None:
+                    booking = await database_sync_to_async(reserve_seats)(user, bus, [seat_id])
+                else:
+                    await database_sync_to_async(release_booking)(booking)
+                    booking = None
+                samples = await asyncio.gather(*(delivered(c, start) for c in communicators))
+                per_socket.extend(samples)
+                per_round.append(max(samples))
+        finally:
+            for communicator in communicators:
+                await communicator.disconnect()
+            if booking is not None:
+                await database_sync_to_async(release_booking)(booking)
+        elapsed = time.perf_counter() - start_all
+        return {
+            'sockets': sockets,
+            'rounds': rounds,
+            'seconds': round(elapsed, 3),
+            'throughput': round(len(per_socket) / elapsed, 1),
+            'p50_ms': round(percentile(per_socket, 50) * 1000, 2),
+            'p99_ms': round(percentile(per_socket, 99) * 1000, 2),
+            'round_p99_ms': round(percentile(per_round, 99) * 1000, 2),
+        }
+
+    def fanout_target(self):
+        # A bus with a seat free to flip between booked and released, and someone to book it
+        bus = Bus.objects.filter(free_seats__gt=0).order_by('id').first()
+        return bus, self.free_seats(bus)[0], User.objects.get(id=next(iter(self.auth)))
+
+    def free_seats(self, bus):
+        taken = set(BookedSeat.objects.filter(bus=bus, is_active=True).values_list('seat_id', flat=True))
+        return [seat_id for seat_id in bus.seats.order_by('id').values_list('id', flat=True) if seat_id not in taken]
+
+    def any_user(self):
+        return self.auth[self.rng.choice(list(self.auth))]
+
+    def consistent(self, bus):
+        # No seat held twice, and the inventory columns agree with the bookings
+        doubled = BookedSeat.objects.filter(bus=bus, is_active=True).values('seat').annotate(
+            holders=Count('id')
+        ).filter(holders__gt=1).exists()
+        counted = Bus.objects.filter(pk=bus.pk).count_inventory()[bus.pk]
+        bus.refresh_from_db()
+        return not doubled and all(getattr(bus, field) == value for field, value in counted.items())
+
+    def load(self, request, total, threads):
+        # request(client, index) is called total times across threads clients
+        indexes = iter(range(total))
+        lock = threading.Lock()
+        samples, statuses = [], Counter()
+
+        def worker():
+            client = APIClient(raise_request_exception=False)
+            try:
+                while True:
+                    with lock:
+                        index = next(indexes, None)
+                    if index is None:
+                        return
+                    start = time.perf_counter()
+                    status = request(client, index).status_code
+                    elapsed = time.perf_counter() - start
+                    with lock:
+                        samples.append(elapsed)
+                        statuses[str(status)] += 1
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=worker) for _ in range(threads)]
+        start = time.perf_counter()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        endpoints = metrics.snapshot().values()
+        handled = sum(numbers['queries']['count'] for numbers in endpoints)
+        queries = sum(numbers['queries']['mean'] * numbers['queries']['count'] for numbers in endpoints)
+        return {
+            'requests': total,
+            'seconds': round(elapsed, 3),
+            'throughput': round(total / elapsed, 1) if elapsed else 0,
+            'p50_ms': round(percentile(samples, 50) * 1000, 2) if samples else 0,
+            'p99_ms': round(percentile(samples, 99) * 1000, 2) if samples else 0,
+            'queries_per_request': round(queries / handled, 2) if handled else 0,
+            'statuses': dict(statuses),
+        }
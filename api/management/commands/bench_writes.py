@@ -0,0 +1,97 @@
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from api.bench import create_bus, percentile, scratch_database
+from api.writer import write_queue
+
+# name -> (SQLite OPTIONS, SQLITE_SINGLE_WRITER)
+MODES = {
+    'default': ({}, False),
+    'wal': (settings.SQLITE_WAL_OPTIONS, False),
+    'wal+writer': (settings.SQLITE_WAL_OPTIONS, True),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Have many clients book different seats on one bus through the API, against a "
+        "file SQLite database with default settings, with WAL, and with WAL plus the "
+        "single writer, and report bookings/sec, p50/p99 latency and failed requests."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=16)
+        parser.add_argument('--bookings', type=int, default=600,
+                            help='Single-seat bookings per mode, all on the same bus')
+        parser.add_argument('--modes', default=','.join(MODES))
+
+    def handle(self, *args, **options):
+        # Failed requests are counted below rather than logged
+        logging.getLogger('django.request').setLevel(logging.CRITICAL)
+        self.stdout.write(
+            f"{'mode':<12} {'bookings/s':>10} {'p50 ms':>8} {'p99 ms':>8} {'failed':>7} {'per commit':>10}"
+        )
+        path = os.path.join(tempfile.gettempdir(), 'bench_writes.sqlite3')
+        old_options = connection.settings_dict['OPTIONS']
+        for mode in options['modes'].split(','):
+            sqlite_options, single_writer = MODES[mode]
+            connection.settings_dict['OPTIONS'] = dict(sqlite_options)
+            try:
+                with override_settings(SQLITE_SINGLE_WRITER=single_writer, SLOW_REQUEST_MS=None), scratch_database(path):
+                    self.measure(mode, options['clients'], options['bookings'])
+            finally:
+                connection.settings_dict['OPTIONS'] = old_options
+
+    def measure(self, mode, clients, bookings):
+        bus = create_bus(total_rows=-(-bookings // 3), has_sleeper=False)
+        seat_ids = iter(bus.seats.order_by('id').values_list('id', flat=True)[:bookings])
+        users = [User.objects.create_user(username=f'bench{i}') for i in range(clients)]
+        lock = threading.Lock()
+        samples, statuses = [], Counter()
+        batches, writes = write_queue.batches, write_queue.writes
+
+        def client(user):
+            api = APIClient(raise_request_exception=False)
+            api.force_authenticate(user=user)
+            try:
+                while True:
+                    with lock:
+                        seat_id = next(seat_ids, None)
+                    if seat_id is None:
+                        return
+                    start = time.perf_counter()
+                    response = api.post(reverse('book-seats'), {'bus': bus.id, 'seat_ids': [seat_id]}, format='json')
+                    elapsed = time.perf_counter() - start
+                    with lock:
+                        samples.append(elapsed)
+                        statuses[response.status_code] += 1
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=client, args=(user,)) for user in users]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        committed = write_queue.batches - batches
+        self.stdout.write(
+            f"{mode:<12} {statuses[201] / elapsed:>10.0f} "
+            f"{percentile(samples, 50) * 1000:>8.2f} {percentile(samples, 99) * 1000:>8.2f} "
+            f"{sum(statuses.values()) - statuses[201]:>7} "
+            f"{(write_queue.writes - writes) / committed if committed else 1:>10.1f}"
+        )
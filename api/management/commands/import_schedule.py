@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.imports import IMPORT_FORMATS, import_buses, import_format, read_rows
+
+
+class Command(BaseCommand):
+    help = (
+        "Stream a CSV or JSONL schedule of trips into Bus rows on the shared "
+        "layout templates and report rows/sec."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=IMPORT_FORMATS,
+                            help='Defaults to the file extension')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Validate every row without writing anything')
+
+    def handle(self, *args, **options):
+        fmt = options['format'] or import_format(options['path'])
+        if fmt is None:
+            raise CommandError("Cannot tell the file format; pass --format csv or --format jsonl")
+
+        try:
+            with open(options['path'], newline='', encoding='utf-8') as lines:
+                report = import_buses(read_rows(lines, fmt), options['batch_size'], options['dry_run'])
+        except UnicodeDecodeError as e:
+            raise CommandError(
+                f"{options['path']} is not UTF-8 ({e.reason}); trips read before it may have been imported"
+            )
+
+        for error in report['errors']:
+            self.stdout.write(self.style.WARNING(f"Line {error['line']}: {error['errors']}"))
+        if report['invalid'] > len(report['errors']):
+            self.stdout.write(self.style.WARNING(f"... and {report['invalid'] - len(report['errors'])} more invalid rows"))
+        action = 'Validated' if options['dry_run'] else 'Imported'
+        self.stdout.write(self.style.SUCCESS(
+            f"{action} {report['created']} of {report['rows']} trips ({report['seats']} seats) "
+            f"in {report['seconds']:.2f}s, {report['rows_per_sec']:.0f} rows/sec"
+        ))
@@ -0,0 +1,24 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api.models import Schedule
+from api.schedules import materialise_trips
+
+
+class Command(BaseCommand):
+    help = (
+        "Create the dated trips of every active recurring schedule for the next "
+        "few days, so searches in that range find them already in place."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.SCHEDULE_HORIZON_DAYS,
+                            help='How many days ahead of today to fill')
+
+    def handle(self, *args, **options):
+        today = timezone.localdate()
+        created = materialise_trips(Schedule.objects.all(), today, today + timedelta(days=options['days']))
+        self.stdout.write(f"Created {created} trips through {today + timedelta(days=options['days'])}")
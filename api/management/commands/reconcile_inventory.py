@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F
+
+from api.events import publish_seat_update, seat_event_dispatcher
+from api.models import Bus
+
+
+class Command(BaseCommand):
+    help = (
+        "Recount every bus's free-seat inventory from BookedSeat, report any "
+        "drift in the denormalized counters and correct it."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report drift without correcting it')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        fields = ['free_seats', *Bus.INVENTORY_FIELDS.values()]
+        bus_ids = list(Bus.objects.order_by('id').values_list('id', flat=True))
+        drifted = 0
+
+        for start in range(0, len(bus_ids), options['batch_size']):
+            chunk = bus_ids[start:start + options['batch_size']]
+            with transaction.atomic():
+                # Lock the batch so bookings cannot move the counters mid-recount
+                buses = Bus.objects.select_for_update().filter(id__in=chunk)
+                stored = {row['id']: row for row in buses.values('id', *fields)}
+                expected = buses.count_inventory()
+
+                for bus_id, values in expected.items():
+                    drift = {
+                        field: values[field] - stored[bus_id][field]
+                        for field in fields if values[field] != stored[bus_id][field]
+                    }
+                    if not drift:
+                        continue
+                    drifted += 1
+                    details = ', '.join(f"{field} {delta:+d}" for field, delta in drift.items())
+                    self.stdout.write(f"Bus {bus_id}: {details}")
+                    if not options['dry_run']:
+                        # Bump the version too so cached bus ETags stop matching; no seat
+                        # changed state, so sockets get an empty delta for it
+                        Bus.objects.filter(pk=bus_id).update(**values, seat_version=F('seat_version') + 1)
+                        publish_seat_update(bus_id, Bus(pk=bus_id).get_seat_version(), [])
+
+        seat_event_dispatcher.flush()
+        action = 'found' if options['dry_run'] else 'corrected'
+        self.stdout.write(self.style.SUCCESS(
+            f"Checked {len(bus_ids)} buses, {action} drift on {drifted}"
+        ))
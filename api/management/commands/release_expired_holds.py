@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.events import seat_event_dispatcher
+from api.reservations import release_expired_holds
+
+
+class Command(BaseCommand):
+    help = (
+        "Release seats held by PENDING bookings whose hold has expired and "
+        "push one seat_update per affected bus."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=0,
+                            help='Keep sweeping every N seconds instead of running once')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        while True:
+            # release_expired_holds pushes one seat_update per affected bus
+            released = release_expired_holds(batch_size=options['batch_size'])
+            seat_event_dispatcher.flush()
+            if released:
+                seats = sum(len(seat_ids) for seat_ids in released.values())
+                self.stdout.write(f"Released {seats} held seats on {len(released)} buses")
+
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,210 @@
+import contextvars
+import functools
+import logging
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+# In-process performance metrics. InstrumentationMiddleware (HTTP) and instrumented()
+# (consumer handlers) open a RequestStats for each unit of work. While one is open,
+# record_query (installed on every DB connection by signals.py) counts and times each
+# statement, and stage() adds the time spent serializing or in the channel layer. When
+# the unit ends its numbers go into per-endpoint histograms, served by the metrics view.
+
+logger = logging.getLogger(__name__)
+
+# Upper bucket bounds: milliseconds for timings, plain counts for queries
+TIME_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89, 144)
+
+METRICS = {
+    'total_ms': TIME_BUCKETS,
+    'db_ms': TIME_BUCKETS,
+    'queries': COUNT_BUCKETS,
+    'serializer_ms': TIME_BUCKETS,
+    'channel_ms': TIME_BUCKETS,
+}
+
+# Queries kept per request for the slow-request log
+MAX_RECORDED_QUERIES = 200
+
+class Histogram:
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)  # The last one is everything above bounds[-1]
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.buckets[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def percentile(self, pct):
+        # Upper bound of the bucket holding the pct-th value; max for the overflow bucket
+        rank = pct / 100 * self.count
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= rank:
+                return self.bounds[index] if index < len(self.bounds) else self.max
+        return 0
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'mean': round(self.total / self.count, 3) if self.count else 0,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+            'max': round(self.max, 3),
+        }
+
+class MetricsRegistry:
+    def __init__(self):
+        self._histograms = {}  # (endpoint, metric) -> Histogram
+        self._lock = threading.Lock()
+
+    def observe(self, endpoint, metric, value):
+        with self._lock:
+            histogram = self._histograms.get((endpoint, metric))
+            if histogram is None:
+                histogram = self._histograms[endpoint, metric] = Histogram(METRICS[metric])
+            histogram.observe(value)
+
+    def snapshot(self):
+        # {endpoint: {metric: {...}}}
+        with self._lock:
+            endpoints = {}
+            for (endpoint, metric), histogram in sorted(self._histograms.items()):
+                endpoints.setdefault(endpoint, {})[metric] = histogram.snapshot()
+            return endpoints
+
+    def clear(self):
+        with self._lock:
+            self._histograms.clear()
+
+metrics = MetricsRegistry()
+
+class RequestStats:
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.queries = 0
+        self.db_ms = 0.0
+        self.stage_ms = Counter()
+        self.sql = []  # (ms, sql) for the slow-request log
+        self._open_stages = Counter()
+
+    def record(self, total_ms):
+        endpoint = self.endpoint
+        metrics.observe(endpoint, 'total_ms', total_ms)
+        metrics.observe(endpoint, 'db_ms', self.db_ms)
+        metrics.observe(endpoint, 'queries', self.queries)
+        metrics.observe(endpoint, 'serializer_ms', self.stage_ms['serializer'])
+        metrics.observe(endpoint, 'channel_ms', self.stage_ms['channel'])
+
+        slow_ms = settings.SLOW_REQUEST_MS
+        if slow_ms is not None and total_ms >= slow_ms:
+            logger.warning(
+                "Slow %s: %.1f ms, %d queries in %.1f ms, serializer %.1f ms, channel %.1f ms%s",
+                endpoint, total_ms, self.queries, self.db_ms,
+                self.stage_ms['serializer'], self.stage_ms['channel'], self.describe_sql()
+            )
+
+    def describe_sql(self):
+        # Statements by total time, with how often each ran; an N+1 is one line with a big xN
+        totals, counts = Counter(), Counter()
+        for ms, sql in self.sql:
+            totals[sql] += ms
+            counts[sql] += 1
+        return ''.join(f"\n  {ms:.1f} ms  x{counts[sql]}  {sql}" for sql, ms in totals.most_common(5))
+
+_current = contextvars.ContextVar('request_stats', default=None)
+
+def record_query(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        ms = (time.perf_counter() - start) * 1000
+        stats.queries += 1
+        stats.db_ms += ms
+        if len(stats.sql) < MAX_RECORDED_QUERIES:
+            stats.sql.append((ms, sql))
+
+@contextmanager
+def stage(name):
+    # Adds the time inside to the current unit's name_ms; nested stages of one name count once
+    stats = _current.get()
+    if stats is None or stats._open_stages[name]:
+        yield
+        return
+    stats._open_stages[name] += 1
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.stage_ms[name] += (time.perf_counter() - start) * 1000
+        stats._open_stages[name] -= 1
+
+@contextmanager
+def measure(endpoint):
+    # The endpoint may be filled in later through the yielded stats
+    stats = RequestStats(endpoint)
+    token = _current.set(stats)
+    start = time.perf_counter()
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+        stats.record((time.perf_counter() - start) * 1000)
+
+def request_endpoint(request):
+    match = request.resolver_match
+    return f"{request.method} {match.view_name if match else 'unmatched'}"
+
+class InstrumentationMiddleware:
+    # Goes first in MIDDLEWARE so the total covers every other middleware too
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with measure(None) as stats:
+            try:
+                return self.get_response(request)
+            finally:
+                # Known once URL resolution has run
+                stats.endpoint = request_endpoint(request)
+
+    async def __acall__(self, request):
+        with measure(None) as stats:
+            try:
+                return await self.get_response(request)
+            finally:
+                stats.endpoint = request_endpoint(request)
+
+def instrumented(endpoint):
+    # For async consumer handlers: each call is measured as one unit under endpoint
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(*args, **kwargs):
+            with measure(endpoint):
+                return await handler(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='bus',
+            index=models.Index(fields=['source', 'destination', 'departure_time'], name='bus_route_departure_idx'),
+        ),
+    ]
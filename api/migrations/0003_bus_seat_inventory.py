@@ -0,0 +1,60 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:12
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+INVENTORY_FIELDS = {
+    'SEATER': 'free_seater_seats',
+    'LOWER': 'free_lower_berths',
+    'UPPER': 'free_upper_berths',
+}
+
+
+def populate_inventory(apps, schema_editor):
+    Bus = apps.get_model('api', 'Bus')
+    Seat = apps.get_model('api', 'Seat')
+
+    free = {}
+    rows = Seat.objects.values('bus_id', 'seat_type').annotate(
+        total=Count('id', distinct=True),
+        booked=Count('bookedseat', filter=Q(bookedseat__booking__status='CONFIRMED')),
+    )
+    for row in rows:
+        values = free.setdefault(row['bus_id'], {'free_seats': 0})
+        values[INVENTORY_FIELDS[row['seat_type']]] = row['total'] - row['booked']
+        values['free_seats'] += row['total'] - row['booked']
+
+    for bus_id, values in free.items():
+        Bus.objects.filter(pk=bus_id).update(**values)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_bus_route_departure_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bus',
+            name='free_lower_berths',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='bus',
+            name='free_seater_seats',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='bus',
+            name='free_seats',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='bus',
+            name='free_upper_berths',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(populate_inventory, migrations.RunPython.noop),
+    ]
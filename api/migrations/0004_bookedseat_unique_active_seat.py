@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:14
+
+from django.db import migrations, models
+
+
+def mark_active_seats(apps, schema_editor):
+    BookedSeat = apps.get_model('api', 'BookedSeat')
+    BookedSeat.objects.exclude(booking__status='CONFIRMED').update(is_active=False)
+
+    # Earlier double bookings would violate the constraint; the first booking keeps the seat
+    kept = set()
+    oversold = []
+    for booked_id, seat_id in BookedSeat.objects.filter(is_active=True).order_by('id').values_list('id', 'seat_id'):
+        if seat_id in kept:
+            oversold.append(booked_id)
+        kept.add(seat_id)
+    BookedSeat.objects.filter(id__in=oversold).update(is_active=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_bus_seat_inventory'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bookedseat',
+            name='is_active',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.RunPython(mark_active_seats, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='bookedseat',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_active', True)), fields=('seat',), name='unique_active_seat'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_booking_hold_expiry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bus',
+            name='seat_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
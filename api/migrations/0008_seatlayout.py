@@ -0,0 +1,50 @@
+# Generated by Django 5.2.18 on 2026-10-18 22:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_booking_user_date_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SeatLayout',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('kind', models.CharField(choices=[('SEATER', 'Seater 2+1'), ('SLEEPER', 'Sleeper L/U'), ('CUSTOM', 'Custom')], max_length=10)),
+                ('total_rows', models.IntegerField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='bus',
+            name='layout',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='buses', to='api.seatlayout'),
+        ),
+        migrations.AddField(
+            model_name='seat',
+            name='layout',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='layout_seats', to='api.seatlayout'),
+        ),
+        # Template seats have no bus; the per-bus seats are deleted once bookings move off them
+        migrations.AlterField(
+            model_name='seat',
+            name='bus',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='bus_seats', to='api.bus'),
+        ),
+        migrations.AddField(
+            model_name='bookedseat',
+            name='bus',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='api.bus'),
+        ),
+        # Template seats are shared between buses, so the old per-seat rule cannot hold
+        # while booked seats are moved onto them
+        migrations.RemoveConstraint(
+            model_name='bookedseat',
+            name='unique_active_seat',
+        ),
+    ]
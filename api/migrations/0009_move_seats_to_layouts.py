@@ -0,0 +1,63 @@
+# Generated by Django 5.2.18 on 2026-10-18 22:40
+
+from django.db import migrations
+
+
+def stock_cells(has_sleeper, total_rows):
+    # Same arrangement SeatLayout.standard_cells() produces
+    cells = []
+    for row in range(1, total_rows + 1):
+        columns = [('LOWER', 'L'), ('UPPER', 'U')] if has_sleeper else [('SEATER', col) for col in ['A', 'B', 'C']]
+        for seat_type, column in columns:
+            cells.append((len(cells) + 1, seat_type, row, column))
+    return tuple(cells)
+
+
+def move_seats_to_layouts(apps, schema_editor):
+    Bus = apps.get_model('api', 'Bus')
+    Seat = apps.get_model('api', 'Seat')
+    SeatLayout = apps.get_model('api', 'SeatLayout')
+    BookedSeat = apps.get_model('api', 'BookedSeat')
+
+    # One template per distinct arrangement; buses whose seats were edited by hand
+    # get a custom template copied from their own seats
+    templates = {}
+    seat_map = {}  # old per-bus seat id -> template seat id
+    for bus in Bus.objects.order_by('id'):
+        old_seats = list(Seat.objects.filter(bus_id=bus.id).order_by('seat_number'))
+        cells = tuple((seat.seat_number, seat.seat_type, seat.row, seat.column) for seat in old_seats)
+        stock = stock_cells(bus.has_sleeper, bus.total_rows)
+        if not cells:
+            cells = stock
+        if cells not in templates:
+            if cells == stock:
+                kind = 'SLEEPER' if bus.has_sleeper else 'SEATER'
+                name = f"{'Sleeper L/U' if bus.has_sleeper else 'Seater 2+1'} x{bus.total_rows}"
+            else:
+                kind, name = 'CUSTOM', f"Custom (bus {bus.bus_number} #{bus.id})"
+            layout = SeatLayout.objects.create(name=name, kind=kind, total_rows=bus.total_rows)
+            Seat.objects.bulk_create([
+                Seat(layout=layout, seat_number=number, seat_type=seat_type, row=row, column=column)
+                for number, seat_type, row, column in cells
+            ])
+            templates[cells] = (layout, dict(Seat.objects.filter(layout=layout).values_list('seat_number', 'id')))
+        layout, template_seats = templates[cells]
+        Bus.objects.filter(pk=bus.pk).update(layout=layout)
+        for seat in old_seats:
+            seat_map[seat.id] = template_seats[seat.seat_number]
+
+    # Booked seats keep their bus and point at the matching template seat
+    for booked in BookedSeat.objects.select_related('seat').iterator():
+        BookedSeat.objects.filter(pk=booked.pk).update(bus_id=booked.seat.bus_id, seat_id=seat_map[booked.seat_id])
+    Seat.objects.filter(layout__isnull=True).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_seatlayout'),
+    ]
+
+    operations = [
+        migrations.RunPython(move_seats_to_layouts),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-18 22:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_move_seats_to_layouts'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='seat',
+            unique_together=set(),
+        ),
+        migrations.RemoveField(
+            model_name='seat',
+            name='bus',
+        ),
+        migrations.AlterField(
+            model_name='seat',
+            name='layout',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='seats', to='api.seatlayout'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='seat',
+            unique_together={('layout', 'seat_number')},
+        ),
+        migrations.AlterField(
+            model_name='bookedseat',
+            name='bus',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.bus'),
+        ),
+        migrations.AddConstraint(
+            model_name='bookedseat',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_active', True)), fields=('bus', 'seat'), name='unique_active_seat'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:55
+
+import django.core.validators
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_seat_layout_required'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bus',
+            name='service_date',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='Schedule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bus_number', models.CharField(max_length=20)),
+                ('source', models.CharField(max_length=100)),
+                ('destination', models.CharField(max_length=100)),
+                ('departure', models.TimeField()),
+                ('duration', models.DurationField()),
+                ('days_of_week', models.CharField(default='0123456', max_length=7, validators=[django.core.validators.RegexValidator('^[0-6]{1,7}$', 'Use the digits 0 (Monday) to 6 (Sunday)')])),
+                ('starts_on', models.DateField()),
+                ('ends_on', models.DateField(blank=True, null=True)),
+                ('is_active', models.BooleanField(default=True)),
+                ('seater_fare', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('lower_berth_fare', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('upper_berth_fare', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('layout', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='schedules', to='api.seatlayout')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='bus',
+            name='schedule',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='trips', to='api.schedule'),
+        ),
+        migrations.AddConstraint(
+            model_name='bus',
+            constraint=models.UniqueConstraint(fields=('schedule', 'service_date'), name='unique_schedule_trip'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 21:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_bus_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='seatlayout',
+            name='seats_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='bookedseat',
+            name='seat',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='api.seat'),
+        ),
+    ]
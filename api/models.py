@@ -1,5 +1,207 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Count, F, Q
 from django.contrib.auth.models import User
+from django.core.validators import RegexValidator
+from django.utils import timezone
+from collections import Counter
+from datetime import datetime
+
+class BusQuerySet(models.QuerySet):
+    def search(self, source, destination, departure_after=None, departure_before=None,
+               seat_type=None, max_fare=None, min_seats=None):
+        # source/destination/departure_time filters line up with bus_route_departure_idx
+        buses = self.filter(source=source, destination=destination)
+        if departure_after is not None:
+            buses = buses.filter(departure_time__gte=departure_after)
+        if departure_before is not None:
+            buses = buses.filter(departure_time__lt=departure_before)
+        
+        if seat_type == 'SLEEPER':
+            buses = buses.filter(has_sleeper=True)
+        elif seat_type == 'SEATER':
+            buses = buses.filter(has_sleeper=False)
+        
+        if max_fare is not None:
+            # A bus matches if any seat it offers is within budget
+            buses = buses.filter(
+                Q(has_sleeper=False, seater_fare__lte=max_fare) |
+                Q(has_sleeper=True, lower_berth_fare__lte=max_fare) |
+                Q(has_sleeper=True, upper_berth_fare__lte=max_fare)
+            )
+        
+        if min_seats is not None:
+            buses = buses.filter(free_seats__gte=min_seats)
+        return buses
+
+    def count_inventory(self):
+        # Recount the inventory columns from the layout templates and active BookedSeats,
+        # keyed by bus id
+        layouts = dict(self.values_list('id', 'layout_id'))
+        totals = {}
+        for row in Seat.objects.filter(layout_id__in=set(layouts.values())).values('layout_id', 'seat_type').annotate(
+            total=Count('id')
+        ):
+            totals.setdefault(row['layout_id'], {})[row['seat_type']] = row['total']
+        booked = {}
+        for row in BookedSeat.objects.filter(bus_id__in=layouts, is_active=True).values('bus_id', 'seat__seat_type').annotate(
+            booked=Count('id')
+        ):
+            booked.setdefault(row['bus_id'], {})[row['seat__seat_type']] = row['booked']
+        
+        inventory = {}
+        for bus_id, layout_id in layouts.items():
+            booked_by_type = booked.get(bus_id, {})
+            inventory[bus_id] = Bus.inventory_values({
+                seat_type: total - booked_by_type.get(seat_type, 0)
+                for seat_type, total in totals.get(layout_id, {}).items()
+            })
+        return inventory
+
+class BookingQuerySet(models.QuerySet):
+    def history(self, user, status=None, trips=None):
+        # A user's bookings with everything BookingSerializer reads fetched up front;
+        # user/booking_date lines up with booking_user_date_idx
+        bookings = self.filter(user=user).select_related('user').prefetch_related(
+            models.Prefetch('booked_seats', queryset=BookedSeat.objects.select_related('seat'))
+        )
+        if status is not None:
+            bookings = bookings.filter(status=status)
+        
+        if trips == 'upcoming':
+            bookings = bookings.filter(bus__departure_time__gte=timezone.now())
+        elif trips == 'past':
+            bookings = bookings.filter(bus__departure_time__lt=timezone.now())
+        return bookings
+
+class SeatLayoutQuerySet(models.QuerySet):
+    def standard(self, total_rows, has_sleeper):
+        # The shared template for a stock coach of this size, created on first use
+        kind = 'SLEEPER' if has_sleeper else 'SEATER'
+        name = f"{dict(SeatLayout.KIND_CHOICES)[kind]} x{total_rows}"
+        with transaction.atomic():
+            layout, created = self.get_or_create(name=name, defaults={'kind': kind, 'total_rows': total_rows})
+            if created:
+                Seat.objects.bulk_create(layout.build_seats())
+        return layout
+    
+    def seats_changed(self):
+        # After seats are added, removed or retyped on these templates: move their ETags
+        # on and recount every trip on them, since a trip's inventory is otherwise only
+        # counted from its template when it is created. Returns {bus_id: seat_version}.
+        with transaction.atomic():
+            self.update(seats_version=F('seats_version') + 1)
+            trips = Bus.objects.select_for_update().filter(layout__in=self)
+            for bus_id, values in trips.count_inventory().items():
+                Bus.objects.filter(pk=bus_id).update(**values, seat_version=F('seat_version') + 1)
+            return dict(trips.values_list('id', 'seat_version'))
+
+class ScheduleQuerySet(models.QuerySet):
+    def running_between(self, first_day, last_day):
+        # Active schedules whose validity overlaps first_day..last_day; runs_on() narrows it per day
+        return self.filter(is_active=True, starts_on__lte=last_day).filter(
+            Q(ends_on__isnull=True) | Q(ends_on__gte=first_day)
+        )
+
+class SeatLayout(models.Model):
+    # A physical seat arrangement shared by every trip that runs that coach
+    KIND_CHOICES = (
+        ('SEATER', 'Seater 2+1'),
+        ('SLEEPER', 'Sleeper L/U'),
+        ('CUSTOM', 'Custom'),
+    )
+    
+    name = models.CharField(max_length=100, unique=True)
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    total_rows = models.IntegerField()
+    # Moves whenever the seats change; part of the template and layout ETags
+    seats_version = models.PositiveIntegerField(default=0)
+    
+    objects = SeatLayoutQuerySet.as_manager()
+    
+    def __str__(self):
+        return self.name
+    
+    def standard_cells(self):
+        # (seat_number, seat_type, row, column) for a stock layout; custom layouts
+        # have their Seat rows added by hand
+        seat_number = 1
+        for row in range(1, self.total_rows + 1):
+            if self.kind == 'SLEEPER':
+                cells = [('LOWER', 'L'), ('UPPER', 'U')]
+            elif self.kind == 'SEATER':
+                cells = [('SEATER', col) for col in ['A', 'B', 'C']]
+            else:
+                cells = []
+            for seat_type, column in cells:
+                yield seat_number, seat_type, row, column
+                seat_number += 1
+    
+    def build_seats(self):
+        return [
+            Seat(layout=self, seat_number=seat_number, seat_type=seat_type, row=row, column=column)
+            for seat_number, seat_type, row, column in self.standard_cells()
+        ]
+    
+    def seat_type_counts(self):
+        return dict(self.seats.values_list('seat_type').annotate(total=Count('id')))
+
+class Schedule(models.Model):
+    # A recurring service. Its dated departures are Bus rows created on demand (see
+    # api/schedules.py); editing a schedule only affects trips not created yet.
+    bus_number = models.CharField(max_length=20)
+    source = models.CharField(max_length=100)
+    destination = models.CharField(max_length=100)
+    departure = models.TimeField()  # Local time
+    duration = models.DurationField()
+    # Weekdays the service runs, Monday=0 as in date.weekday(); '0123456' is daily
+    days_of_week = models.CharField(
+        max_length=7,
+        default='0123456',
+        validators=[RegexValidator(r'^[0-6]{1,7}$', 'Use the digits 0 (Monday) to 6 (Sunday)')]
+    )
+    starts_on = models.DateField()
+    ends_on = models.DateField(null=True, blank=True)
+    is_active = models.BooleanField(default=True)
+    
+    layout = models.ForeignKey(SeatLayout, on_delete=models.PROTECT, related_name='schedules')
+    seater_fare = models.DecimalField(max_digits=10, decimal_places=2)
+    lower_berth_fare = models.DecimalField(max_digits=10, decimal_places=2)
+    upper_berth_fare = models.DecimalField(max_digits=10, decimal_places=2)
+    
+    objects = ScheduleQuerySet.as_manager()
+    
+    def __str__(self):
+        return f"{self.bus_number}: {self.source} to {self.destination} at {self.departure}"
+    
+    def runs_on(self, day):
+        return (
+            self.is_active
+            and self.starts_on <= day
+            and (self.ends_on is None or day <= self.ends_on)
+            and str(day.weekday()) in self.days_of_week
+        )
+    
+    def build_trip(self, day, seat_type_counts):
+        # The unsaved Bus for this service on day; bulk_create skips the pre_save signal,
+        # so the layout and inventory are filled in here
+        departure_time = timezone.make_aware(datetime.combine(day, self.departure))
+        bus = Bus(
+            schedule=self,
+            service_date=day,
+            bus_number=self.bus_number,
+            source=self.source,
+            destination=self.destination,
+            departure_time=departure_time,
+            arrival_time=departure_time + self.duration,
+            total_rows=self.layout.total_rows,
+            has_sleeper=bool(seat_type_counts.get('LOWER') or seat_type_counts.get('UPPER')),
+            seater_fare=self.seater_fare,
+            lower_berth_fare=self.lower_berth_fare,
+            upper_berth_fare=self.upper_berth_fare,
+            layout=self.layout,
+        )
+        bus.set_initial_inventory(seat_type_counts)
+        return bus
 
 class Bus(models.Model):
     bus_number = models.CharField(max_length=20)
@@ -17,6 +219,39 @@ class Bus(models.Model):
     lower_berth_fare = models.DecimalField(max_digits=10, decimal_places=2)
     upper_berth_fare = models.DecimalField(max_digits=10, decimal_places=2)
     
+    # Seats come from a shared template; assigned on create when left empty
+    layout = models.ForeignKey(SeatLayout, on_delete=models.PROTECT, null=True, blank=True, related_name='buses')
+    
+    # Set on trips materialised from a recurring schedule; one trip per schedule and day
+    schedule = models.ForeignKey(Schedule, on_delete=models.SET_NULL, null=True, blank=True, related_name='trips')
+    service_date = models.DateField(null=True, blank=True)
+    
+    # Denormalized seat inventory, kept in step with BookedSeat by adjust_inventory()
+    free_seats = models.IntegerField(default=0)
+    free_seater_seats = models.IntegerField(default=0)
+    free_lower_berths = models.IntegerField(default=0)
+    free_upper_berths = models.IntegerField(default=0)
+    # Bumped on every seat-state change so WebSocket clients can spot missed deltas
+    seat_version = models.PositiveIntegerField(default=0)
+    # Set on every save and bulk_create; the journey planner syncs its graph from it
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+    
+    INVENTORY_FIELDS = {
+        'SEATER': 'free_seater_seats',
+        'LOWER': 'free_lower_berths',
+        'UPPER': 'free_upper_berths',
+    }
+    
+    objects = BusQuerySet.as_manager()
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['source', 'destination', 'departure_time'], name='bus_route_departure_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['schedule', 'service_date'], name='unique_schedule_trip'),
+        ]
+    
     def __str__(self):
         return f"{self.bus_number}: {self.source} to {self.destination}"
     
@@ -25,6 +260,59 @@ class Bus(models.Model):
             return self.total_rows * 2
         else:
             return self.total_rows * 3  # Assuming 3 seats per row for non-sleeper
+    
+    @property
+    def seats(self):
+        # The template's seats; which of them are taken is per bus, in BookedSeat
+        return Seat.objects.filter(layout_id=self.layout_id)
+    
+    def get_fare(self, seat_type):
+        if seat_type == 'SEATER':
+            return self.seater_fare
+        elif seat_type == 'LOWER':
+            return self.lower_berth_fare
+        else:  # UPPER
+            return self.upper_berth_fare
+    
+    def set_initial_inventory(self, seat_type_counts=None):
+        # Every seat starts free; bulk imports pass the layout's counts to skip the query
+        if seat_type_counts is None:
+            seat_type_counts = self.layout.seat_type_counts()
+        for field, value in self.inventory_values(seat_type_counts).items():
+            setattr(self, field, value)
+    
+    def get_seat_states(self):
+        # Single query for every taken seat on this bus: {seat_id: booking status}
+        return dict(BookedSeat.objects.filter(
+            bus=self,
+            is_active=True
+        ).values_list('seat_id', 'booking__status'))
+
+    @classmethod
+    def inventory_values(cls, free_by_type):
+        # Map {seat_type: free count} onto the inventory columns
+        values = {field: free_by_type.get(seat_type, 0) for seat_type, field in cls.INVENTORY_FIELDS.items()}
+        values['free_seats'] = sum(values.values())
+        return values
+
+    def adjust_inventory(self, seat_types, delta):
+        # F() update so concurrent bookings on the same bus never lose a decrement
+        counts = Counter(seat_types)
+        updates = {
+            'free_seats': F('free_seats') + delta * sum(counts.values()),
+            'seat_version': F('seat_version') + 1,
+        }
+        for seat_type, count in counts.items():
+            field = self.INVENTORY_FIELDS[seat_type]
+            updates[field] = F(field) + delta * count
+        Bus.objects.filter(pk=self.pk).update(**updates)
+
+    def bump_seat_version(self):
+        Bus.objects.filter(pk=self.pk).update(seat_version=F('seat_version') + 1)
+
+    def get_seat_version(self):
+        # Read back inside the writing transaction so the event matches the change
+        return Bus.objects.filter(pk=self.pk).values_list('seat_version', flat=True).get()
 
 class Seat(models.Model):
     SEAT_TYPE_CHOICES = (
@@ -33,25 +321,17 @@ class Seat(models.Model):
         ('UPPER', 'Upper Berth'),
     )
     
-    bus = models.ForeignKey(Bus, on_delete=models.CASCADE, related_name='seats')
+    layout = models.ForeignKey(SeatLayout, on_delete=models.CASCADE, related_name='seats')
     seat_number = models.IntegerField()
     seat_type = models.CharField(max_length=10, choices=SEAT_TYPE_CHOICES)
     row = models.IntegerField()
     column = models.CharField(max_length=2)  # A, B, C or L (lower), U (upper)
     
     class Meta:
-        unique_together = ('bus', 'seat_number')
-    
-    def get_fare(self):
-        if self.seat_type == 'SEATER':
-            return self.bus.seater_fare
-        elif self.seat_type == 'LOWER':
-            return self.bus.lower_berth_fare
-        else:  # UPPER
-            return self.bus.upper_berth_fare
+        unique_together = ('layout', 'seat_number')
     
     def __str__(self):
-        return f"{self.seat_type} {self.seat_number} on Bus {self.bus.bus_number}"
+        return f"{self.seat_type} {self.seat_number} in {self.layout.name}"
 
 class Booking(models.Model):
     STATUS_CHOICES = (
@@ -65,16 +345,35 @@ class Booking(models.Model):
     booking_date = models.DateTimeField(auto_now_add=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='PENDING')
     total_fare = models.DecimalField(max_digits=10, decimal_places=2)
+    # Set while a PENDING booking is holding its seats
+    expires_at = models.DateTimeField(null=True, blank=True)
+    
+    objects = BookingQuerySet.as_manager()
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'expires_at'], name='booking_hold_expiry_idx'),
+            models.Index(fields=['user', 'booking_date'], name='booking_user_date_idx'),
+        ]
     
     def __str__(self):
         return f"Booking {self.id} by {self.user.username}"
 
 class BookedSeat(models.Model):
     booking = models.ForeignKey(Booking, on_delete=models.CASCADE, related_name='booked_seats')
-    seat = models.ForeignKey(Seat, on_delete=models.CASCADE)
+    # Seats are shared by every bus on a layout, so the bus is what makes this row unique
+    bus = models.ForeignKey(Bus, on_delete=models.CASCADE)
+    # A template seat someone has booked cannot be deleted from under them
+    seat = models.ForeignKey(Seat, on_delete=models.PROTECT)
+    # True while the booking holds the seat; cleared on cancel
+    is_active = models.BooleanField(default=True)
     
     class Meta:
         unique_together = ('booking', 'seat')
+        constraints = [
+            # A seat on a bus can be held by at most one live booking
+            models.UniqueConstraint(fields=['bus', 'seat'], condition=Q(is_active=True), name='unique_active_seat'),
+        ]
     
     def __str__(self):
-        return f"{self.seat.seat_type} {self.seat.seat_number} for {self.booking}"
\ No newline at end of file
+        return f"{self.seat.seat_type} {self.seat.seat_number} for {self.booking}"
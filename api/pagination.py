@@ -0,0 +1,15 @@
+from rest_framework.pagination import CursorPagination
+
+class BusCursorPagination(CursorPagination):
+    # Keyset pagination on (departure_time, id) so deep pages stay constant-time
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = ('departure_time', 'id')
+
+class BookingCursorPagination(CursorPagination):
+    # Newest first; (booking_date, id) keeps pages stable while new bookings arrive
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = ('-booking_date', '-id')
@@ -0,0 +1,132 @@
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from collections import defaultdict
+from decimal import Decimal
+from .events import publish_seat_update, seat_changes
+from .models import Bus, Booking, BookedSeat
+from .writer import single_writer
+
+class ReservationError(Exception):
+    pass
+
+class SeatUnavailable(ReservationError):
+    pass
+
+class AlreadyCancelled(ReservationError):
+    pass
+
+class HoldExpired(ReservationError):
+    pass
+
+# Every write below hands its seat delta to publish(bus_id, version, seats) inside its
+# transaction; the default publisher only sends it once that transaction commits.
+# The ones customers trigger go through the single writer when SQLITE_SINGLE_WRITER is on
+
+@single_writer
+def reserve_seats(user, bus, seat_ids, hold_for=None, publish=publish_seat_update):
+    # With hold_for the seats are only held (PENDING) until confirm_hold or expiry
+    # Sorted so overlapping requests take their row locks in the same order
+    seat_ids = sorted(set(seat_ids))
+    try:
+        with transaction.atomic():
+            # Seats are shared template rows, so there is nothing per bus to lock here;
+            # unique_active_seat settles any race, and the inventory update serializes the bus
+            seats = list(bus.seats.filter(id__in=seat_ids).order_by('id'))
+            missing = set(seat_ids) - {seat.id for seat in seats}
+            if missing:
+                raise ReservationError(f"Seat ID {min(missing)} not found")
+
+            taken = BookedSeat.objects.filter(
+                bus=bus,
+                seat_id__in=seat_ids,
+                is_active=True
+            ).select_related('seat').first()
+            if taken is not None:
+                raise SeatUnavailable(f"Seat {taken.seat.seat_number} is already booked")
+
+            booking = Booking.objects.create(
+                user=user,
+                bus=bus,
+                status='CONFIRMED' if hold_for is None else 'PENDING',
+                expires_at=None if hold_for is None else timezone.now() + hold_for,
+                total_fare=sum((bus.get_fare(seat.seat_type) for seat in seats), Decimal(0))
+            )
+            BookedSeat.objects.bulk_create([
+                BookedSeat(booking=booking, bus=bus, seat_id=seat_id) for seat_id in seat_ids
+            ])
+            bus.adjust_inventory([seat.seat_type for seat in seats], -1)
+            publish(bus.id, bus.get_seat_version(), seat_changes(seat_ids, booking.status))
+    except IntegrityError:
+        # unique_active_seat caught a booking that committed after our check
+        raise SeatUnavailable("One or more selected seats were just booked")
+    return booking
+
+@single_writer
+def release_booking(booking, publish=publish_seat_update):
+    with transaction.atomic():
+        # Conditional update so two concurrent cancels cannot both release the seats
+        if not Booking.objects.filter(id=booking.id, status=booking.status).update(status='CANCELLED'):
+            raise AlreadyCancelled("Booking is already cancelled")
+
+        active_seats = BookedSeat.objects.filter(booking=booking, is_active=True)
+        seats = list(active_seats.values_list('seat_id', 'seat__seat_type'))
+        active_seats.update(is_active=False)
+        booking.bus.adjust_inventory([seat_type for _, seat_type in seats], 1)
+        publish(booking.bus_id, booking.bus.get_seat_version(), seat_changes([seat_id for seat_id, _ in seats], None))
+
+    booking.status = 'CANCELLED'
+    return booking
+
+@single_writer
+def confirm_hold(booking, publish=publish_seat_update):
+    with transaction.atomic():
+        confirmed = Booking.objects.filter(
+            id=booking.id,
+            status='PENDING',
+            expires_at__gt=timezone.now()
+        ).update(status='CONFIRMED', expires_at=None)
+        if not confirmed:
+            raise HoldExpired("Seat hold has expired or is no longer pending")
+
+        # Held seats now show as booked, which is a seat-state change of its own
+        booking.bus.bump_seat_version()
+        seat_ids = list(booking.booked_seats.filter(is_active=True).values_list('seat_id', flat=True))
+        publish(booking.bus_id, booking.bus.get_seat_version(), seat_changes(seat_ids, 'CONFIRMED'))
+
+    booking.status = 'CONFIRMED'
+    booking.expires_at = None
+    return booking
+
+def release_expired_holds(now=None, batch_size=500, publish=publish_seat_update):
+    # Returns {bus_id: [seat_id, ...]} for every seat put back on sale, and publishes
+    # one seat_update per bus, covering the versions of every batch, once all batches
+    # have committed
+    now = now or timezone.now()
+    released = defaultdict(list)
+    versions = defaultdict(list)
+    while True:
+        with transaction.atomic():
+            expired = list(
+                Booking.objects.select_for_update()
+                .filter(status='PENDING', expires_at__lte=now)
+                .values_list('id', flat=True)[:batch_size]
+            )
+            if not expired:
+                break
+
+            active_seats = BookedSeat.objects.filter(booking_id__in=expired, is_active=True)
+            seat_types = defaultdict(list)
+            for bus_id, seat_id, seat_type in active_seats.values_list('bus_id', 'seat_id', 'seat__seat_type'):
+                released[bus_id].append(seat_id)
+                seat_types[bus_id].append(seat_type)
+
+            active_seats.update(is_active=False)
+            Booking.objects.filter(id__in=expired, status='PENDING').update(status='CANCELLED', expires_at=None)
+            for bus_id, types in seat_types.items():
+                bus = Bus(pk=bus_id)
+                bus.adjust_inventory(types, 1)
+                versions[bus_id].append(bus.get_seat_version())
+
+    for bus_id, seat_ids in released.items():
+        publish(bus_id, versions[bus_id][-1], seat_changes(seat_ids, None), versions[bus_id])
+    return dict(released)
@@ -0,0 +1,10 @@
+from channels.routing import URLRouter
+from django.urls import path
+from .authentication import JWTAuthMiddleware
+from .consumers import BusSeatConsumer
+
+websocket_urlpatterns = [
+    path('ws/bus/<int:bus_id>/', BusSeatConsumer.as_asgi()),
+]
+
+websocket_application = JWTAuthMiddleware(URLRouter(websocket_urlpatterns))
@@ -0,0 +1,59 @@
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from .models import Bus, Schedule
+
+# Lazy materialisation of recurring schedules. A dated trip is an ordinary Bus row, so
+# bookings, seat maps and events work on it unchanged; it is created the first time a
+# search covers its day, or ahead of time by the materialise_trips command.
+
+def booking_window():
+    # First and last day trips may be created for
+    today = timezone.localdate()
+    return today, today + timedelta(days=settings.SCHEDULE_BOOKING_DAYS)
+
+def materialise_trips(schedules, first_day, last_day):
+    # Create the missing trips of schedules on first_day..last_day inclusive, skipping any
+    # that have already left; returns how many rows were actually inserted
+    today, last_bookable = booking_window()
+    first_day, last_day = max(first_day, today), min(last_day, last_bookable)
+    if first_day > last_day:
+        return 0
+    schedules = list(schedules.running_between(first_day, last_day).select_related('layout'))
+    if not schedules:
+        return 0
+    dated_trips = Bus.objects.filter(schedule__in=schedules, service_date__range=(first_day, last_day))
+    existing = set(dated_trips.values_list('schedule_id', 'service_date'))
+    
+    now = timezone.now()
+    seat_type_counts = {}
+    trips = []
+    day = first_day
+    while day <= last_day:
+        for schedule in schedules:
+            if not schedule.runs_on(day) or (schedule.id, day) in existing:
+                continue
+            if schedule.layout_id not in seat_type_counts:
+                seat_type_counts[schedule.layout_id] = schedule.layout.seat_type_counts()
+            trip = schedule.build_trip(day, seat_type_counts[schedule.layout_id])
+            if trip.departure_time > now:
+                trips.append(trip)
+        day += timedelta(days=1)
+    if not trips:
+        return 0
+    # A concurrent search may get there first; unique_schedule_trip keeps one row per day,
+    # and the trips it skips are not counted
+    with transaction.atomic():
+        before = dated_trips.count()
+        Bus.objects.bulk_create(trips, ignore_conflicts=True)
+        return dated_trips.count() - before
+
+def materialise_for_search(source, destination, departure_after=None, departure_before=None):
+    # The days a search covers; an open-ended one covers the rolling horizon
+    first_day = timezone.localdate(departure_after) if departure_after else timezone.localdate()
+    if departure_before is not None:
+        last_day = timezone.localdate(departure_before - timedelta(microseconds=1))
+    else:
+        last_day = first_day + timedelta(days=settings.SCHEDULE_HORIZON_DAYS)
+    return materialise_trips(Schedule.objects.filter(source=source, destination=destination), first_day, last_day)
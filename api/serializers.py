@@ -1,10 +1,24 @@
 from rest_framework import serializers
+from rest_framework.renderers import JSONRenderer
+from .cache import seat_map_cache
+from .metrics import stage
 from .models import Bus, Seat, Booking, BookedSeat
+from .reservations import ReservationError, reserve_seats
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.db import transaction
-from decimal import Decimal
+from django.db.models import Prefetch, prefetch_related_objects
+from django.utils import timezone
+from datetime import datetime, time, timedelta
+import base64
 
-class UserSerializer(serializers.ModelSerializer):
+class TimedRepresentation:
+    # Output serializers count towards the request's serializer_ms, including any
+    # queries they make along the way, which is where an N+1 shows up
+    def to_representation(self, instance):
+        with stage('serializer'):
+            return super().to_representation(instance)
+
+class UserSerializer(TimedRepresentation, serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['id', 'username', 'email']
@@ -24,37 +38,169 @@ class RegisterSerializer(serializers.ModelSerializer):
         )
         return user
 
-class SeatSerializer(serializers.ModelSerializer):
+class SeatSerializer(TimedRepresentation, serializers.ModelSerializer):
     is_booked = serializers.SerializerMethodField()
-    fare = serializers.DecimalField(max_digits=10, decimal_places=2, source='get_fare')
+    is_held = serializers.SerializerMethodField()
+    # Set on each seat by serialize_seat_map, since fares belong to the bus, not the layout
+    fare = serializers.DecimalField(max_digits=10, decimal_places=2)
     
     class Meta:
         model = Seat
-        fields = ['id', 'seat_number', 'seat_type', 'row', 'column', 'is_booked', 'fare']
+        fields = ['id', 'seat_number', 'seat_type', 'row', 'column', 'is_booked', 'is_held', 'fare']
+    
+    def get_seat_state(self, obj):
+        # Seat maps pass the precomputed states so the list costs one query, not one per seat
+        seat_states = self.context.get('seat_states')
+        if seat_states is not None:
+            return seat_states.get(obj.id)
+        return BookedSeat.objects.filter(bus=self.context['bus'], seat=obj, is_active=True).values_list(
+            'booking__status', flat=True
+        ).first()
     
     def get_is_booked(self, obj):
-        return BookedSeat.objects.filter(
-            seat=obj, 
-            booking__status='CONFIRMED'
-        ).exists()
+        # Held seats count as booked so clients never offer them
+        return self.get_seat_state(obj) is not None
+    
+    def get_is_held(self, obj):
+        return self.get_seat_state(obj) == 'PENDING'
+
+def serialize_seat_map(bus):
+    seats = list(bus.seats.order_by('seat_number'))
+    for seat in seats:
+        seat.fare = bus.get_fare(seat.seat_type)
+    serializer = SeatSerializer(
+        seats,
+        many=True,
+        context={'bus': bus, 'seat_states': bus.get_seat_states()}
+    )
+    return serializer.data
+
+def build_seat_map(bus):
+    # bus must be freshly loaded: its seat_version is read before the seat states
+    with stage('serializer'):
+        payload = JSONRenderer().render(serialize_seat_map(bus))
+    seat_map_cache.put(bus.id, bus.seat_version, payload)
+    return bus.seat_version, payload
+
+def get_seat_map(bus, encoding='json'):
+    # For callers that already loaded the bus, e.g. get_bus_seats
+    entry = seat_map_cache.get(bus.id, bus.seat_version, encoding)
+    if entry is not None:
+        return entry
+    return build_seat_bitmap(bus) if encoding == 'bitmap' else build_seat_map(bus)
 
-class BusSerializer(serializers.ModelSerializer):
-    available_seats_count = serializers.SerializerMethodField()
+# Compact encoding: the static layout is fetched once, after which each seat map is a
+# pair of bitmaps. Bit i (most significant bit first) is the i-th seat of the layout.
+
+def serialize_layout_template(layout):
+    # Column per field, in bitmap order; the same for every bus on this template
+    columns = {'ids': [], 'seat_numbers': [], 'seat_types': [], 'rows': [], 'columns': []}
+    seats = layout.seats.order_by('seat_number').values_list('id', 'seat_number', 'seat_type', 'row', 'column')
+    for seat in seats:
+        for values, value in zip(columns.values(), seat):
+            values.append(value)
+    return {'layout': layout.id, 'name': layout.name, 'kind': layout.kind, **columns}
+
+def serialize_seat_layout(bus):
+    # The bus's template plus its fares, which are per seat type, not per seat
+    return {
+        'bus': bus.id,
+        'fares': {
+            'SEATER': str(bus.seater_fare),
+            'LOWER': str(bus.lower_berth_fare),
+            'UPPER': str(bus.upper_berth_fare),
+        },
+        **serialize_layout_template(bus.layout),
+    }
+
+def encode_seat_bitmap(flags):
+    bitmap = bytearray((len(flags) + 7) // 8)
+    for index, flag in enumerate(flags):
+        if flag:
+            bitmap[index >> 3] |= 0x80 >> (index & 7)
+    return base64.b64encode(bytes(bitmap)).decode()
+
+def build_seat_bitmap(bus):
+    # bus must be freshly loaded, as for build_seat_map
+    seat_ids = list(bus.seats.order_by('seat_number').values_list('id', flat=True))
+    seat_states = bus.get_seat_states()
+    with stage('serializer'):
+        payload = JSONRenderer().render({
+            'version': bus.seat_version,
+            'seats': len(seat_ids),
+            'booked': encode_seat_bitmap([seat_states.get(seat_id) is not None for seat_id in seat_ids]),
+            'held': encode_seat_bitmap([seat_states.get(seat_id) == 'PENDING' for seat_id in seat_ids]),
+        })
+    seat_map_cache.put(bus.id, bus.seat_version, payload, 'bitmap')
+    return bus.seat_version, payload
+
+class BusSerializer(TimedRepresentation, serializers.ModelSerializer):
+    available_seats_count = serializers.IntegerField(source='free_seats', read_only=True)
     
     class Meta:
         model = Bus
         fields = ['id', 'bus_number', 'source', 'destination', 'departure_time', 
                  'arrival_time', 'total_rows', 'has_sleeper', 'seater_fare', 
-                 'lower_berth_fare', 'upper_berth_fare', 'available_seats_count']
+                 'lower_berth_fare', 'upper_berth_fare', 'available_seats_count',
+                 'free_seater_seats', 'free_lower_berths', 'free_upper_berths']
+        read_only_fields = ['free_seater_seats', 'free_lower_berths', 'free_upper_berths']
+
+class BusSearchSerializer(serializers.Serializer):
+    source = serializers.CharField(max_length=100)
+    destination = serializers.CharField(max_length=100)
+    date = serializers.DateField(required=False)
+    departure_after = serializers.DateTimeField(required=False)
+    departure_before = serializers.DateTimeField(required=False)
+    seat_type = serializers.ChoiceField(choices=['SLEEPER', 'SEATER'], required=False)
+    max_fare = serializers.DecimalField(max_digits=10, decimal_places=2, required=False)
+    min_seats = serializers.IntegerField(min_value=1, required=False)
     
-    def get_available_seats_count(self, obj):
-        booked_seats = BookedSeat.objects.filter(
-            seat__bus=obj, 
-            booking__status='CONFIRMED'
-        ).count()
-        return obj.get_total_seats() - booked_seats
-
-class BookedSeatSerializer(serializers.ModelSerializer):
+    def validate(self, data):
+        return apply_date_window(data)
+
+class JourneySearchSerializer(serializers.Serializer):
+    source = serializers.CharField(max_length=100)
+    destination = serializers.CharField(max_length=100)
+    date = serializers.DateField(required=False)
+    departure_after = serializers.DateTimeField(required=False)
+    departure_before = serializers.DateTimeField(required=False)
+    max_transfers = serializers.IntegerField(min_value=0, max_value=2, default=2)
+    min_layover = serializers.IntegerField(min_value=0, default=30)  # Minutes
+    max_hours = serializers.IntegerField(min_value=1, max_value=72, default=24)
+    min_seats = serializers.IntegerField(min_value=1, required=False)
+    
+    def validate(self, data):
+        # Without a window, anything leaving in the next day
+        data = apply_date_window(data)
+        data.setdefault('departure_after', timezone.now())
+        data.setdefault('departure_before', data['departure_after'] + timedelta(days=1))
+        data['min_layover'] = timedelta(minutes=data['min_layover'])
+        data['max_duration'] = timedelta(hours=data.pop('max_hours'))
+        return data
+
+def apply_date_window(data):
+    # A calendar date is shorthand for that whole local day
+    date = data.pop('date', None)
+    if date is not None:
+        start = timezone.make_aware(datetime.combine(date, time.min))
+        data['departure_after'] = max(start, data.get('departure_after', start))
+        end = start + timedelta(days=1)
+        data['departure_before'] = min(end, data.get('departure_before', end))
+    return data
+
+def serialize_journey(legs):
+    return {
+        'departure_time': legs[0].departure_time,
+        'arrival_time': legs[-1].arrival_time,
+        'transfers': len(legs) - 1,
+        'legs': BusSerializer(legs, many=True).data,
+    }
+
+class BookingHistorySerializer(serializers.Serializer):
+    status = serializers.ChoiceField(choices=[choice for choice, _ in Booking.STATUS_CHOICES], required=False)
+    trips = serializers.ChoiceField(choices=['upcoming', 'past'], required=False)
+
+class BookedSeatSerializer(TimedRepresentation, serializers.ModelSerializer):
     seat_number = serializers.IntegerField(source='seat.seat_number')
     seat_type = serializers.CharField(source='seat.seat_type')
     
@@ -62,7 +208,7 @@ class BookedSeatSerializer(serializers.ModelSerializer):
         model = BookedSeat
         fields = ['id', 'seat_number', 'seat_type']
 
-class BookingSerializer(serializers.ModelSerializer):
+class BookingSerializer(TimedRepresentation, serializers.ModelSerializer):
     booked_seats = BookedSeatSerializer(many=True, read_only=True)
     user = UserSerializer(read_only=True)
     seat_ids = serializers.ListField(
@@ -72,45 +218,42 @@ class BookingSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = Booking
-        fields = ['id', 'user', 'bus', 'booking_date', 'status', 'total_fare', 'booked_seats', 'seat_ids']
-        read_only_fields = ['id', 'booking_date', 'total_fare']
+        fields = ['id', 'user', 'bus', 'booking_date', 'status', 'total_fare', 'expires_at', 'booked_seats', 'seat_ids']
+        read_only_fields = ['id', 'booking_date', 'total_fare', 'expires_at']
+    
+    def validate_seat_ids(self, value):
+        if not value:
+            raise serializers.ValidationError("Select at least one seat")
+        if len(set(value)) != len(value):
+            raise serializers.ValidationError("Duplicate seat IDs")
+        return value
     
     def create(self, validated_data):
         seat_ids = validated_data.pop('seat_ids')
+        hold_minutes = validated_data.pop('hold_minutes', None)
         bus = validated_data.get('bus')
         user = self.context['request'].user
         
-        # Calculate total fare based on selected seats
-        total_fare = Decimal(0)
-        for seat_id in seat_ids:
-            try:
-                seat = Seat.objects.get(id=seat_id, bus=bus)
-                total_fare += seat.get_fare()
-            except Seat.DoesNotExist:
-                raise serializers.ValidationError(f"Seat ID {seat_id} not found")
+        hold_for = timedelta(minutes=hold_minutes) if hold_minutes else None
+        try:
+            booking = reserve_seats(user, bus, seat_ids, hold_for=hold_for)
+        except ReservationError as e:
+            raise serializers.ValidationError(str(e))
         
-        # Create booking with transaction to ensure atomicity
-        with transaction.atomic():
-            # Check if any seats are already booked
-            for seat_id in seat_ids:
-                if BookedSeat.objects.filter(
-                    seat_id=seat_id, 
-                    booking__status='CONFIRMED'
-                ).exists():
-                    raise serializers.ValidationError(
-                        f"Seat {Seat.objects.get(id=seat_id).seat_number} is already booked"
-                    )
-            
-            # Create booking
-            booking = Booking.objects.create(
-                user=user,
-                bus=bus,
-                status='CONFIRMED',
-                total_fare=total_fare
-            )
-            
-            # Create booked seats
-            for seat_id in seat_ids:
-                BookedSeat.objects.create(booking=booking, seat_id=seat_id)
-        
-        return booking
\ No newline at end of file
+        # One query for the response's seat details instead of one per seat
+        prefetch_related_objects(
+            [booking],
+            Prefetch('booked_seats', queryset=BookedSeat.objects.select_related('seat'))
+        )
+        return booking
+
+class SeatHoldSerializer(BookingSerializer):
+    hold_minutes = serializers.IntegerField(
+        min_value=1,
+        max_value=settings.SEAT_HOLD_MAX_MINUTES,
+        default=settings.SEAT_HOLD_MINUTES,
+        write_only=True
+    )
+    
+    class Meta(BookingSerializer.Meta):
+        fields = BookingSerializer.Meta.fields + ['hold_minutes']
@@ -1,46 +1,61 @@
 # signals.py
-from django.db.models.signals import post_save
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
-from .models import Bus, Seat
+from .cache import token_user_cache
+from .events import publish_seat_update
+from .journeys import connection_graph
+from .metrics import record_query
+from .models import Bus, Seat, SeatLayout
+
+@receiver(pre_save, sender=Bus)
+def assign_seat_layout(sender, instance, raw=False, **kwargs):
+    if instance._state.adding and not raw:
+        # New trips share the stock template for their size unless one was chosen
+        if instance.layout_id is None:
+            instance.layout = SeatLayout.objects.standard(instance.total_rows, instance.has_sleeper)
+        
+        # Every seat starts free
+        instance.set_initial_inventory()
 
 @receiver(post_save, sender=Bus)
-def create_seats_for_bus(sender, instance, created, **kwargs):
-    if created:
-        # Remove existing seats (if any)
-        Seat.objects.filter(bus=instance).delete()
+def invalidate_seat_map(sender, instance, created, **kwargs):
+    if not created:
+        # Fares may have changed, so move the version past every cached seat map and
+        # have sockets send a fresh one
+        instance.bump_seat_version()
+        publish_seat_update(instance.pk, instance.get_seat_version(), None)
+
+@receiver(post_save, sender=Seat)
+@receiver(post_delete, sender=Seat)
+def recount_layout_trips(sender, instance, raw=False, **kwargs):
+    # Trips on the template were counted from its old seats, and their maps show them
+    if raw:
+        return
+    versions = SeatLayout.objects.filter(pk=instance.layout_id).seats_changed()
+    for bus_id, version in versions.items():
+        publish_seat_update(bus_id, version, None)
+
+@receiver(post_delete, sender=Bus)
+def drop_from_connection_graph(sender, instance, **kwargs):
+    # Added and edited trips reach the graph through updated_at; deletes leave no row to read
+    trip_id = instance.pk
+    transaction.on_commit(lambda: connection_graph.discard(trip_id))
 
-        seats = []
-        seat_number = 1
-        if instance.has_sleeper:
-            for row in range(1, instance.total_rows + 1):
-                # Lower berth
-                seats.append(Seat(
-                    bus=instance,
-                    seat_number=seat_number,
-                    seat_type='LOWER',
-                    row=row,
-                    column='L'
-                ))
-                seat_number += 1
-                # Upper berth
-                seats.append(Seat(
-                    bus=instance,
-                    seat_number=seat_number,
-                    seat_type='UPPER',
-                    row=row,
-                    column='U'
-                ))
-                seat_number += 1
-        else:
-            for row in range(1, instance.total_rows + 1):
-                for col in ['A', 'B', 'C']:
-                    seats.append(Seat(
-                        bus=instance,
-                        seat_number=seat_number,
-                        seat_type='SEATER',
-                        row=row,
-                        column=col
-                    ))
-                    seat_number += 1
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def evict_token_user(sender, instance, **kwargs):
+    # Deactivation, a new password or any other edit must reach the next request. Until
+    # the save commits another request can still read the old row and cache it again,
+    # so evict once more after commit
+    user_id = str(instance.pk)
+    token_user_cache.discard(user_id)
+    transaction.on_commit(lambda: token_user_cache.discard(user_id))
 
-        Seat.objects.bulk_create(seats)
+@receiver(connection_created)
+def instrument_connection(sender, connection, **kwargs):
+    # Counts and times queries for whichever request or handler is being measured
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
@@ -1,3 +1,1493 @@
-from django.test import TestCase
+import asyncio
+import base64
+import csv
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from datetime import datetime, time as dt_time, timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, OperationalError, connection, connections, transaction
+from django.db.models import Count, ProtectedError
+from django.db.models.signals import post_save
+from django.test import AsyncClient, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .bench import create_bus, generate_fleet
+from .authentication import JWTAuthMiddleware
+from .cache import SeatMapCache, TokenUserCache, seat_map_cache, token_user_cache
+from .consumers import BusSeatConsumer, coalescing_stats, open_connections, outbox_stats
+from .events import SeatEventDispatcher, merge_seat_updates
+from .imports import import_buses
+from .journeys import connection_graph
+from .metrics import measure, metrics
+from .models import Bus, Booking, BookedSeat, Schedule, Seat, SeatLayout
+from .reservations import ReservationError, release_booking, reserve_seats
+from .routing import websocket_application
+from .schedules import materialise_trips
+from .serializers import SeatSerializer, build_seat_bitmap, build_seat_map
+from .writer import write_queue
+
+
+IN_MEMORY_CHANNEL_LAYERS = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+
+
+def decode_bitmap(data, count):
+    bits = base64.b64decode(data)
+    return [bool(bits[index >> 3] & (0x80 >> (index & 7))) for index in range(count)]
+
+
+def confirm_seats(user, bus, seats):
+    booking = Booking.objects.create(
+        user=user,
+        bus=bus,
+        status='CONFIRMED',
+        total_fare=sum(bus.get_fare(seat.seat_type) for seat in seats)
+    )
+    for seat in seats:
+        BookedSeat.objects.create(booking=booking, bus=bus, seat=seat)
+    bus.adjust_inventory([seat.seat_type for seat in seats], -1)
+    return booking
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class SeatMapTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='rider', password='secret123')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        seat_map_cache.clear()
+
+    def test_seat_map_reports_confirmed_seats_only(self):
+        bus = create_bus(total_rows=3)
+        seats = list(bus.seats.order_by('seat_number'))
+        confirm_seats(self.user, bus, seats[:2])
+        release_booking(confirm_seats(self.user, bus, seats[2:3]))
+
+        response = self.client.get(reverse('bus-seats', args=[bus.id]))
+
+        self.assertEqual(response.status_code, 200)
+        booked = {seat['seat_number']: seat['is_booked'] for seat in response.json()}
+        self.assertEqual(booked, {1: True, 2: True, 3: False, 4: False, 5: False, 6: False})
+        fares = {seat['seat_type']: seat['fare'] for seat in response.json()}
+        self.assertEqual(fares, {'LOWER': '800.00', 'UPPER': '700.00'})
+
+    def test_seat_map_query_count_is_constant(self):
+        small = create_bus(total_rows=2, has_sleeper=False)
+        large = create_bus(total_rows=20, has_sleeper=False)
+        confirm_seats(self.user, large, list(large.seats.all()[:5]))
+
+        for bus in (small, large):
+            with self.assertNumQueries(3):
+                response = self.client.get(reverse('bus-seats', args=[bus.id]))
+            self.assertEqual(len(response.json()), bus.get_total_seats())
+
+            # Served from the shared cache until the seat version moves
+            with self.assertNumQueries(1):
+                cached = self.client.get(reverse('bus-seats', args=[bus.id]))
+            self.assertEqual(cached.content, response.content)
+
+    def test_seat_map_cache_follows_seat_version(self):
+        bus = create_bus(total_rows=2)
+        seat = bus.seats.order_by('seat_number').first()
+        self.client.get(reverse('bus-seats', args=[bus.id]))
+
+        booking = reserve_seats(self.user, bus, [seat.id])
+        response = self.client.get(reverse('bus-seats', args=[bus.id]))
+        self.assertTrue(response.json()[0]['is_booked'])
+
+        release_booking(booking)
+        response = self.client.get(reverse('bus-seats', args=[bus.id]))
+        self.assertFalse(response.json()[0]['is_booked'])
+
+    def test_editing_a_bus_invalidates_its_seat_map(self):
+        bus = create_bus(total_rows=2)
+        self.client.get(reverse('bus-seats', args=[bus.id]))
+
+        bus.lower_berth_fare = Decimal('950.00')
+        bus.save()
+
+        response = self.client.get(reverse('bus-seats', args=[bus.id]))
+        self.assertEqual(response.json()[0]['fare'], '950.00')
+
+    def test_cache_evicts_least_recently_used_past_byte_limit(self):
+        cache = SeatMapCache(max_bytes=10)
+        cache.put(1, 0, b'aaaa')
+        cache.put(2, 0, b'bbbb')
+        cache.get(1)
+        cache.put(3, 0, b'cccc')
+
+        self.assertIsNone(cache.get(2))
+        self.assertEqual(cache.get(1), (0, b'aaaa'))
+        self.assertEqual(cache.size, 8)
+
+    def test_cache_ignores_snapshot_older_than_last_write(self):
+        cache = SeatMapCache(max_bytes=100)
+        cache.put(1, 3, b'v3')
+        cache.invalidate(1, 4)
+        self.assertIsNone(cache.get(1))
+
+        # A build that read version 3 before the write finishes after it
+        cache.put(1, 3, b'v3')
+        self.assertIsNone(cache.get(1))
+        cache.put(1, 4, b'v4')
+        self.assertEqual(cache.get(1, 4), (4, b'v4'))
+        cache.put(1, 3, b'v3')
+        self.assertEqual(cache.get(1), (4, b'v4'))
+
+    def test_cache_forgets_write_floors_of_evicted_and_quiet_buses(self):
+        cache = SeatMapCache(max_bytes=4)
+        cache.invalidate(1, 2)
+        cache.put(1, 2, b'aaaa')
+        cache.put(2, 0, b'bbbb')  # Evicts bus 1, and with it its floor
+        self.assertFalse(cache._floor)
+
+        cache.invalidate(3, 1)
+        with mock.patch('api.cache.time.monotonic', return_value=time.monotonic() + 61):
+            cache.invalidate(4, 1)
+        self.assertEqual(set(cache._floor), {4})
+
+    def test_seat_map_unknown_bus(self):
+        response = self.client.get(reverse('bus-seats', args=[999]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_polling_with_etag_gets_304_until_seats_change(self):
+        bus = create_bus(total_rows=3)
+        seat = bus.seats.order_by('seat_number').first()
+        for name in ('bus-seats', 'bus-details'):
+            url = reverse(name, args=[bus.id])
+            response = self.client.get(url)
+            self.assertEqual(response['Cache-Control'], 'private, no-cache')
+
+            # One read of the bus row, nothing from the seat tables
+            with self.assertNumQueries(1):
+                cached = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(cached.status_code, 304)
+            # A 304 keeps the validator and caching rules of the response it stands for
+            self.assertEqual(cached['ETag'], response['ETag'])
+            self.assertEqual(cached['Cache-Control'], 'private, no-cache')
+
+            booking = reserve_seats(self.user, bus, [seat.id])
+            changed = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(changed.status_code, 200)
+            self.assertNotEqual(changed['ETag'], response['ETag'])
+            release_booking(booking)
+
+        response = self.client.get(reverse('bus-seats', args=[bus.id]), {'encoding': 'bitmap'})
+        self.assertNotEqual(response['ETag'], changed['ETag'])
+
+    def test_layout_is_cacheable_until_the_bus_is_edited(self):
+        bus = create_bus(total_rows=3)
+        url = reverse('bus-layout', args=[bus.id])
+        response = self.client.get(url)
+        self.assertIn('max-age=3600', response['Cache-Control'])
+
+        reserve_seats(self.user, bus, [bus.seats.first().id])
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+        bus.refresh_from_db()
+        bus.upper_berth_fare = Decimal('750.00')
+        bus.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_buses_of_one_size_share_a_template_but_not_bookings(self):
+        first = create_bus(total_rows=3)
+        second = create_bus(total_rows=3)
+        self.assertEqual(first.layout_id, second.layout_id)
+        self.assertEqual(Seat.objects.count(), 6)
+
+        seat = first.seats.order_by('seat_number').first()
+        reserve_seats(self.user, first, [seat.id])
+        reserve_seats(self.user, second, [seat.id])
+        with self.assertRaisesMessage(ReservationError, 'Seat 1 is already booked'):
+            reserve_seats(self.user, second, [seat.id])
+
+        url = reverse('layout-template', args=[first.layout_id])
+        response = self.client.get(url)
+        self.assertEqual(response.json()['ids'], self.client.get(reverse('bus-layout', args=[second.id])).json()['ids'])
+        self.assertIn('max-age=3600', response['Cache-Control'])
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_seats_added_to_a_template_after_its_trips_are_counted(self):
+        layout = SeatLayout.objects.create(name='Mini 1+1', kind='CUSTOM', total_rows=2)
+        bus = create_bus(total_rows=2, layout=layout)
+        self.assertEqual(bus.free_seats, 0)
+        template = self.client.get(reverse('layout-template', args=[layout.id]))
+        bus_layout = self.client.get(reverse('bus-layout', args=[bus.id]))
+
+        for number in (1, 2):
+            Seat.objects.create(layout=layout, seat_number=number, seat_type='SEATER', row=number, column='A')
+        bus.refresh_from_db()
+        self.assertEqual((bus.free_seats, bus.free_seater_seats), (2, 2))
+        self.assertEqual(bus.seat_version, 2)
+        for url, response in ((reverse('layout-template', args=[layout.id]), template),
+                              (reverse('bus-layout', args=[bus.id]), bus_layout)):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+        seat = layout.seats.first()
+        reserve_seats(self.user, bus, [seat.id])
+        bus.refresh_from_db()
+        self.assertEqual((bus.free_seats, bus.free_seater_seats), (1, 1))
+        with self.assertRaises(ProtectedError):
+            seat.delete()
+
+    def test_bitmap_encoding_matches_the_json_seat_map(self):
+        bus = create_bus(total_rows=30)
+        seats = list(bus.seats.order_by('seat_number'))
+        confirm_seats(self.user, bus, seats[:3])
+        reserve_seats(self.user, bus, [seats[10].id], hold_for=timedelta(minutes=5))
+
+        layout = self.client.get(reverse('bus-layout', args=[bus.id])).json()
+        self.assertEqual(layout['seat_numbers'], list(range(1, 61)))
+        self.assertEqual(layout['fares']['LOWER'], '800.00')
+
+        full = self.client.get(reverse('bus-seats', args=[bus.id]))
+        compact = self.client.get(reverse('bus-seats', args=[bus.id]), {'encoding': 'bitmap'})
+        bitmap = compact.json()
+        booked = dict(zip(layout['ids'], decode_bitmap(bitmap['booked'], bitmap['seats'])))
+        held = dict(zip(layout['ids'], decode_bitmap(bitmap['held'], bitmap['seats'])))
+        self.assertEqual(booked, {seat['id']: seat['is_booked'] for seat in full.json()})
+        self.assertEqual(held, {seat['id']: seat['is_held'] for seat in full.json()})
+        self.assertGreater(len(full.content), 10 * len(compact.content))
+
+        response = self.client.get(reverse('bus-seats', args=[bus.id]), {'encoding': 'xml'})
+        self.assertEqual(response.status_code, 400)
+
+
+class BusListingTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='rider', password='secret123')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def test_listing_annotates_available_seats_in_one_query(self):
+        buses = [create_bus(total_rows=4, departure_time=timezone.now() + timedelta(hours=i)) for i in range(1, 6)]
+        confirm_seats(self.user, buses[0], list(buses[0].seats.all()[:3]))
+
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('all-buses'))
+
+        self.assertEqual(response.status_code, 200)
+        available = {bus['id']: bus['available_seats_count'] for bus in response.data['results']}
+        self.assertEqual(available[buses[0].id], 5)
+        self.assertEqual(available[buses[1].id], 8)
+
+        cached = self.client.get(reverse('all-buses'), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(cached['ETag'], response['ETag'])
+        confirm_seats(self.user, buses[1], list(buses[1].seats.all()[:1]))
+        changed = self.client.get(reverse('all-buses'), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(changed.status_code, 200)
+
+    def test_listing_cursor_pagination_walks_every_bus_in_order(self):
+        departure = timezone.now() + timedelta(days=2)
+        # Shared departure times exercise the id tie-breaker
+        buses = [create_bus(departure_time=departure + timedelta(hours=i // 2)) for i in range(7)]
+
+        seen = []
+        url = reverse('all-buses') + '?page_size=3'
+        while url:
+            response = self.client.get(url)
+            self.assertLessEqual(len(response.data['results']), 3)
+            seen.extend(bus['id'] for bus in response.data['results'])
+            url = response.data['next']
+
+        self.assertEqual(seen, [bus.id for bus in buses])
+
+        # A bus that sorts after a full last page leaves its rows alone but gives it a next link
+        url = reverse('all-buses') + '?page_size=7'
+        response = self.client.get(url)
+        self.assertIsNone(response.data['next'])
+        create_bus(departure_time=departure + timedelta(days=1))
+        changed = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertEqual(changed.data['results'], response.data['results'])
+        self.assertIsNotNone(changed.data['next'])
+
+    def test_bus_details_available_seats(self):
+        bus = create_bus(total_rows=3, has_sleeper=False)
+        confirm_seats(self.user, bus, list(bus.seats.all()[:2]))
+
+        response = self.client.get(reverse('bus-details', args=[bus.id]))
+
+        self.assertEqual(response.data['available_seats_count'], 7)
+
+
+class BusSearchTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='rider', password='secret123')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.day = (timezone.now() + timedelta(days=3)).replace(hour=12, minute=0, second=0, microsecond=0)
+
+    def search(self, **params):
+        params.setdefault('source', 'Bangalore')
+        params.setdefault('destination', 'Chennai')
+        response = self.client.get(reverse('bus-search'), params)
+        self.assertEqual(response.status_code, 200, response.data)
+        return [bus['id'] for bus in response.data['results']]
+
+    def test_filters_by_route_and_date(self):
+        match = create_bus(departure_time=self.day)
+        create_bus(departure_time=self.day, destination='Mysore')
+        create_bus(departure_time=self.day + timedelta(days=1))
+
+        self.assertEqual(self.search(date=self.day.date().isoformat()), [match.id])
+
+    def test_filters_by_seat_type_and_fare(self):
+        sleeper = create_bus(departure_time=self.day, lower_berth_fare=Decimal('900'), upper_berth_fare=Decimal('650'))
+        seater = create_bus(departure_time=self.day, has_sleeper=False, seater_fare=Decimal('450'))
+
+        self.assertEqual(self.search(seat_type='SEATER'), [seater.id])
+        self.assertEqual(self.search(max_fare='700'), [sleeper.id, seater.id])
+        self.assertEqual(self.search(max_fare='500'), [seater.id])
+
+    def test_filters_by_min_free_seats(self):
+        nearly_full = create_bus(departure_time=self.day, total_rows=2)
+        roomy = create_bus(departure_time=self.day, total_rows=2)
+        confirm_seats(self.user, nearly_full, list(nearly_full.seats.all()[:3]))
+
+        self.assertEqual(self.search(min_seats=2), [roomy.id])
+        self.assertEqual(self.search(min_seats=1), [nearly_full.id, roomy.id])
+
+    def test_requires_route(self):
+        response = self.client.get(reverse('bus-search'), {'source': 'Bangalore'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('destination', response.data)
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class RecurringScheduleTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='rider', password='secret123')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.today = timezone.localdate()
+        # Weekdays only
+        self.schedule = Schedule.objects.create(
+            bus_number='KA01', source='Bangalore', destination='Chennai',
+            departure=dt_time(21, 30), duration=timedelta(hours=7), days_of_week='01234',
+            starts_on=self.today, layout=SeatLayout.objects.standard(4, True),
+            seater_fare=Decimal('500.00'), lower_berth_fare=Decimal('800.00'), upper_berth_fare=Decimal('700.00'),
+        )
+
+    def search(self, day):
+        response = self.client.get(reverse('bus-search'), {'source': 'Bangalore', 'destination': 'Chennai', 'date': day.isoformat()})
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data['results']
+
+    def next_day(self, weekdays):
+        return next(
+            self.today + timedelta(days=offset) for offset in range(1, 8)
+            if (self.today + timedelta(days=offset)).weekday() in weekdays
+        )
+
+    def test_search_creates_the_days_trip_once(self):
+        day = self.next_day({0, 1, 2, 3, 4})
+        self.assertEqual(Bus.objects.count(), 0)
+
+        results = self.search(day)
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0]['available_seats_count'], 8)
+        trip = Bus.objects.get()
+        self.assertEqual((trip.schedule, trip.service_date, timezone.localtime(trip.departure_time).hour), (self.schedule, day, 21))
+        self.assertEqual(trip.layout, self.schedule.layout)
+
+        self.assertEqual([bus['id'] for bus in self.search(day)], [trip.id])
+        self.assertEqual(Bus.objects.count(), 1)
+        self.assertEqual(self.search(self.next_day({5, 6})), [])
+
+        # A materialised trip books like any other bus
+        reserve_seats(self.user, trip, [trip.seats.first().id])
+        trip.refresh_from_db()
+        self.assertEqual(trip.free_seats, 7)
+
+    def test_trips_a_concurrent_search_created_first_are_not_counted(self):
+        day = self.next_day({0, 1, 2, 3, 4})
+        build_trip = Schedule.build_trip
+
+        def racing_build_trip(schedule, *args):
+            # Another search inserts the same trip between our read and our insert
+            build_trip(schedule, *args).save()
+            return build_trip(schedule, *args)
+
+        with mock.patch.object(Schedule, 'build_trip', racing_build_trip):
+            created = materialise_trips(Schedule.objects.all(), day, day)
+        self.assertEqual((created, Bus.objects.count()), (0, 1))
+        # Any seven days hold five weekdays
+        self.assertEqual(materialise_trips(Schedule.objects.all(), day + timedelta(days=1), day + timedelta(days=7)), 5)
+
+    def test_only_bookable_days_are_created(self):
+        self.schedule.ends_on = self.today + timedelta(days=30)
+        self.schedule.save()
+
+        self.assertEqual(self.search(self.today + timedelta(days=45)), [])
+        with self.settings(SCHEDULE_BOOKING_DAYS=5):
+            day = self.next_day({0, 1, 2, 3, 4})
+            self.assertEqual(self.search(day + timedelta(days=7)), [])
+        self.assertEqual(Bus.objects.count(), 0)
+
+    def test_command_fills_the_rolling_horizon(self):
+        call_command('materialise_trips', '--days', '13', stdout=StringIO())
+        service_dates = set(Bus.objects.values_list('service_date', flat=True))
+        expected = {
+            self.today + timedelta(days=offset) for offset in range(14)
+            if (self.today + timedelta(days=offset)).weekday() < 5
+        }
+        # Tonight's trip depends on whether it has left yet
+        self.assertEqual(service_dates - {self.today}, expected - {self.today})
+
+        out = StringIO()
+        call_command('materialise_trips', '--days', '13', stdout=out)
+        self.assertIn('Created 0 trips', out.getvalue())
+
+
+class JourneyPlannerTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(user=User.objects.create_user(username='rider'))
+        connection_graph.clear()
+        self.addCleanup(connection_graph.clear)
+        self.start = timezone.make_aware(datetime.combine(timezone.localdate() + timedelta(days=1), dt_time(6)))
+
+    def trip(self, source, destination, leaves, hours):
+        departure = self.start + timedelta(hours=leaves)
+        return create_bus(source=source, destination=destination, departure_time=departure,
+                          arrival_time=departure + timedelta(hours=hours), total_rows=2)
+
+    def plan(self, **params):
+        params = {'source': 'A', 'destination': 'D', 'date': self.start.date().isoformat(), **params}
+        response = self.client.get(reverse('journey-search'), params)
+        self.assertEqual(response.status_code, 200, response.data)
+        return [[leg['id'] for leg in journey['legs']] for journey in response.data['results']]
+
+    def test_finds_direct_and_connecting_journeys_by_arrival(self):
+        ab, bc, cd = self.trip('A', 'B', 0, 2), self.trip('B', 'C', 3, 2), self.trip('C', 'D', 6, 2)
+        direct = self.trip('A', 'D', 1, 13)
+        # Leaves B ten minutes after ab arrives, inside the layover
+        self.trip('B', 'D', 2.2, 1)
+        bd = self.trip('B', 'D', 4, 5)
+
+        self.assertEqual(self.plan(), [[ab.id, bc.id, cd.id], [ab.id, bd.id], [direct.id]])
+        self.assertEqual(self.plan(max_transfers=1), [[ab.id, bd.id], [direct.id]])
+        self.assertEqual(self.plan(min_layover=90), [[ab.id, bd.id], [direct.id]])
+        self.assertEqual(self.plan(max_hours=8), [[ab.id, bc.id, cd.id]])
+
+    def test_graph_follows_new_edited_and_deleted_trips(self):
+        ab, bd = self.trip('A', 'B', 0, 2), self.trip('B', 'D', 4, 3)
+        self.assertEqual(self.plan(), [[ab.id, bd.id]])
+
+        direct = self.trip('A', 'D', 1, 3)
+        bd.departure_time -= timedelta(hours=1)
+        bd.save()
+        with self.assertNumQueries(3):
+            self.assertEqual(self.plan(), [[direct.id], [ab.id, bd.id]])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            direct.delete()
+        self.assertEqual(self.plan(), [[ab.id, bd.id]])
+        self.assertEqual(self.plan(min_seats=5), [])
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class SeatInventoryTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='rider', password='secret123')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.bus = create_bus(total_rows=4)
+
+    def inventory(self):
+        self.bus.refresh_from_db()
+        return (self.bus.free_seats, self.bus.free_lower_berths, self.bus.free_upper_berths)
+
+    def test_new_bus_starts_with_every_seat_free(self):
+        self.assertEqual(self.inventory(), (8, 4, 4))
+        seater = create_bus(total_rows=4, has_sleeper=False)
+        self.assertEqual((seater.free_seats, seater.free_seater_seats), (12, 12))
+
+    def test_booking_and_cancel_move_the_counters(self):
+        seats = list(self.bus.seats.order_by('seat_number')[:3])
+        response = self.client.post(reverse('book-seats'), {
+            'bus': self.bus.id,
+            'seat_ids': [seat.id for seat in seats],
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(self.inventory(), (5, 2, 3))
+
+        response = self.client.post(reverse('cancel-booking', args=[response.data['id']]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.inventory(), (8, 4, 4))
+
+    def test_listing_reads_the_counter(self):
+        Bus.objects.filter(pk=self.bus.pk).update(free_seats=3)
+        response = self.client.get(reverse('bus-details', args=[self.bus.id]))
+        self.assertEqual(response.data['available_seats_count'], 3)
+
+    def test_reconcile_reports_and_fixes_drift(self):
+        confirm_seats(self.user, self.bus, list(self.bus.seats.filter(seat_type='UPPER')[:2]))
+        Bus.objects.filter(pk=self.bus.pk).update(free_seats=8, free_upper_berths=4)
+
+        out = StringIO()
+        call_command('reconcile_inventory', '--dry-run', stdout=out)
+        self.assertIn(f"Bus {self.bus.id}: free_seats -2, free_upper_berths -2", out.getvalue())
+        self.assertEqual(self.inventory(), (8, 4, 4))
+
+        call_command('reconcile_inventory', stdout=StringIO())
+        self.assertEqual(self.inventory(), (6, 4, 2))
+
+
+class ScheduleImportTests(TestCase):
+    header = 'bus_number,source,destination,departure_time,arrival_time,total_rows,has_sleeper,seater_fare,lower_berth_fare,upper_berth_fare\n'
+
+    def schedule(self, trips):
+        departure = timezone.now() + timedelta(days=1)
+        lines = [
+            f"KA{i:03d},Bangalore,Chennai,{(departure + timedelta(hours=i)).isoformat()},"
+            f"{(departure + timedelta(hours=i + 6)).isoformat()},{4 + i % 3},{i % 2 == 0},500,800,700\n"
+            for i in range(trips)
+        ]
+        # Arrives before it leaves
+        lines.append(f"BAD1,Bangalore,Chennai,{departure.isoformat()},{departure.isoformat()},4,true,500,800,700\n")
+        return self.header + ''.join(lines)
+
+    def test_command_builds_seats_and_inventory_without_signals(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as handle:
+            handle.write(self.schedule(30))
+        self.addCleanup(os.remove, handle.name)
+
+        saved = []
+        record = lambda sender, instance, **kwargs: saved.append(instance)
+        post_save.connect(record, sender=Bus)
+        self.addCleanup(post_save.disconnect, record, sender=Bus)
+
+        out = StringIO()
+        call_command('import_schedule', handle.name, '--batch-size', '8', stdout=out)
+        self.assertEqual(saved, [])
+
+        self.assertIn('Imported 30 of 31 trips', out.getvalue())
+        self.assertIn('Line 32:', out.getvalue())
+        self.assertEqual(Bus.objects.count(), 30)
+        for bus in Bus.objects.all():
+            self.assertEqual((bus.seats.count(), bus.free_seats), (bus.get_total_seats(), bus.get_total_seats()))
+        # Six coach sizes in the file, so six templates and no per-trip seats
+        self.assertEqual(SeatLayout.objects.count(), 6)
+        self.assertEqual(Seat.objects.count(), sum(
+            layout.seats.count() for layout in SeatLayout.objects.annotate(trips=Count('buses')).filter(trips__gt=0)
+        ))
+
+    def test_api_is_admin_only_and_accepts_jsonl(self):
+        client = APIClient()
+        client.force_authenticate(user=User.objects.create_user(username='rider'))
+        rows = list(csv.DictReader(StringIO(self.schedule(5))))
+        upload = SimpleUploadedFile('trips.jsonl', '\n'.join(json.dumps(row) for row in rows).encode())
+
+        response = client.post(reverse('import-schedule'), {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, 403)
+
+        client.force_authenticate(user=User.objects.create_superuser(username='ops'))
+        upload.seek(0)
+        response = client.post(reverse('import-schedule'), {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual((response.data['created'], len(response.data['errors'])), (5, 1))
+        self.assertEqual(Bus.objects.values('layout').distinct().count(), 5)
+
+    def test_api_rejects_a_file_that_is_not_utf8(self):
+        client = APIClient()
+        client.force_authenticate(user=User.objects.create_superuser(username='ops'))
+        upload = SimpleUploadedFile('trips.csv', self.schedule(2).encode('utf-16'))
+        response = client.post(reverse('import-schedule'), {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Bus.objects.exists())
+
+    def test_report_lists_a_bounded_number_of_invalid_rows(self):
+        rows = [(line, {'bus_number': 'BAD'}) for line in range(1, 252)]
+        report = import_buses(rows, batch_size=50)
+        self.assertEqual((report['rows'], report['invalid'], len(report['errors'])), (251, 251, 100))
+        self.assertEqual(report['errors'][-1]['line'], 100)
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class ReservationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='rider', password='secret123')
+        self.bus = create_bus(total_rows=4)
+        self.seats = list(self.bus.seats.order_by('seat_number'))
+
+    def test_overlapping_booking_is_rejected(self):
+        reserve_seats(self.user, self.bus, [self.seats[0].id, self.seats[1].id])
+        with self.assertRaisesMessage(ReservationError, 'Seat 2 is already booked'):
+            reserve_seats(self.user, self.bus, [self.seats[1].id, self.seats[2].id])
+
+    def test_released_seat_can_be_booked_again(self):
+        booking = reserve_seats(self.user, self.bus, [self.seats[0].id])
+        release_booking(booking)
+        reserve_seats(self.user, self.bus, [self.seats[0].id])
+        self.assertEqual(BookedSeat.objects.filter(seat=self.seats[0], is_active=True).count(), 1)
+
+    def test_database_rejects_second_active_seat(self):
+        booking = reserve_seats(self.user, self.bus, [self.seats[0].id])
+        other = Booking.objects.create(user=self.user, bus=self.bus, status='CONFIRMED', total_fare=Decimal('800'))
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            BookedSeat.objects.create(booking=other, bus=self.bus, seat=self.seats[0])
+        self.assertEqual(booking.booked_seats.count(), 1)
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class BookingWritePathTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='rider', password='secret123')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def book(self, bus, seats):
+        return self.client.post(reverse('book-seats'), {
+            'bus': bus.id,
+            'seat_ids': [seat.id for seat in seats],
+        }, format='json')
+
+    def test_booking_query_count_is_constant(self):
+        bus = create_bus(total_rows=10)
+        seats = list(bus.seats.order_by('seat_number'))
+
+        counts = []
+        for group in (seats[:1], seats[1:7]):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.book(bus, group)
+            self.assertEqual(response.status_code, 201, response.data)
+            counts.append(len(queries))
+
+        self.assertEqual(counts[0], counts[1])
+        self.assertLessEqual(counts[1], 10)
+        self.assertEqual(len(response.data['booked_seats']), 6)
+        self.assertEqual(response.data['total_fare'], '4500.00')
+
+    def test_booking_unknown_and_taken_seats(self):
+        bus = create_bus(total_rows=2)
+        # Same-sized buses share their seats, so take one from a different template
+        other = create_bus(total_rows=3)
+        seats = list(bus.seats.order_by('seat_number'))
+
+        response = self.book(bus, [seats[0], other.seats.first()])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('not found', str(response.data))
+
+        self.assertEqual(self.book(bus, seats[:2]).status_code, 201)
+        response = self.book(bus, seats[1:3])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Seat 2 is already booked', str(response.data))
+
+    def test_many_bookings_keep_to_a_fixed_number_of_queries(self):
+        bookings = 100
+        buses = [create_bus(total_rows=3, has_sleeper=False) for _ in range(bookings)]
+        groups = [list(bus.seats.all()[:6]) for bus in buses]
+
+        with CaptureQueriesContext(connection) as queries:
+            for bus, seats in zip(buses, groups):
+                reserve_seats(self.user, bus, [seat.id for seat in seats])
+
+        self.assertLessEqual(len(queries) / bookings, 8)
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class BenchFleetTests(TestCase):
+    def test_generated_fleet_is_reproducible_and_consistent(self):
+        fleet, users = generate_fleet(20, 5, occupancy=0.4, seed=7)
+        counted = Bus.objects.count_inventory()
+        for bus in fleet:
+            bus.refresh_from_db()
+            self.assertEqual({field: getattr(bus, field) for field in counted[bus.pk]}, counted[bus.pk])
+        doubled = BookedSeat.objects.filter(is_active=True).values('bus', 'seat').annotate(
+            holders=Count('id')
+        ).filter(holders__gt=1)
+        self.assertFalse(doubled.exists())
+
+        # The same seed books the same seats again
+        first = sorted(BookedSeat.objects.values_list('bus__bus_number', 'seat__seat_number'))
+        Bus.objects.all().delete()
+        User.objects.filter(username__startswith='bench').delete()
+        generate_fleet(20, 5, occupancy=0.4, seed=7)
+        self.assertEqual(sorted(BookedSeat.objects.values_list('bus__bus_number', 'seat__seat_number')), first)
+
+
+class BookingHistoryTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='rider', password='secret123')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.upcoming = create_bus(total_rows=20)
+        self.past = create_bus(total_rows=20, departure_time=timezone.now() - timedelta(days=3))
+        seats = {bus: list(bus.seats.order_by('seat_number')) for bus in (self.upcoming, self.past)}
+        self.bookings = [
+            confirm_seats(self.user, bus, seats[bus][i * 2:i * 2 + 2])
+            for i in range(12) for bus in (self.upcoming, self.past)
+        ]
+        Booking.objects.filter(pk=self.bookings[0].pk).update(status='CANCELLED')
+        confirm_seats(User.objects.create_user(username='other'), self.upcoming, seats[self.upcoming][30:32])
+
+    def test_query_count_is_constant_and_pages_walk_newest_first(self):
+        seen = []
+        url = reverse('my-bookings') + '?page_size=10'
+        while url:
+            # Bookings with their users, then every booked seat with its seat
+            with self.assertNumQueries(2):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            seen.extend(booking['id'] for booking in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(seen, [booking.id for booking in reversed(self.bookings)])
+        self.assertEqual(len(response.data['results'][-1]['booked_seats']), 2)
+
+    def test_filters_by_status_and_trip(self):
+        response = self.client.get(reverse('my-bookings'), {'status': 'CANCELLED'})
+        self.assertEqual([booking['id'] for booking in response.data['results']], [self.bookings[0].id])
+
+        response = self.client.get(reverse('my-bookings'), {'trips': 'past', 'page_size': 100})
+        self.assertEqual({booking['bus'] for booking in response.data['results']}, {self.past.id})
+        self.assertEqual(len(response.data['results']), 12)
+
+        response = self.client.get(reverse('my-bookings'), {'status': 'LOST'})
+        self.assertEqual(response.status_code, 400)
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(user=User.objects.create_user(username='rider'))
+        self.bus = create_bus(total_rows=3)
+        metrics.clear()
+
+    def test_requests_are_recorded_per_endpoint(self):
+        for _ in range(2):
+            self.client.get(reverse('bus-seats', args=[self.bus.id]))
+        self.client.get(reverse('bus-details', args=[self.bus.id]))
+
+        endpoints = metrics.snapshot()
+        seat_map = endpoints['GET bus-seats']
+        self.assertEqual(seat_map['total_ms']['count'], 2)
+        self.assertGreater(seat_map['queries']['max'], 0)
+        self.assertGreater(seat_map['serializer_ms']['max'], 0)
+        self.assertEqual(endpoints['GET bus-details']['queries']['max'], 1)
+
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 403)
+        self.client.force_authenticate(user=User.objects.create_superuser(username='ops'))
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.data['endpoints']['GET bus-seats']['total_ms']['count'], 2)
+        self.assertIn('hits', response.data['seat_map_cache'])
+
+    @override_settings(SLOW_REQUEST_MS=0)
+    def test_slow_log_names_repeated_queries(self):
+        # Serializing seats one at a time without their states is the N+1 this should expose
+        seats = list(self.bus.seats.order_by('seat_number'))
+        with self.assertLogs('api.metrics', 'WARNING') as logs, measure('seat loop'):
+            for seat in seats:
+                seat.fare = self.bus.seater_fare
+                SeatSerializer(seat, context={'bus': self.bus}).data
+        self.assertIn('Slow seat loop: ', logs.output[0])
+        # Two lookups per seat, one each for is_booked and is_held
+        self.assertIn(' x12  SELECT', logs.output[0])
+
+
+class TokenUserCacheTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='rider', password='secret123')
+        self.token = RefreshToken.for_user(self.user).access_token
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        token_user_cache.clear()
+
+    def user_lookups(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('get_user'))
+        return response, sum('"auth_user"' in query['sql'] for query in queries)
+
+    def test_repeat_requests_skip_the_user_query(self):
+        response, lookups = self.user_lookups()
+        self.assertEqual((response.status_code, lookups), (200, 1))
+        response, lookups = self.user_lookups()
+        self.assertEqual((response.status_code, lookups), (200, 0))
+        self.assertEqual(response.data['username'], 'rider')
+
+    def test_deactivation_and_password_change_take_effect_at_once(self):
+        self.user_lookups()
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get(reverse('get_user')).status_code, 401)
+
+        self.user.is_active = True
+        self.user.save()
+        self.user_lookups()
+        self.user.set_password('changed456')
+        self.user.save()
+        # Evicted, so the next request reads the user row again
+        response, lookups = self.user_lookups()
+        self.assertEqual((response.status_code, lookups), (200, 1))
+
+    def test_a_user_cached_again_before_the_save_commits_is_evicted_after(self):
+        stale = User.objects.get(pk=self.user.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+            # A concurrent request that still read the committed, active row
+            token_user_cache.put(str(self.user.pk), stale)
+            self.assertIsNotNone(token_user_cache.get(str(self.user.pk)))
+        self.assertIsNone(token_user_cache.get(str(self.user.pk)))
+        self.assertEqual(self.client.get(reverse('get_user')).status_code, 401)
+
+    def test_entries_expire_and_the_least_recently_used_go_first(self):
+        cache = TokenUserCache(max_entries=2, ttl=60)
+        users = [User(pk=pk, username=f'user{pk}') for pk in range(3)]
+        for user in users:
+            cache.put(str(user.pk), user)
+        self.assertIsNone(cache.get('0'))
+        self.assertEqual(cache.get('2').username, 'user2')
+        self.assertIsNot(cache.get('2'), users[2])
+
+        with mock.patch('api.cache.time.monotonic', return_value=time.monotonic() + 61):
+            self.assertIsNone(cache.get('1'))
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class SeatHoldTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='rider', password='secret123')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.bus = create_bus(total_rows=3)
+        self.seats = list(self.bus.seats.order_by('seat_number'))
+        seat_map_cache.clear()
+
+    def hold(self, seats, **extra):
+        return self.client.post(reverse('hold-seats'), {
+            'bus': self.bus.id,
+            'seat_ids': [seat.id for seat in seats],
+            **extra,
+        }, format='json')
+
+    def seat_map(self):
+        response = self.client.get(reverse('bus-seats', args=[self.bus.id]))
+        return {seat['seat_number']: (seat['is_booked'], seat['is_held']) for seat in response.json()}
+
+    def test_hold_blocks_seats_until_confirmed(self):
+        response = self.hold(self.seats[:2], hold_minutes=5)
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(response.data['status'], 'PENDING')
+        self.assertIsNotNone(response.data['expires_at'])
+        self.assertEqual(self.seat_map()[1], (True, True))
+
+        with self.assertRaises(ReservationError):
+            reserve_seats(self.user, self.bus, [self.seats[1].id])
+
+        response = self.client.post(reverse('confirm-booking', args=[response.data['id']]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['status'], 'CONFIRMED')
+        self.assertEqual(self.seat_map()[1], (True, False))
+
+    def test_expired_hold_cannot_be_confirmed(self):
+        booking = reserve_seats(self.user, self.bus, [self.seats[0].id], hold_for=timedelta(minutes=5))
+        Booking.objects.filter(pk=booking.pk).update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        response = self.client.post(reverse('confirm-booking', args=[booking.id]))
+        self.assertEqual(response.status_code, 400)
+
+    def test_sweeper_releases_expired_holds_and_notifies_each_bus_once(self):
+        other_bus = create_bus(total_rows=3)
+        expired = [
+            reserve_seats(self.user, self.bus, [self.seats[0].id], hold_for=timedelta(minutes=5)),
+            reserve_seats(self.user, self.bus, [self.seats[1].id], hold_for=timedelta(minutes=5)),
+            reserve_seats(self.user, other_bus, [other_bus.seats.first().id], hold_for=timedelta(minutes=5)),
+        ]
+        live = reserve_seats(self.user, self.bus, [self.seats[2].id], hold_for=timedelta(minutes=5))
+        Booking.objects.filter(pk__in=[b.pk for b in expired]).update(expires_at=timezone.now())
+
+        channel_layer = get_channel_layer()
+        channel = async_to_sync(channel_layer.new_channel)()
+        async_to_sync(channel_layer.group_add)(f"bus_{self.bus.id}", channel)
+
+        out = StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('release_expired_holds', '--batch-size', '1', stdout=out)
+
+        self.assertIn('Released 3 held seats on 2 buses', out.getvalue())
+        event = async_to_sync(channel_layer.receive)(channel)
+        self.assertEqual(event['type'], 'seat_update')
+        # Each batch moved the version; the one push accounts for both, so sockets see no gap
+        self.assertEqual(event['versions'], [event['version'] - 1, event['version']])
+        # Two expired holds on this bus, but only one push
+        self.assertNotIn(channel, channel_layer.channels)
+        self.assertEqual(
+            set(Booking.objects.values_list('status', flat=True).filter(pk__in=[b.pk for b in expired])),
+            {'CANCELLED'}
+        )
+        live.refresh_from_db()
+        self.assertEqual(live.status, 'PENDING')
+        self.bus.refresh_from_db()
+        self.assertEqual(self.bus.free_seats, 5)
+
+
+class FlakyChannelLayer:
+    # Fails the first group_send, then records every send
+    def __init__(self):
+        self.failed = False
+        self.sent = []
+
+    async def group_send(self, group, message):
+        if not self.failed:
+            self.failed = True
+            raise ConnectionError("channel layer unavailable")
+        self.sent.append((group, message))
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class SeatEventPublishingTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='rider')
+        self.bus = create_bus(total_rows=3)
+        self.seats = list(self.bus.seats.order_by('seat_number'))
+
+    def test_event_leaves_only_after_commit(self):
+        channel_layer = get_channel_layer()
+        channel = async_to_sync(channel_layer.new_channel)()
+        async_to_sync(channel_layer.group_add)(f"bus_{self.bus.id}", channel)
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            reserve_seats(self.user, self.bus, [self.seats[0].id])
+        self.assertNotIn(channel, channel_layer.channels)
+        for callback in callbacks:
+            callback()
+        self.assertEqual(async_to_sync(channel_layer.receive)(channel)['seats'][0]['id'], self.seats[0].id)
+
+        # A rolled-back booking never announces anything
+        with self.captureOnCommitCallbacks() as callbacks:
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                reserve_seats(self.user, self.bus, [self.seats[1].id])
+                raise RuntimeError
+        self.assertEqual(callbacks, [])
+
+    @override_settings(SEAT_EVENT_RETRY_DELAY_MS=1)
+    def test_dispatcher_batches_per_bus_and_retries(self):
+        channel_layer = FlakyChannelLayer()
+        dispatcher = SeatEventDispatcher()
+        with mock.patch('api.events.get_channel_layer', return_value=channel_layer), \
+                self.assertLogs('api.events', 'WARNING'):
+            dispatcher.enqueue(1, 5, [{'id': 10, 'is_booked': True, 'is_held': False}])
+            dispatcher.enqueue(2, 3, [{'id': 20, 'is_booked': True, 'is_held': False}])
+            dispatcher.enqueue(1, 6, [{'id': 10, 'is_booked': False, 'is_held': False}])
+            dispatcher.enqueue(1, 7, [{'id': 11, 'is_booked': True, 'is_held': True}])
+            self.assertTrue(dispatcher.flush(timeout=5))
+
+        sent = dict(channel_layer.sent)
+        self.assertEqual(set(sent), {'bus_1', 'bus_2'})
+        self.assertEqual((sent['bus_1']['version'], sent['bus_1']['versions']), (7, [5, 6, 7]))
+        self.assertEqual(
+            {seat['id']: seat['is_booked'] for seat in sent['bus_1']['seats']},
+            {10: False, 11: True}
+        )
+        self.assertEqual((dispatcher.sent, dispatcher.retried, dispatcher.dropped), (2, 1, 0))
+
+    def test_a_change_without_a_delta_turns_the_merged_event_into_a_snapshot(self):
+        seat = {'id': 10, 'is_booked': True, 'is_held': False}
+        merged = merge_seat_updates([(1, [5], [seat]), (1, [6], None), (1, [7], [seat])])
+        self.assertEqual((merged[1]['version'], merged[1]['versions'], merged[1]['seats']), (7, [5, 6, 7], None))
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class ReservationStressTests(TransactionTestCase):
+    threads = 8
+    attempts_per_thread = 250
+    hot_seats = 10
+
+    def test_concurrent_bookings_never_oversell(self):
+        bus = create_bus(total_rows=10)
+        users = [User.objects.create_user(username=f'rider{i}') for i in range(self.threads)]
+        hot_seat_ids = list(bus.seats.order_by('id').values_list('id', flat=True)[:self.hot_seats])
+        confirmed = []
+        oversold = []
+        done = threading.Event()
+
+        def rider(user, seed):
+            rng = random.Random(seed)
+            try:
+                for _ in range(self.attempts_per_thread):
+                    try:
+                        booking = reserve_seats(user, bus, rng.sample(hot_seat_ids, 2))
+                    except (ReservationError, OperationalError):
+                        continue
+                    confirmed.append(booking.id)
+                    # Hand the seats straight back so the other riders keep contending for them
+                    while True:
+                        try:
+                            release_booking(booking)
+                            break
+                        except OperationalError:
+                            continue
+            finally:
+                connection.close()
+
+        def auditor():
+            # Sample the live table for any seat held by two bookings at once
+            try:
+                while not done.is_set():
+                    try:
+                        oversold.extend(
+                            BookedSeat.objects.filter(is_active=True)
+                            .values('seat').annotate(holders=Count('id')).filter(holders__gt=1)
+                        )
+                    except OperationalError:
+                        pass
+            finally:
+                connection.close()
+
+        riders = [threading.Thread(target=rider, args=(user, i)) for i, user in enumerate(users)]
+        audit = threading.Thread(target=auditor)
+        audit.start()
+        for thread in riders:
+            thread.start()
+        for thread in riders:
+            thread.join()
+        done.set()
+        audit.join()
+
+        self.assertEqual(oversold, [])
+        self.assertGreater(len(confirmed), self.threads)
+        self.assertFalse(BookedSeat.objects.filter(is_active=True).exists())
+        bus.refresh_from_db()
+        self.assertEqual(bus.free_seats, bus.get_total_seats())
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS, SQLITE_SINGLE_WRITER=True)
+class SingleWriterTests(TransactionTestCase):
+    def test_queued_bookings_commit_together_and_fail_alone(self):
+        bus = create_bus(total_rows=3)
+        user = User.objects.create_user(username='rider')
+        seats = list(bus.seats.order_by('seat_number'))
+        reserve_seats(user, bus, [seats[0].id])
+        results = {}
+
+        def book(seat):
+            try:
+                results[seat.seat_number] = reserve_seats(user, bus, [seat.id]).status
+            except ReservationError as e:
+                results[seat.seat_number] = str(e)
+            finally:
+                connection.close()
+
+        # Hold the writer up so every booking below lands in the same batch
+        started, gate = threading.Event(), threading.Event()
+
+        def hold():
+            started.set()
+            gate.wait()
+
+        batches = write_queue.batches
+        blocker = threading.Thread(target=write_queue.run, args=(hold,))
+        blocker.start()
+        started.wait()
+        riders = [threading.Thread(target=book, args=(seat,)) for seat in seats]
+        for thread in riders:
+            thread.start()
+        while write_queue._queue.qsize() < len(seats):
+            time.sleep(0.01)
+        gate.set()
+        for thread in riders + [blocker]:
+            thread.join()
+
+        self.assertEqual(write_queue.batches - batches, 2)
+        self.assertEqual(results, {1: 'Seat 1 is already booked', **{n: 'CONFIRMED' for n in range(2, 7)}})
+        self.assertEqual(
+            Bus.objects.filter(pk=bus.pk).count_inventory()[bus.pk]['free_seats'],
+            Bus.objects.get(pk=bus.pk).free_seats
+        )
+        self.assertEqual(BookedSeat.objects.filter(bus=bus, is_active=True).count(), 6)
+
+    def test_a_batch_that_fails_to_commit_fails_its_callers(self):
+        bus = create_bus(total_rows=3)
+        user = User.objects.create_user(username='rider')
+        booking = reserve_seats(user, bus, [bus.seats.first().id])
+
+        # Only the first commit fails, so a replay of the write would get to run
+        wrapper = type(connections['default'])
+        commit = wrapper._commit
+        failures = [OperationalError('disk I/O error')]
+
+        def flaky_commit(self):
+            if failures:
+                raise failures.pop()
+            return commit(self)
+
+        with mock.patch.object(wrapper, '_commit', flaky_commit):
+            with self.assertRaisesMessage(OperationalError, 'disk I/O error'):
+                release_booking(booking)
+        self.assertEqual(Booking.objects.get(pk=booking.pk).status, 'CONFIRMED')
+
+        release_booking(Booking.objects.get(pk=booking.pk))
+        self.assertEqual(Booking.objects.get(pk=booking.pk).status, 'CANCELLED')
+        self.assertFalse(BookedSeat.objects.filter(bus=bus, is_active=True).exists())
+
+    def test_writes_inside_a_transaction_stay_on_the_callers_connection(self):
+        bus = create_bus(total_rows=3)
+        user = User.objects.create_user(username='rider')
+        writes = write_queue.writes
+        with transaction.atomic():
+            booking = reserve_seats(user, bus, [bus.seats.first().id])
+            release_booking(booking)
+        self.assertEqual(write_queue.writes, writes)
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class AsyncEndpointTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='rider', password='secret123')
+        self.auth = {'Authorization': f'Bearer {RefreshToken.for_user(self.user).access_token}'}
+        self.client = AsyncClient()
+        self.bus = create_bus(total_rows=3)
+        self.seats = list(self.bus.seats.order_by('seat_number'))
+        seat_map_cache.clear()
+
+    async def test_requires_a_valid_token(self):
+        response = await AsyncClient().get(reverse('async-bus-details', args=[self.bus.id]))
+        self.assertEqual(response.status_code, 401)
+        response = await AsyncClient().get(
+            reverse('async-bus-details', args=[self.bus.id]), headers={'Authorization': 'Bearer nonsense'}
+        )
+        self.assertEqual(response.status_code, 401)
+
+    async def test_read_endpoints_match_the_sync_ones(self):
+        sync_client = APIClient()
+        sync_client.force_authenticate(user=self.user)
+        for name, args in (('bus-details', [self.bus.id]), ('bus-seats', [self.bus.id]), ('all-buses', [])):
+            response = await self.client.get(reverse(f'async-{name}', args=args), headers=self.auth)
+            self.assertEqual(response.status_code, 200)
+            expected = await sync_to_async(sync_client.get)(reverse(name, args=args))
+            self.assertEqual(response.json(), expected.json())
+
+            cached = await self.client.get(
+                reverse(f'async-{name}', args=args), headers={**self.auth, 'If-None-Match': response['ETag']}
+            )
+            self.assertEqual(cached.status_code, 304)
+            self.assertEqual(cached['ETag'], response['ETag'])
+            self.assertEqual(cached['Cache-Control'], 'private, no-cache')
+
+    async def test_book_and_cancel(self):
+        channel_layer = get_channel_layer()
+        channel = await channel_layer.new_channel()
+        await channel_layer.group_add(f"bus_{self.bus.id}", channel)
+
+        response = await self.client.post(
+            reverse('async-book-seats'),
+            {'bus': self.bus.id, 'seat_ids': [self.seats[0].id, self.seats[1].id]},
+            content_type='application/json',
+            headers=self.auth
+        )
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(response.json()['total_fare'], '1500.00')
+        event = await channel_layer.receive(channel)
+        self.assertEqual([seat['id'] for seat in event['seats']], [self.seats[0].id, self.seats[1].id])
+
+        response = await self.client.post(
+            reverse('async-book-seats'),
+            {'bus': self.bus.id, 'seat_ids': [self.seats[1].id]},
+            content_type='application/json',
+            headers=self.auth
+        )
+        self.assertEqual(response.status_code, 400)
+
+        booking_id = (await Booking.objects.aget(user=self.user)).id
+        response = await self.client.post(reverse('async-cancel-booking', args=[booking_id]), headers=self.auth)
+        self.assertEqual(response.status_code, 200)
+        event = await channel_layer.receive(channel)
+        self.assertFalse(any(seat['is_booked'] for seat in event['seats']))
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class BusSeatConsumerTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='rider')
+        self.token = RefreshToken.for_user(self.user).access_token
+        self.bus = create_bus(total_rows=3)
+        self.seats = list(self.bus.seats.order_by('seat_number'))
+        seat_map_cache.clear()
+
+    async def connect(self, **kwargs):
+        communicator = WebsocketCommunicator(websocket_application, f'/ws/bus/{self.bus.id}/?token={self.token}', **kwargs)
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    def test_snapshot_then_deltas(self):
+        async def scenario():
+            communicator = await self.connect()
+            snapshot = await communicator.receive_json_from()
+            self.assertEqual(snapshot['type'], 'seat_status')
+            self.assertEqual(len(snapshot['seats']), 6)
+
+            booking = await database_sync_to_async(reserve_seats)(
+                self.user, self.bus, [self.seats[0].id, self.seats[1].id]
+            )
+            delta = await communicator.receive_json_from()
+            self.assertEqual(delta['type'], 'seat_delta')
+            self.assertEqual(delta['version'], snapshot['version'] + 1)
+            self.assertEqual(delta['seats'], [
+                {'id': self.seats[0].id, 'is_booked': True, 'is_held': False},
+                {'id': self.seats[1].id, 'is_booked': True, 'is_held': False},
+            ])
+
+            await database_sync_to_async(release_booking)(booking)
+            delta = await communicator.receive_json_from()
+            self.assertEqual(delta['version'], snapshot['version'] + 2)
+            self.assertFalse(any(seat['is_booked'] for seat in delta['seats']))
+
+            await communicator.send_json_to({'type': 'resync'})
+            snapshot = await communicator.receive_json_from()
+            self.assertEqual(snapshot['type'], 'seat_status')
+            self.assertEqual(snapshot['version'], delta['version'])
+            await communicator.disconnect()
+
+        metrics.clear()
+        async_to_sync(scenario)()
+        handlers = {endpoint: numbers['total_ms']['count'] for endpoint, numbers in metrics.snapshot().items()}
+        self.assertEqual(
+            {endpoint: count for endpoint, count in handlers.items() if endpoint.startswith('ws ')},
+            {'ws bus-seats connect': 1, 'ws bus-seats snapshot': 2, 'ws bus-seats push': 2,
+             'ws bus-seats receive': 1, 'ws bus-seats disconnect': 1}
+        )
+
+    def test_bitmap_subprotocol_gets_full_bitmaps(self):
+        async def scenario():
+            communicator = WebsocketCommunicator(
+                websocket_application,
+                f'/ws/bus/{self.bus.id}/?token={self.token}',
+                subprotocols=['seatmap.bitmap']
+            )
+            connected, subprotocol = await communicator.connect()
+            self.assertEqual((connected, subprotocol), (True, 'seatmap.bitmap'))
+            snapshot = await communicator.receive_json_from()
+            self.assertEqual(snapshot['type'], 'seat_bitmap')
+            self.assertEqual(decode_bitmap(snapshot['bitmap']['booked'], 6), [False] * 6)
+
+            await database_sync_to_async(reserve_seats)(self.user, self.bus, [self.seats[1].id])
+            update = await communicator.receive_json_from()
+            self.assertEqual(update['bitmap']['version'], snapshot['bitmap']['version'] + 1)
+            self.assertEqual(decode_bitmap(update['bitmap']['booked'], 6), [False, True] + [False] * 4)
+            await communicator.disconnect()
+
+        async_to_sync(scenario)()
+
+    @override_settings(WEBSOCKET_MAX_PER_USER=None)
+    def test_connection_storm_builds_the_snapshot_once(self):
+        async def scenario():
+            communicators = await asyncio.gather(*(self.connect() for _ in range(20)))
+            snapshots = await asyncio.gather(*(c.receive_json_from() for c in communicators))
+            self.assertEqual(len({json.dumps(s) for s in snapshots}), 1)
+            for communicator in communicators:
+                await communicator.disconnect()
+
+        with CaptureQueriesContext(connection) as build_queries:
+            build_seat_map(Bus.objects.get(pk=self.bus.pk))
+        seat_map_cache.clear()
+        with mock.patch('api.consumers.build_seat_map', wraps=build_seat_map) as build, \
+                CaptureQueriesContext(connection) as queries:
+            async_to_sync(scenario)()
+        self.assertEqual(build.call_count, 1)
+        # One build, plus a read of the bus's seat_version per connecting socket
+        self.assertEqual(len(queries), len(build_queries) + 20)
+
+    @override_settings(WEBSOCKET_MAX_PER_USER=None)
+    def test_pushed_snapshots_take_their_version_from_the_event(self):
+        async def scenario():
+            communicators = await asyncio.gather(*(
+                self.connect(subprotocols=['seatmap.bitmap']) for _ in range(10)
+            ))
+            for communicator in communicators:
+                await communicator.receive_json_from()
+
+            metrics.clear()
+            await database_sync_to_async(reserve_seats)(self.user, self.bus, [self.seats[0].id])
+            updates = await asyncio.gather(*(c.receive_json_from() for c in communicators))
+            self.assertEqual(len({json.dumps(update) for update in updates}), 1)
+            for communicator in communicators:
+                await communicator.disconnect()
+
+        async_to_sync(scenario)()
+        # Ten pushes, one bitmap build and no per-socket version reads
+        seat_map_cache.clear()
+        with CaptureQueriesContext(connection) as build_queries:
+            build_seat_bitmap(Bus.objects.get(pk=self.bus.pk))
+        snapshots = metrics.snapshot()['ws bus-seats snapshot']['queries']
+        self.assertEqual(snapshots['count'], 10)
+        self.assertEqual(round(snapshots['mean'] * snapshots['count']), len(build_queries))
+
+    def test_bus_edits_are_pushed_as_snapshots_without_a_version_gap(self):
+        async def scenario():
+            communicator = await self.connect()
+            snapshot = await communicator.receive_json_from()
+
+            bus = await database_sync_to_async(Bus.objects.get)(pk=self.bus.pk)
+            bus.lower_berth_fare = Decimal('999.00')
+            await database_sync_to_async(bus.save)()
+            edited = await communicator.receive_json_from()
+            self.assertEqual((edited['type'], edited['version']), ('seat_status', snapshot['version'] + 1))
+            self.assertIn('999.00', {seat['fare'] for seat in edited['seats']})
+
+            # Deltas carry on from the edit
+            await database_sync_to_async(reserve_seats)(self.user, self.bus, [self.seats[0].id])
+            delta = await communicator.receive_json_from()
+            self.assertEqual((delta['type'], delta['base_version']), ('seat_delta', edited['version']))
+            await communicator.disconnect()
+
+        async_to_sync(scenario)()
+
+    def test_a_failed_snapshot_closes_the_socket(self):
+        async def scenario():
+            communicator = await self.connect()
+            self.assertEqual(await communicator.receive_output(), {'type': 'websocket.close', 'code': 1011})
+            await communicator.disconnect()
+
+        with mock.patch.object(BusSeatConsumer, 'get_seat_status', side_effect=OperationalError('database is locked')), \
+                self.assertLogs('api.consumers', 'ERROR'):
+            async_to_sync(scenario)()
+        self.assertFalse(open_connections)
+
+    def test_snapshot_ignores_a_cached_map_another_process_made_stale(self):
+        # A REST poll cached the map, then a write elsewhere (another worker, the hold
+        # sweeper) changed the bus without any seat_update reaching this process
+        stale_version, _ = build_seat_map(Bus.objects.get(pk=self.bus.pk))
+        confirm_seats(self.user, self.bus, self.seats[:1])
+
+        async def scenario():
+            communicator = await self.connect()
+            snapshot = await communicator.receive_json_from()
+            self.assertEqual(snapshot['version'], stale_version + 1)
+            booked = {seat['id']: seat['is_booked'] for seat in snapshot['seats']}
+            self.assertTrue(booked[self.seats[0].id])
+            await communicator.disconnect()
+
+        async_to_sync(scenario)()
+
+    @override_settings(WEBSOCKET_MAX_PER_USER=2, WEBSOCKET_MAX_PER_BUS=3)
+    def test_admission_needs_a_token_and_respects_the_caps(self):
+        async def scenario():
+            for query in ('', '?token=nonsense'):
+                communicator = WebsocketCommunicator(websocket_application, f'/ws/bus/{self.bus.id}/{query}')
+                self.assertEqual(await communicator.connect(), (False, 4401))
+
+            first, second = await self.connect(), await self.connect()
+            refused = WebsocketCommunicator(websocket_application, f'/ws/bus/{self.bus.id}/?token={self.token}')
+            self.assertEqual(await refused.connect(), (False, 4429))
+
+            # Another user may still join, up to the bus limit; the header works as well as ?token=
+            other = await database_sync_to_async(User.objects.create_user)(username='other')
+            headers = [(b'authorization', f'Bearer {RefreshToken.for_user(other).access_token}'.encode())]
+            third = WebsocketCommunicator(websocket_application, f'/ws/bus/{self.bus.id}/', headers=headers)
+            self.assertTrue((await third.connect())[0])
+            fourth = WebsocketCommunicator(websocket_application, f'/ws/bus/{self.bus.id}/', headers=headers)
+            self.assertEqual(await fourth.connect(), (False, 4429))
+
+            await first.disconnect()
+            replacement = await self.connect()
+            for communicator in (second, third, replacement):
+                await communicator.disconnect()
+            self.assertEqual(open_connections, {})
+
+        async_to_sync(scenario)()
+
+    @override_settings(WEBSOCKET_SEND_QUEUE=2, SEAT_UPDATE_COALESCE_MS=0)
+    def test_slow_client_gets_the_latest_snapshot_instead_of_a_backlog(self):
+        send = BusSeatConsumer.send
+
+        async def scenario():
+            reading = asyncio.Event()
+
+            async def slow_send(consumer, *args, **kwargs):
+                await reading.wait()
+                await send(consumer, *args, **kwargs)
+
+            reading.set()
+            communicator = await self.connect()
+            base = (await communicator.receive_json_from())['version']
+            outbox_stats['dropped'] = 0
+
+            reading.clear()
+            with mock.patch.object(BusSeatConsumer, 'send', slow_send):
+                for seat in self.seats:
+                    await database_sync_to_async(reserve_seats)(self.user, self.bus, [seat.id])
+                    await asyncio.sleep(0.05)
+                reading.set()
+                messages = []
+                while not await communicator.receive_nothing(timeout=0.3):
+                    messages.append(await communicator.receive_json_from())
+            await communicator.disconnect()
+
+            self.assertLess(len(messages), len(self.seats))
+            self.assertGreater(outbox_stats['dropped'], 0)
+            self.assertEqual(messages[-1]['type'], 'seat_status')
+            self.assertEqual(messages[-1]['version'], base + len(self.seats))
+            self.assertTrue(all(seat['is_booked'] for seat in messages[-1]['seats']))
+
+        async_to_sync(scenario)()
+
+    def test_middleware_resolves_users_without_queries(self):
+        scope = {'type': 'websocket', 'query_string': f'token={self.token}'.encode()}
+        with self.assertNumQueries(0):
+            user = JWTAuthMiddleware(None).get_user(scope)
+        self.assertEqual((user.is_authenticated, str(user.id)), (True, str(self.user.id)))
+
+    def send_event(self, version, seat, is_booked=True):
+        return get_channel_layer().group_send(f"bus_{self.bus.id}", {
+            "type": "seat_update",
+            "bus_id": self.bus.id,
+            "version": version,
+            "seats": [{'id': seat.id, 'is_booked': is_booked, 'is_held': False}],
+        })
+
+    def test_burst_of_updates_is_coalesced_into_one_push(self):
+        async def scenario():
+            communicator = await self.connect()
+            base = (await communicator.receive_json_from())['version']
+            coalescing_stats.update(events_in=0, pushes_out=0)
+
+            # Ten changes inside the window; each seat flips back and forth
+            for step in range(1, 11):
+                await self.send_event(base + step, self.seats[step % 3], is_booked=step % 2 == 0)
+
+            delta = await communicator.receive_json_from()
+            self.assertEqual((delta['base_version'], delta['version']), (base, base + 10))
+            states = {seat['id']: seat['is_booked'] for seat in delta['seats']}
+            self.assertEqual(states, {self.seats[0].id: False, self.seats[1].id: True, self.seats[2].id: True})
+            self.assertTrue(await communicator.receive_nothing(timeout=0.3))
+            self.assertEqual(coalescing_stats, {'events_in': 10, 'pushes_out': 1})
+            await communicator.disconnect()
+
+        async_to_sync(scenario)()
+
+    def test_missing_version_triggers_a_full_snapshot(self):
+        async def scenario():
+            communicator = await self.connect()
+            base = (await communicator.receive_json_from())['version']
+
+            await self.send_event(base + 1, self.seats[0])
+            await self.send_event(base + 3, self.seats[1])
+
+            message = await communicator.receive_json_from()
+            self.assertEqual(message['type'], 'seat_status')
+            await communicator.disconnect()
+
+        async_to_sync(scenario)()
 
-# Create your tests here.
@@ -1,5 +1,5 @@
 from django.urls import path
-from . import views
+from . import async_views, views
 
 urlpatterns = [
     
@@ -7,9 +7,24 @@ urlpatterns = [
     path('register/', views.register, name='register'),
     path('login/', views.login, name='login'),
     path('buses/', views.get_all_buses, name='all-buses'),
+    path('buses/search/', views.search_buses, name='bus-search'),
+    path('journeys/', views.search_journeys, name='journey-search'),
+    path('buses/import/', views.import_schedule, name='import-schedule'),
     path('buses/<int:bus_id>/', views.get_bus_details, name='bus-details'),
     path('buses/<int:bus_id>/seats/', views.get_bus_seats, name='bus-seats'),
+    path('buses/<int:bus_id>/layout/', views.get_bus_layout, name='bus-layout'),
+    path('layouts/<int:layout_id>/', views.get_layout_template, name='layout-template'),
     path('bookings/', views.book_seats, name='book-seats'),
+    path('bookings/hold/', views.hold_seats, name='hold-seats'),
+    path('bookings/confirm/<int:booking_id>/', views.confirm_booking, name='confirm-booking'),
     path('bookings/cancel/<int:booking_id>/', views.cancel_booking, name='cancel-booking'),
     path('my-bookings/', views.my_bookings, name='my-bookings'),
+    path('metrics/', views.get_metrics, name='metrics'),
+    
+    # Async versions of the hot paths, for deployments served over ASGI
+    path('async/buses/', async_views.get_all_buses, name='async-all-buses'),
+    path('async/buses/<int:bus_id>/', async_views.get_bus_details, name='async-bus-details'),
+    path('async/buses/<int:bus_id>/seats/', async_views.get_bus_seats, name='async-bus-seats'),
+    path('async/bookings/', async_views.book_seats, name='async-book-seats'),
+    path('async/bookings/cancel/<int:booking_id>/', async_views.cancel_booking, name='async-cancel-booking'),
 ]
\ No newline at end of file
@@ -1,15 +1,25 @@
 
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.permissions import IsAdminUser, IsAuthenticated, AllowAny
 from rest_framework import status
-from django.db import transaction
-from .models import Bus, Seat, Booking, BookedSeat
-from .serializers import BusSerializer, RegisterSerializer, SeatSerializer, BookingSerializer, UserSerializer
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
+from .cache import ENCODINGS, seat_map_cache
+from .conditional import bus_etag, layout_cache_control, layout_etag, listing_etag, not_modified, tag_response, template_etag
+from .consumers import coalescing_stats
+from .events import seat_event_dispatcher
+from .imports import import_buses, import_format, read_rows
+from .journeys import connection_graph, plan_journeys
+from .metrics import metrics
+from .models import Bus, Schedule, Seat, SeatLayout, Booking, BookedSeat
+from .pagination import BookingCursorPagination, BusCursorPagination
+from .reservations import AlreadyCancelled, HoldExpired, confirm_hold, release_booking
+from .schedules import materialise_for_search, materialise_trips
+from .serializers import BookingHistorySerializer, BusSerializer, BusSearchSerializer, JourneySearchSerializer, RegisterSerializer, BookingSerializer, SeatHoldSerializer, UserSerializer, get_seat_map, serialize_journey, serialize_layout_template, serialize_seat_layout
 from rest_framework_simplejwt.tokens import RefreshToken
 from django.contrib.auth import authenticate
+from django.http import HttpResponse
+from django.utils import timezone
+import io
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
@@ -59,27 +69,135 @@ def get_user(request):
 @api_view(['GET'])
 def get_all_buses(request):
     buses = Bus.objects.all()
-    serializer = BusSerializer(buses, many=True)
-    return Response(serializer.data)
+    paginator = BusCursorPagination()
+    page = paginator.paginate_queryset(buses, request)
+    etag = listing_etag(paginator, page)
+    response = not_modified(request, etag)
+    if response is not None:
+        return tag_response(response, etag)
+    serializer = BusSerializer(page, many=True)
+    return tag_response(paginator.get_paginated_response(serializer.data), etag)
+
+@api_view(['GET'])
+def search_buses(request):
+    search = BusSearchSerializer(data=request.query_params)
+    if not search.is_valid():
+        return Response(search.errors, status=status.HTTP_400_BAD_REQUEST)
+    
+    # Trips of recurring schedules are created the first time a search covers their day
+    data = search.validated_data
+    materialise_for_search(data['source'], data['destination'], data.get('departure_after'), data.get('departure_before'))
+    buses = Bus.objects.search(**data)
+    paginator = BusCursorPagination()
+    page = paginator.paginate_queryset(buses, request)
+    serializer = BusSerializer(page, many=True)
+    return paginator.get_paginated_response(serializer.data)
+
+@api_view(['GET'])
+def search_journeys(request):
+    search = JourneySearchSerializer(data=request.query_params)
+    if not search.is_valid():
+        return Response(search.errors, status=status.HTTP_400_BAD_REQUEST)
+    
+    # Connections can run on any route, so every schedule's trips in the window come first
+    data = search.validated_data
+    materialise_trips(
+        Schedule.objects.all(),
+        timezone.localdate(data['departure_after']),
+        timezone.localdate(data['departure_before'] + data['max_duration'])
+    )
+    journeys = plan_journeys(**data)
+    return Response({'results': [serialize_journey(legs) for legs in journeys]})
 
 @api_view(['GET'])
 def get_bus_details(request, bus_id):
     try:
         bus = Bus.objects.get(id=bus_id)
-        serializer = BusSerializer(bus)
-        return Response(serializer.data)
     except Bus.DoesNotExist:
         return Response({"error": "Bus not found"}, status=status.HTTP_404_NOT_FOUND)
+    
+    etag = bus_etag('bus', bus)
+    response = not_modified(request, etag)
+    if response is not None:
+        return tag_response(response, etag)
+    serializer = BusSerializer(bus)
+    return tag_response(Response(serializer.data), etag)
 
 @api_view(['GET'])
 def get_bus_seats(request, bus_id):
     try:
-        seats = Seat.objects.filter(bus_id=bus_id)
-        serializer = SeatSerializer(seats, many=True)
-        return Response(serializer.data)
+        bus = Bus.objects.get(id=bus_id)
+    except Bus.DoesNotExist:
+        return Response({"error": "Bus not found"}, status=status.HTTP_404_NOT_FOUND)
+    
+    # ?encoding=bitmap returns booked/held bitmaps over the layout from get_bus_layout
+    encoding = request.query_params.get('encoding', 'json')
+    if encoding not in ENCODINGS:
+        return Response({"error": f"Unknown encoding '{encoding}'"}, status=status.HTTP_400_BAD_REQUEST)
+    
+    # Polling clients that already hold this version get a 304 without a seat query
+    etag = bus_etag('seats', bus, encoding)
+    response = not_modified(request, etag)
+    if response is not None:
+        return tag_response(response, etag)
+    
+    try:
+        # Pre-rendered payload shared with BusSeatConsumer; rebuilt only after a seat change
+        _, payload = get_seat_map(bus, encoding)
+        return tag_response(HttpResponse(payload, content_type='application/json'), etag)
     except:
         return Response({"error": "Error fetching seats"}, status=status.HTTP_400_BAD_REQUEST)
 
+@api_view(['GET'])
+def get_bus_layout(request, bus_id):
+    try:
+        bus = Bus.objects.select_related('layout').get(id=bus_id)
+    except Bus.DoesNotExist:
+        return Response({"error": "Bus not found"}, status=status.HTTP_404_NOT_FOUND)
+    
+    etag = layout_etag(bus)
+    response = not_modified(request, etag)
+    if response is None:
+        response = Response(serialize_seat_layout(bus))
+    # The layout only changes when the bus is edited, so clients may reuse it for a while
+    return tag_response(response, etag, layout_cache_control())
+
+@api_view(['GET'])
+def get_layout_template(request, layout_id):
+    try:
+        layout = SeatLayout.objects.get(id=layout_id)
+    except SeatLayout.DoesNotExist:
+        return Response({"error": "Layout not found"}, status=status.HTTP_404_NOT_FOUND)
+    
+    # Shared by every trip on this coach, so clients fetch it once per template
+    etag = template_etag(layout)
+    response = not_modified(request, etag)
+    if response is None:
+        response = Response(serialize_layout_template(layout))
+    return tag_response(response, etag, layout_cache_control())
+
+@api_view(['POST'])
+@permission_classes([IsAdminUser])
+def import_schedule(request):
+    # multipart upload of a .csv or .jsonl schedule; streamed, never read whole into memory
+    upload = request.FILES.get('file')
+    if upload is None:
+        return Response({"error": "Upload the schedule as 'file'"}, status=status.HTTP_400_BAD_REQUEST)
+    fmt = import_format(upload.name)
+    if fmt is None:
+        return Response({"error": "Schedule must be a .csv or .jsonl file"}, status=status.HTTP_400_BAD_REQUEST)
+    
+    lines = io.TextIOWrapper(upload.file, encoding='utf-8', newline='')
+    try:
+        report = import_buses(read_rows(lines, fmt), dry_run=request.query_params.get('dry_run') == 'true')
+    except UnicodeDecodeError:
+        # Batches before the bad bytes are already committed, unless this was a dry run
+        return Response(
+            {"error": "Schedule must be UTF-8 text; trips read before the invalid bytes may have been imported"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    return Response(report, status=status.HTTP_201_CREATED if report['created'] else status.HTTP_200_OK)
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def book_seats(request):
@@ -87,19 +205,24 @@ def book_seats(request):
     
     if serializer.is_valid():
         try:
-            # Create booking
-            booking = serializer.save()
+            # Create booking; the reservation engine pushes the seat delta
+            serializer.save()
             
-            # Send real-time update via WebSocket
-            bus_id = booking.bus.id
-            channel_layer = get_channel_layer()
-            async_to_sync(channel_layer.group_send)(
-                f"bus_{bus_id}",
-                {
-                    "type": "seat_update",
-                    "bus_id": bus_id,
-                }
-            )
+            return Response(serializer.data, status=status.HTTP_201_CREATED)
+        except Exception as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    
+    return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def hold_seats(request):
+    serializer = SeatHoldSerializer(data=request.data, context={'request': request})
+    
+    if serializer.is_valid():
+        try:
+            # Create PENDING booking that holds the seats until it expires
+            serializer.save()
             
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         except Exception as e:
@@ -107,6 +230,22 @@ def book_seats(request):
     
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def confirm_booking(request, booking_id):
+    try:
+        booking = Booking.objects.get(id=booking_id, user=request.user)
+    except Booking.DoesNotExist:
+        return Response({"error": "Booking not found"}, status=status.HTTP_404_NOT_FOUND)
+    
+    try:
+        confirm_hold(booking)
+    except HoldExpired as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    
+    serializer = BookingSerializer(booking)
+    return Response(serializer.data, status=status.HTTP_200_OK)
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def cancel_booking(request, booking_id):
@@ -118,28 +257,43 @@ def cancel_booking(request, booking_id):
     if booking.status == 'CANCELLED':
         return Response({"error": "Booking is already cancelled"}, status=status.HTTP_400_BAD_REQUEST)
     
-    # Cancel booking
-    with transaction.atomic():
-        booking.status = 'CANCELLED'
-        booking.save()
-        
-        # Send real-time update via WebSocket
-        bus_id = booking.bus.id
-        channel_layer = get_channel_layer()
-        async_to_sync(channel_layer.group_send)(
-            f"bus_{bus_id}",
-            {
-                "type": "seat_update",
-                "bus_id": bus_id,
-            }
-        )
+    # Cancel booking; the reservation engine pushes the seat delta
+    try:
+        release_booking(booking)
+    except AlreadyCancelled as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
     
     return Response({"message": "Booking cancelled successfully"}, status=status.HTTP_200_OK)
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def my_bookings(request):
-    bookings = Booking.objects.filter(user=request.user)
-    serializer = BookingSerializer(bookings, many=True)
-    return Response(serializer.data)
+    filters = BookingHistorySerializer(data=request.query_params)
+    if not filters.is_valid():
+        return Response(filters.errors, status=status.HTTP_400_BAD_REQUEST)
+    
+    bookings = Booking.objects.history(request.user, **filters.validated_data)
+    paginator = BookingCursorPagination()
+    page = paginator.paginate_queryset(bookings, request)
+    serializer = BookingSerializer(page, many=True)
+    return paginator.get_paginated_response(serializer.data)
 
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def get_metrics(request):
+    # Figures for this process since it started; each worker keeps its own
+    return Response({
+        'endpoints': metrics.snapshot(),
+        'seat_map_cache': {
+            'hits': seat_map_cache.hits,
+            'misses': seat_map_cache.misses,
+            'bytes': seat_map_cache.size,
+        },
+        'seat_events': {
+            'sent': seat_event_dispatcher.sent,
+            'retried': seat_event_dispatcher.retried,
+            'dropped': seat_event_dispatcher.dropped,
+        },
+        'seat_update_coalescing': coalescing_stats,
+        'connection_graph': {'trips': len(connection_graph)},
+    })
@@ -0,0 +1,90 @@
+import contextvars
+import functools
+import logging
+import queue
+import threading
+from concurrent.futures import Future
+from django.conf import settings
+from django.db import connection, transaction
+
+logger = logging.getLogger(__name__)
+
+class WriteQueue:
+    # With SQLITE_SINGLE_WRITER on, booking and cancel writes run on one background
+    # thread instead of the request threads, so SQLite never sees two writers from this
+    # process. Whatever has queued up while the previous batch committed goes into the
+    # next transaction together (up to SINGLE_WRITER_BATCH), each write in a savepoint
+    # of its own so a failed one leaves the rest alone. Callers block until their write
+    # has committed and its on_commit callbacks have run, so they see the same result
+    # (or exception) as when calling the function directly; if the batch as a whole
+    # fails to commit, every write in it fails with that error.
+
+    def __init__(self):
+        self.batches = 0
+        self.writes = 0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def run(self, func, *args, **kwargs):
+        # Inside a transaction the write has to stay on the caller's connection
+        if not settings.SQLITE_SINGLE_WRITER or connection.in_atomic_block:
+            return func(*args, **kwargs)
+        self._start()
+        future = Future()
+        # The caller's context, so its queries still count towards its request metrics
+        self._queue.put((contextvars.copy_context(), func, args, kwargs, future))
+        return future.result()
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='single-writer', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            jobs = [self._queue.get()]
+            while len(jobs) < settings.SINGLE_WRITER_BATCH:
+                try:
+                    jobs.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                outcomes = self._commit(jobs)
+            except Exception as e:
+                # The batch itself failed to commit. Its writes are not replayed, since the
+                # first run may already have changed the objects they were given (as
+                # release_booking does to booking.status); every caller gets the error
+                logger.warning("Single-writer batch of %d failed to commit", len(jobs), exc_info=True)
+                outcomes = [(None, e)] * len(jobs)
+            self.batches += 1
+            self.writes += len(jobs)
+            for (_, _, _, _, future), (result, error) in zip(jobs, outcomes):
+                if error is None:
+                    future.set_result(result)
+                else:
+                    future.set_exception(error)
+
+    def _commit(self, jobs):
+        outcomes = []
+        with transaction.atomic():
+            for context, func, args, kwargs, _ in jobs:
+                outcomes.append(context.run(self._call, func, args, kwargs))
+        return outcomes
+
+    def _call(self, func, args, kwargs):
+        try:
+            with transaction.atomic():
+                return func(*args, **kwargs), None
+        except Exception as e:
+            return None, e
+
+write_queue = WriteQueue()
+
+def single_writer(func):
+    # Marks a write that goes through write_queue when SQLITE_SINGLE_WRITER is on
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        return write_queue.run(func, *args, **kwargs)
+    return wrapper
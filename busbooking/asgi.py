@@ -17,18 +17,15 @@ https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 
 import os
 from django.core.asgi import get_asgi_application
-from channels.routing import ProtocolTypeRouter, URLRouter
-from channels.auth import AuthMiddlewareStack
-from django.urls import path
-from api.consumers import BusSeatConsumer
+from channels.routing import ProtocolTypeRouter
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'busbooking.settings')
+django_application = get_asgi_application()
+
+# Needs the app registry loaded by get_asgi_application()
+from api.routing import websocket_application
 
 application = ProtocolTypeRouter({
-    "http": get_asgi_application(),
-    "websocket": AuthMiddlewareStack(
-        URLRouter([
-            path('ws/bus/<int:bus_id>/', BusSeatConsumer.as_asgi()),
-        ])
-    ),
+    "http": django_application,
+    "websocket": websocket_application,
 })
\ No newline at end of file
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from datetime import timedelta
 from pathlib import Path
 
@@ -49,6 +50,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.metrics.InstrumentationMiddleware',  # Per-endpoint timings, served at /api/metrics/
     'corsheaders.middleware.CorsMiddleware',  # CORS middleware
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -79,15 +81,62 @@ TEMPLATES = [
 WSGI_APPLICATION = 'busbooking.wsgi.application'
 ASGI_APPLICATION = 'busbooking.asgi.application'
 
-# Channel layers for WebSockets
-CHANNEL_LAYERS = {
-    'default': {
+# Channel layers for WebSockets. Redis is the default: seat updates are also published
+# from outside the web process (manage.py release_expired_holds, other nodes), and only
+# a shared layer gets those to the sockets. A single-process install that publishes
+# nothing out of process can set CHANNEL_LAYER_BACKEND=memory (the test suite uses the
+# in-memory layer too). Compare them with manage.py bench_fanout.
+CHANNEL_LAYER_BACKENDS = {
+    'memory': {
+        'BACKEND': 'channels.layers.InMemoryChannelLayer',
+    },
+    'redis': {
         'BACKEND': 'channels_redis.core.RedisChannelLayer',
         'CONFIG': {
-            'hosts': [('127.0.0.1', 6379)],
+            'hosts': [(os.environ.get('REDIS_HOST', '127.0.0.1'), int(os.environ.get('REDIS_PORT', 6379)))],
         },
     },
 }
+CHANNEL_LAYER_BACKEND = os.environ.get('CHANNEL_LAYER_BACKEND', 'redis')
+CHANNEL_LAYERS = {
+    'default': CHANNEL_LAYER_BACKENDS[CHANNEL_LAYER_BACKEND],
+}
+
+# Seat holds: how long a PENDING booking keeps its seats before the sweeper releases them
+SEAT_HOLD_MINUTES = 10
+SEAT_HOLD_MAX_MINUTES = 30
+
+# Upper bound on memory used by the shared per-bus seat-map cache (api/cache.py)
+SEAT_MAP_CACHE_MAX_BYTES = 8 * 1024 * 1024
+
+# Seat changes on one bus inside this window reach each WebSocket client as a single push
+SEAT_UPDATE_COALESCE_MS = 100
+
+# WebSocket admission (api/consumers.py): sockets open at once in one process per bus
+# and per user (None for no limit), and messages queued for a slow client before its
+# backlog is replaced with a single fresh snapshot
+WEBSOCKET_MAX_PER_BUS = 5000
+WEBSOCKET_MAX_PER_USER = 10
+WEBSOCKET_SEND_QUEUE = 32
+
+# How long clients may reuse a bus's static seat layout before revalidating its ETag
+BUS_LAYOUT_MAX_AGE = 60 * 60
+
+# Seat events are sent after commit by a background dispatcher (api/events.py) that
+# batches them per bus and retries a failed channel-layer send with backoff
+SEAT_EVENTS_IN_BACKGROUND = True
+SEAT_EVENT_BATCH_MS = 20
+SEAT_EVENT_MAX_ATTEMPTS = 5
+SEAT_EVENT_RETRY_DELAY_MS = 50
+
+# Recurring schedules (api/schedules.py): dated trips are created on demand by searches up
+# to SCHEDULE_BOOKING_DAYS ahead, and materialise_trips keeps the next SCHEDULE_HORIZON_DAYS filled
+SCHEDULE_BOOKING_DAYS = 90
+SCHEDULE_HORIZON_DAYS = 14
+
+# Requests and consumer handlers slower than this are logged with their slowest and most
+# repeated SQL (api/metrics.py); None turns the log off
+SLOW_REQUEST_MS = 500
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
@@ -99,10 +148,27 @@ DATABASES = {
     }
 }
 
+# Opt-in mode for small depots on SQLite (SQLITE_SINGLE_WRITER=1): WAL so reads never
+# wait on the writer, a busy timeout and IMMEDIATE transactions so writers queue up
+# instead of failing with "database is locked", and booking and cancel writes funnelled
+# through one in-process writer thread that commits them in batches (api/writer.py).
+# Seat events then leave from that thread, so pair it with the redis channel layer
+SQLITE_SINGLE_WRITER = os.environ.get('SQLITE_SINGLE_WRITER') == '1'
+SQLITE_WAL_OPTIONS = {
+    'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL',
+    'timeout': 20,
+    'transaction_mode': 'IMMEDIATE',
+}
+if SQLITE_SINGLE_WRITER:
+    DATABASES['default']['OPTIONS'] = SQLITE_WAL_OPTIONS
+
+# Most writes the single writer commits in one transaction
+SINGLE_WRITER_BATCH = 50
+
 # REST Framework settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'api.authentication.CachedJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
@@ -125,6 +191,12 @@ SIMPLE_JWT = {
     'TOKEN_TYPE_CLAIM': 'token_type',
 }
 
+# Users resolved from access tokens are cached in-process (api/cache.py). Other
+# processes only see a deactivation or password change once their entry expires, so
+# the TTL (seconds) bounds how long a disabled account keeps access there
+TOKEN_USER_CACHE_MAX_ENTRIES = 10000
+TOKEN_USER_CACHE_TTL = int(os.environ.get('TOKEN_USER_CACHE_TTL', 60))
+
 # CORS settings
 CORS_ALLOW_ALL_ORIGINS = True  # For development only, configure for production
 CORS_ALLOW_CREDENTIALS = True